@@ -0,0 +1,129 @@
+"""
+Замер рассылки одного сообщения всем подключённым клиентам (например, сообщения 205).
+В одном процессе создаются пары сокетов socketpair, серверные концы регистрируются
+в сервере (Server) как авторизованные соединения. Сравниваются рассылка ServerCore.broadcast
+(сообщение кодируется один раз) и отправка сообщения каждому клиенту по отдельности.
+Каждый клиент - два файловых дескриптора, лимит открытых файлов поднимается до максимального.
+Запуск из каталога приложения:
+
+    python -m benchmarks.broadcast --clients 5000 --rounds 20
+"""
+
+
+import argparse
+import os
+import socket
+import tempfile
+import time
+
+import common.variables as vrs
+from benchmarks.harness import raise_files_limit, free_port, latency_report, quiet_server_log
+from common.wire_codecs import CODECS
+from server.connection_class import ClientConnection
+from server.server_class import Server, NewConnection
+
+
+def connect_clients(server, count, codec):
+    """
+    Функция подключения клиентов к серверу через пары сокетов
+    :return: список клиентских сокетов
+    """
+    client_socks = []
+    for number in range(count):
+        client_sock, server_sock = socket.socketpair()
+        server_sock.setblocking(False)
+        client_sock.setblocking(False)
+        connection = ClientConnection(server_sock)
+        connection.buffer.framed = True
+        connection.buffer.codec = codec
+        connection.auth_state = vrs.AUTH_DONE
+        server.clients_names[f'user{number}'] = connection
+        server.clients_list.append(connection)
+        client_socks.append(client_sock)
+    return client_socks
+
+
+def drain(client_socks):
+    """
+    Функция чтения всех данных, полученных клиентами
+    :return: количество принятых байт
+    """
+    received = 0
+    for sock in client_socks:
+        while True:
+            try:
+                data = sock.recv(vrs.MAX_PACKAGE_LENGTH)
+            except BlockingIOError:
+                break
+            received += len(data)
+    return received
+
+
+def send_each(server, message):
+    """
+    Функция отправки сообщения каждому клиенту по отдельности (сообщение кодируется для каждого клиента)
+    """
+    for client in list(server.clients_names.values()):
+        server.send_to_client(client, dict(message))
+
+
+def send_broadcast(server, message):
+    """
+    Функция рассылки сообщения всем клиентам через ServerCore.broadcast
+    """
+    server.broadcast(message, server.clients_names.values())
+
+
+def measure(server, client_socks, send, message, rounds):
+    """
+    Функция замера рассылки
+    :return: список времени рассылки (в секундах) и общее количество принятых клиентами байт
+    """
+    times, received = [], 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        send(server, message)
+        times.append(time.perf_counter() - started)
+        received += drain(client_socks)
+    return times, received
+
+
+def get_params():
+    """
+    Функция получения параметров замера из командной строки
+    """
+    parser = argparse.ArgumentParser(description='Замер рассылки сообщения всем клиентам')
+    parser.add_argument('--clients', type=int, default=5000, help='количество клиентов')
+    parser.add_argument('--rounds', type=int, default=20, help='количество рассылок')
+    parser.add_argument('--codec', choices=list(CODECS), default=vrs.CODEC_JSON, help='кодек соединений')
+    parser.add_argument('--added', type=int, default=1, help='количество имён в изменениях списка пользователей')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Основная функция замера
+    """
+    params = get_params()
+    raise_files_limit()
+    quiet_server_log()
+    db_path = os.path.join(tempfile.mkdtemp(), 'server_base.db3')
+    server = Server(free_port(), '127.0.0.1', db_path, NewConnection(), {'backend': 'memory'})
+    client_socks = connect_clients(server, params.clients, CODECS[params.codec])
+    message = {
+        vrs.RESPONSE: 205,
+        vrs.USERS_VERSION: 1,
+        vrs.USERS_ADDED: [f'new_user{number}' for number in range(params.added)],
+        vrs.USERS_REMOVED: [],
+    }
+    print(f'Клиентов: {params.clients}, кодек: {params.codec}, рассылок: {params.rounds}')
+    for title, send in (('По отдельности', send_each), ('broadcast', send_broadcast)):
+        times, received = measure(server, client_socks, send, message, params.rounds)
+        print(latency_report(f'{title}: время рассылки', times))
+        print(f'  на одного получателя, мкс: {sum(times) / len(times) / params.clients * 1e6:.2f}, '
+              f'принято байт: {received}')
+    server.database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Замер стоимости кодирования и декодирования сообщений JIM разными кодеками (common.wire_codecs).
+Набор сообщений повторяет реальный обмен: presence с публичным ключом, сообщение с зашифрованным
+текстом (RSA 2048 - 256 байт), ответы со списками пользователей и контактов, сообщение 205 с изменениями.
+Для каждого кодека выводятся размер кадра и время кодирования и декодирования одного сообщения.
+Кодек msgpack замеряется, если установлен пакет msgpack. Запуск из каталога приложения:
+
+    python -m benchmarks.codec_cost -n 20000 --users 1000
+"""
+
+
+import argparse
+import base64
+import os
+import textwrap
+import time
+
+import common.variables as vrs
+from common.utils import encode_message, decode_message, FRAME_HEADER_LENGTH
+from common.wire_codecs import CODECS
+
+
+def make_pubkey():
+    """
+    Функция создания строки, по размеру и виду соответствующей публичному ключу RSA 2048 в формате PEM
+    """
+    body = '\n'.join(textwrap.wrap(base64.b64encode(os.urandom(294)).decode('ascii'), 64))
+    return f'-----BEGIN PUBLIC KEY-----\n{body}\n-----END PUBLIC KEY-----'
+
+
+def make_messages(users):
+    """
+    Функция подготовки набора сообщений для замера
+    :param users: количество пользователей в ответе на запрос списка пользователей
+    :return: список пар (название, сообщение)
+    """
+    names = [f'user{number}' for number in range(users)]
+    return [
+        ('presence', {
+            vrs.ACTION: vrs.PRESENCE,
+            vrs.TIME: time.time(),
+            vrs.PORT: vrs.DEFAULT_PORT,
+            vrs.USER: {vrs.ACCOUNT_NAME: 'user1', vrs.PUBLIC_KEY: make_pubkey()},
+            vrs.FRAMING: vrs.FRAMING_LENGTH_PREFIX,
+            vrs.CODECS: list(CODECS),
+        }),
+        ('message', {
+            vrs.ACTION: vrs.MESSAGE,
+            vrs.TIME: time.time(),
+            vrs.PORT: 50123,
+            vrs.REQUEST_ID: 42,
+            vrs.SENDER: 'user1',
+            vrs.DESTINATION: 'user2',
+            vrs.MESSAGE_TEXT: os.urandom(256),
+        }),
+        ('200', {vrs.RESPONSE: 200, vrs.REQUEST_ID: 42}),
+        ('202 contacts', {vrs.RESPONSE: 202, vrs.LIST_INFO: names[:20], vrs.REQUEST_ID: 43}),
+        (f'202 users ({users})', {vrs.RESPONSE: 202, vrs.LIST_INFO: names, vrs.USERS_VERSION: 7,
+                                  vrs.REQUEST_ID: 44}),
+        ('205 delta', {vrs.RESPONSE: 205, vrs.USERS_VERSION: 8, vrs.USERS_ADDED: ['user_new'],
+                       vrs.USERS_REMOVED: []}),
+    ]
+
+
+def measure(codec, message, iterations):
+    """
+    Функция замера одного сообщения одним кодеком (кадровый режим, как при обмене с сервером)
+    :return: размер кадра в байтах, время кодирования и декодирования одного сообщения в микросекундах
+    """
+    frame = encode_message(message, True, codec)
+    body = frame[FRAME_HEADER_LENGTH:]
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        encode_message(message, True, codec)
+    encode_time = (time.perf_counter() - started) / iterations
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        decode_message(body, codec)
+    decode_time = (time.perf_counter() - started) / iterations
+    return len(frame), encode_time * 1e6, decode_time * 1e6
+
+
+def get_params():
+    """
+    Функция получения параметров замера из командной строки
+    """
+    parser = argparse.ArgumentParser(description='Замер стоимости кодеков сообщений')
+    parser.add_argument('-n', '--iterations', type=int, default=20000,
+                        help='количество повторов для каждого сообщения')
+    parser.add_argument('--users', type=int, default=1000, help='размер списка пользователей в ответе 202')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Основная функция замера
+    """
+    params = get_params()
+    messages = make_messages(params.users)
+    print(f'Кодеки: {", ".join(CODECS)}; повторов: {params.iterations}')
+    print(f'{"сообщение":<22}{"кодек":<10}{"байт":>10}{"кодирование, мкс":>19}{"декодирование, мкс":>21}')
+    for title, message in messages:
+        for name, codec in CODECS.items():
+            size, encode_time, decode_time = measure(codec, message, params.iterations)
+            print(f'{title:<22}{name:<10}{size:>10}{encode_time:>19.2f}{decode_time:>21.2f}')
+
+
+if __name__ == '__main__':
+    main()
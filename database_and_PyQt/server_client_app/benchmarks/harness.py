@@ -0,0 +1,154 @@
+"""
+Модуль общих функций замеров производительности: запуск сервера в отдельном процессе,
+регистрация пользователей, сбор статистики
+"""
+
+
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import common.variables as vrs
+from common.crypto import create_crypto_executor, hash_password
+from server.server_class import NewConnection
+from server.server_functions import SERVER_ENGINES
+
+
+def raise_files_limit():
+    """
+    Функция увеличения лимита открытых файлов процесса до максимально разрешённого
+    (каждый клиент - отдельный сокет)
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def quiet_server_log():
+    """
+    Функция отключения подробного журнала сервера (DEBUG и INFO пишутся на каждое сообщение,
+    с ними замер показывает в основном скорость журналирования)
+    """
+    logging.getLogger('server').setLevel(logging.WARNING)
+
+
+def free_port():
+    """
+    Функция получения свободного порта на локальном интерфейсе
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_users(count, prefix='user'):
+    """
+    Функция подготовки пользователей: имена, пароли и хэши паролей (хэши вычисляются в пуле процессов)
+    :return: список кортежей (имя, пароль, хэш пароля)
+    """
+    names = [f'{prefix}{number}' for number in range(count)]
+    passwords = [f'pass{number}' for number in range(count)]
+    with ProcessPoolExecutor() as executor:
+        hashes = list(executor.map(hash_password, names, passwords, chunksize=64))
+    return list(zip(names, passwords, hashes))
+
+
+def percentile(values, percent):
+    """
+    Функция вычисления перцентиля (по ближайшему рангу)
+    :param values: отсортированный список значений
+    :param percent: перцентиль, 0-100
+    """
+    if not values:
+        return float('nan')
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def latency_report(title, values):
+    """
+    Функция формирования строки с перцентилями задержки (значения в секундах, вывод в миллисекундах)
+    """
+    values = sorted(values)
+    return (f'{title}, мс: p50 {percentile(values, 50) * 1000:.2f}, p90 {percentile(values, 90) * 1000:.2f}, '
+            f'p99 {percentile(values, 99) * 1000:.2f}, max {(values[-1] if values else float("nan")) * 1000:.2f}')
+
+
+def max_rss():
+    """
+    Функция получения максимального объёма резидентной памяти процесса (в мегабайтах)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def process_rss(pid):
+    """
+    Функция получения объёма резидентной памяти другого процесса (в мегабайтах, только Linux)
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+
+def run_server(engine, port, users, storage_options, server_options, backlog, ready, stop):
+    """
+    Функция процесса сервера: создаёт сервер с временной базой, регистрирует пользователей,
+    запускает сервер и работает до установки события stop.
+    :param server_options: атрибуты сервера; crypto - тип исполнителя криптографических операций
+    :param backlog: размер очереди ожидающих подключений (None - значение MAX_CONNECTIONS)
+    """
+    raise_files_limit()
+    if backlog:
+        vrs.MAX_CONNECTIONS = backlog
+    quiet_server_log()
+    db_path = os.path.join(tempfile.mkdtemp(), 'server_base.db3')
+    server_options = dict(server_options)
+    crypto = create_crypto_executor(server_options.pop('crypto')) if 'crypto' in server_options else None
+    server = SERVER_ENGINES[engine](port, '127.0.0.1', db_path, NewConnection(), storage_options, crypto=crypto)
+    for name, value in server_options.items():
+        setattr(server, name, value)
+    for name, _, passwd_hash in users:
+        server.database.add_user(name, passwd_hash)
+    server.daemon = True
+    server.start()
+    ready.set()
+    stop.wait()
+    server.database.close()
+
+
+def start_server(engine, users, storage_options=None, server_options=None, backlog=None):
+    """
+    Функция запуска сервера в отдельном процессе (клиенты и сервер не делят GIL).
+    :return: порт сервера, процесс и событие остановки
+    """
+    port = free_port()
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=run_server,
+        args=(engine, port, users, storage_options or {}, server_options or {}, backlog, ready, stop),
+        daemon=True)
+    process.start()
+    if not ready.wait(600):
+        process.terminate()
+        raise RuntimeError('Сервер не запустился')
+    return port, process, stop
+
+
+def stop_server(process, stop):
+    """
+    Функция остановки процесса сервера
+    """
+    stop.set()
+    process.join(10)
+    if process.is_alive():
+        process.terminate()
@@ -0,0 +1,166 @@
+"""
+Замер одновременного входа большого числа клиентов (например, после перезапуска сервера).
+Каждый имитируемый клиент проходит полный вход по протоколу JIM: presence, ответ на вызов
+(как Client.presence_answer), затем запросы GET_CONTACTS и USERS_REQUEST.
+Не требует PyQt. Запуск из каталога приложения:
+
+    python -m benchmarks.login_storm -n 1000 --engine selectors
+"""
+
+
+import argparse
+import asyncio
+import binascii
+import time
+from collections import Counter
+
+import common.variables as vrs
+from benchmarks.harness import SERVER_ENGINES, raise_files_limit, make_users, latency_report, \
+    start_server, stop_server
+from common.crypto import challenge_digest
+from common.utils import MessageBuffer, encode_message
+
+
+async def read_response(reader, buffer):
+    """
+    Функция чтения очередного ответа сервера (сообщения без ключа response пропускаются)
+    """
+    while True:
+        message = buffer.next_message()
+        while message is not None:
+            if vrs.RESPONSE in message:
+                return message
+            message = buffer.next_message()
+        data = await reader.read(vrs.MAX_PACKAGE_LENGTH)
+        if not data:
+            raise ConnectionResetError('Соединение закрыто сервером')
+        buffer.feed(data)
+
+
+async def handshake(reader, writer, port, name, passwd_hash, framing):
+    """
+    Функция авторизации по протоколу JIM на открытом соединении.
+    :return: буфер сообщений соединения (в кадровом режиме, если сервер его подтвердил)
+    """
+    buffer = MessageBuffer()
+    presence = {
+        vrs.ACTION: vrs.PRESENCE,
+        vrs.TIME: time.time(),
+        vrs.PORT: port,
+        vrs.USER: {vrs.ACCOUNT_NAME: name, vrs.PUBLIC_KEY: f'KEY{name}'},
+    }
+    if framing:
+        presence[vrs.FRAMING] = vrs.FRAMING_LENGTH_PREFIX
+    writer.write(encode_message(presence))
+    challenge = await read_response(reader, buffer)
+    if challenge[vrs.RESPONSE] != 511:
+        raise ConnectionRefusedError(f'{challenge[vrs.RESPONSE]}: {challenge.get(vrs.ERROR)}')
+    buffer.framed = challenge.get(vrs.FRAMING) == vrs.FRAMING_LENGTH_PREFIX
+    digest = challenge_digest(passwd_hash, challenge[vrs.DATA].encode(vrs.ENCODING))
+    writer.write(encode_message(
+        {vrs.RESPONSE: 511, vrs.DATA: binascii.b2a_base64(digest).decode('ascii')}, buffer.framed))
+    answer = await read_response(reader, buffer)
+    if answer[vrs.RESPONSE] != 200:
+        raise ConnectionRefusedError(f'{answer[vrs.RESPONSE]}: {answer.get(vrs.ERROR)}')
+    return buffer
+
+
+async def login_user(port, name, passwd_hash, framing):
+    """
+    Функция входа одного пользователя.
+    :return: время авторизации, время полного входа (в секундах), соединение
+    """
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    buffer = await handshake(reader, writer, port, name, passwd_hash, framing)
+    handshake_time = time.perf_counter() - started
+
+    writer.write(encode_message(
+        {vrs.ACTION: vrs.GET_CONTACTS, vrs.TIME: time.time(), vrs.USER: name}, buffer.framed))
+    await read_response(reader, buffer)
+    writer.write(encode_message(
+        {vrs.ACTION: vrs.USERS_REQUEST, vrs.TIME: time.time(), vrs.ACCOUNT_NAME: name}, buffer.framed))
+    await read_response(reader, buffer)
+    return handshake_time, time.perf_counter() - started, writer
+
+
+async def storm(port, users, concurrency, timeout, framing):
+    """
+    Функция одновременного входа всех пользователей. Соединения остаются открытыми до конца замера.
+    :return: списки времени авторизации и полного входа, счётчик ошибок, общее время
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    handshakes, logins, errors, writers = [], [], Counter(), []
+
+    async def run_user(name, passwd_hash):
+        async with semaphore:
+            try:
+                handshake_time, login, writer = await asyncio.wait_for(
+                    login_user(port, name, passwd_hash, framing), timeout)
+            except Exception as err:
+                errors[f'{type(err).__name__}: {err}'[:100]] += 1
+                return
+        handshakes.append(handshake_time)
+        logins.append(login)
+        writers.append(writer)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(name, passwd_hash) for name, _, passwd_hash in users))
+    elapsed = time.perf_counter() - started
+    for writer in writers:
+        writer.close()
+    return handshakes, logins, errors, elapsed
+
+
+def get_params():
+    """
+    Функция получения параметров замера из командной строки
+    """
+    parser = argparse.ArgumentParser(description='Замер одновременного входа клиентов')
+    parser.add_argument('-n', '--users', type=int, default=1000, help='количество клиентов')
+    parser.add_argument('--engine', choices=SERVER_ENGINES, default='selectors', help='движок сервера')
+    parser.add_argument('--backend', choices=['sqlalchemy', 'memory'], default='sqlalchemy',
+                        help='реализация базы данных сервера')
+    parser.add_argument('--crypto', choices=['inline', 'thread', 'process'], default=vrs.CRYPTO_EXECUTOR,
+                        help='исполнитель проверки ответов на сервере')
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='количество одновременных попыток входа (0 - все сразу)')
+    parser.add_argument('--backlog', type=int, default=0,
+                        help='размер очереди подключений сервера (0 - MAX_CONNECTIONS)')
+    parser.add_argument('--timeout', type=float, default=60, help='время на вход одного клиента, с')
+    parser.add_argument('--legacy-framing', action='store_true', help='не запрашивать кадровый режим')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Основная функция замера
+    """
+    params = get_params()
+    raise_files_limit()
+    print(f'Подготовка {params.users} пользователей...')
+    users = make_users(params.users)
+    server_options = {
+        'max_pending_handshakes': params.users,
+        'handshake_timeout': params.timeout,
+        'crypto': params.crypto,
+    }
+    port, process, stop = start_server(
+        params.engine, users, {'backend': params.backend}, server_options, params.backlog)
+    try:
+        handshakes, logins, errors, elapsed = asyncio.run(storm(
+            port, users, params.concurrency or params.users, params.timeout, not params.legacy_framing))
+    finally:
+        stop_server(process, stop)
+
+    print(f'Движок: {params.engine}, база: {params.backend}, клиентов: {params.users}, '
+          f'успешно: {len(handshakes)}, ошибок: {sum(errors.values())}')
+    print(latency_report('Авторизация (presence - 200)', handshakes))
+    print(latency_report('Полный вход (с GET_CONTACTS и USERS_REQUEST)', logins))
+    print(f'Общее время: {elapsed:.2f} с, входов в секунду: {len(logins) / elapsed:.1f}')
+    for error, count in errors.most_common():
+        print(f'  {count} x {error}')
+
+
+if __name__ == '__main__':
+    main()
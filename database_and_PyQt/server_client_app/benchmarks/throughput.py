@@ -0,0 +1,291 @@
+"""
+Замер пропускной способности маршрутизации сообщений (действие MESSAGE).
+Отправители посылают сообщения получателям по кругу: сообщение k отправителя i
+получает получатель (i + k) % receivers. Отчёт: сообщений в секунду, перцентили задержки
+от отправки до получения и объём памяти.
+
+Режимы:
+  socketpair - в одном процессе, сервер (Server) не запускается как поток, а его методы
+               process_client_message, send_messages_to_clients и run_calls вызываются напрямую;
+  tcp        - сервер в отдельном процессе, клиенты подключаются через loopback.
+
+Запуск из каталога приложения:
+
+    python -m benchmarks.throughput --mode socketpair --senders 10 --receivers 10 -n 10000 --size 256
+"""
+
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import time
+
+import common.variables as vrs
+from benchmarks.harness import SERVER_ENGINES, raise_files_limit, make_users, latency_report, max_rss, \
+    process_rss, free_port, start_server, stop_server, quiet_server_log
+from benchmarks.login_storm import handshake
+from common.utils import MessageBuffer, encode_message
+from server.connection_class import ClientConnection
+from server.server_class import Server, NewConnection
+
+
+def make_message(sender, destination, text):
+    """
+    Функция создания сообщения; в поле времени - момент отправки по time.perf_counter
+    """
+    return {
+        vrs.ACTION: vrs.MESSAGE,
+        vrs.SENDER: sender,
+        vrs.DESTINATION: destination,
+        vrs.TIME: time.perf_counter(),
+        vrs.MESSAGE_TEXT: text
+    }
+
+
+class SimulatedClient:
+    """
+    Класс клиента для замера в одном процессе: неблокирующий сокет из пары socketpair
+    с собственным буфером исходящих данных
+    """
+
+    def __init__(self, name, sock, framed):
+        """
+        Метод инициализации
+        """
+        self.name = name
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.buffer = MessageBuffer(framed)
+        self.outbound = bytearray()
+        self.sent = 0
+
+    def pump_out(self):
+        """
+        Метод отправки накопленных данных без блокировки
+        """
+        if self.outbound:
+            try:
+                del self.outbound[:self.sock.send(self.outbound)]
+            except BlockingIOError:
+                pass
+
+    def pump_in(self, latencies):
+        """
+        Метод чтения всех доступных сообщений с записью задержки каждого
+        """
+        while True:
+            try:
+                data = self.sock.recv(vrs.MAX_PACKAGE_LENGTH)
+            except BlockingIOError:
+                return
+            self.buffer.feed(data)
+            message = self.buffer.next_message()
+            while message is not None:
+                latencies.append(time.perf_counter() - message[vrs.TIME])
+                message = self.buffer.next_message()
+
+
+def run_socketpair(params):
+    """
+    Функция замера в одном процессе.
+    :return: задержки доставки (в секундах), общее время
+    """
+    quiet_server_log()
+    db_path = os.path.join(tempfile.mkdtemp(), 'server_base.db3')
+    server = Server(free_port(), '127.0.0.1', db_path, NewConnection(), {'backend': params.backend})
+    framed = not params.legacy_framing
+    senders, receivers = [], []
+    for names, clients in ((sender_names(params), senders), (receiver_names(params), receivers)):
+        for name in names:
+            server.database.add_user(name, b'')
+            client_sock, server_sock = socket.socketpair()
+            server_sock.setblocking(False)
+            connection = ClientConnection(server_sock)
+            connection.buffer.framed = framed
+            connection.auth_state = vrs.AUTH_DONE
+            server.clients_names[name] = connection
+            server.clients_list.append(connection)
+            clients.append((SimulatedClient(name, client_sock, framed), connection))
+
+    text = 'x' * params.size
+    window = max(params.window * (params.size + 128), vrs.MAX_PACKAGE_LENGTH)
+    total = params.senders * params.messages
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < total:
+        for number, (client, _) in enumerate(senders):
+            while client.sent < params.messages and len(client.outbound) < window:
+                destination = receivers[(number + client.sent) % params.receivers][0].name
+                client.outbound += encode_message(make_message(client.name, destination, text), framed)
+                client.sent += 1
+            client.pump_out()
+        for _, connection in senders:
+            if connection.paused:
+                continue
+            try:
+                for message in connection.receive():
+                    server.process_client_message(message, connection)
+            except BlockingIOError:
+                pass
+        server.send_data_list = [connection for _, connection in receivers if connection.has_pending_output]
+        server.send_messages_to_clients()
+        server.run_calls()
+        for client, _ in receivers:
+            client.pump_in(latencies)
+    elapsed = time.perf_counter() - started
+    server.database.close()
+    return latencies, elapsed, max_rss()
+
+
+async def connect_user(port, name, passwd_hash, framed):
+    """
+    Функция подключения и авторизации клиента в режиме tcp
+    :return: поток чтения, буфер сообщений, поток записи
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    buffer = await handshake(reader, writer, port, name, passwd_hash, framed)
+    return reader, buffer, writer
+
+
+async def tcp_sender(port, user, destinations, params, framed):
+    """
+    Задача клиента-отправителя в режиме tcp
+    """
+    name, _, passwd_hash = user
+    _, buffer, writer = await connect_user(port, name, passwd_hash, framed)
+    framed = buffer.framed
+    text = 'x' * params.size
+    for number in range(params.messages):
+        destination = destinations[number % len(destinations)]
+        writer.write(encode_message(make_message(name, destination, text), framed))
+        if number % params.window == 0:
+            await writer.drain()
+    await writer.drain()
+    return writer
+
+
+async def tcp_receiver(reader, buffer, expected, latencies):
+    """
+    Задача клиента-получателя в режиме tcp
+    """
+    received = 0
+    while received < expected:
+        message = buffer.next_message()
+        if message is None:
+            data = await reader.read(vrs.MAX_PACKAGE_LENGTH)
+            if not data:
+                raise ConnectionResetError('Соединение закрыто сервером')
+            buffer.feed(data)
+            continue
+        if message.get(vrs.ACTION) == vrs.MESSAGE:
+            latencies.append(time.perf_counter() - message[vrs.TIME])
+            received += 1
+
+
+async def run_tcp_clients(port, users, params):
+    """
+    Функция замера через loopback: сначала входят получатели, затем отправители
+    """
+    framed = not params.legacy_framing
+    senders, receivers = users[:params.senders], users[params.senders:]
+    receiver_names_list = [name for name, _, _ in receivers]
+    expected = dict.fromkeys(receiver_names_list, 0)
+    for number in range(params.senders):
+        for message in range(params.messages):
+            expected[receiver_names_list[(number + message) % params.receivers]] += 1
+
+    connections = []
+    for name, _, passwd_hash in receivers:
+        connections.append(await connect_user(port, name, passwd_hash, framed))
+
+    latencies = []
+    started = time.perf_counter()
+    receiving = [
+        asyncio.create_task(tcp_receiver(reader, buffer, expected[name], latencies))
+        for name, (reader, buffer, _) in zip(receiver_names_list, connections)
+    ]
+    writers = await asyncio.gather(*(
+        tcp_sender(port, user, receiver_names_list[number:] + receiver_names_list[:number], params, framed)
+        for number, user in enumerate(senders)
+    ))
+    await asyncio.gather(*receiving)
+    elapsed = time.perf_counter() - started
+    for writer in writers + [writer for _, _, writer in connections]:
+        writer.close()
+    return latencies, elapsed
+
+
+def run_tcp(params):
+    """
+    Функция замера через loopback с сервером в отдельном процессе
+    """
+    users = make_users(params.senders + params.receivers)
+    port, process, stop = start_server(
+        params.engine, users, {'backend': params.backend}, {'max_pending_handshakes': len(users)}, params.backlog)
+    try:
+        latencies, elapsed = asyncio.run(run_tcp_clients(port, users, params))
+        rss = process_rss(process.pid)
+    finally:
+        stop_server(process, stop)
+    return latencies, elapsed, rss
+
+
+def sender_names(params):
+    """
+    Функция получения имён отправителей
+    """
+    return [f'user{number}' for number in range(params.senders)]
+
+
+def receiver_names(params):
+    """
+    Функция получения имён получателей
+    """
+    return [f'user{number}' for number in range(params.senders, params.senders + params.receivers)]
+
+
+def get_params():
+    """
+    Функция получения параметров замера из командной строки
+    """
+    parser = argparse.ArgumentParser(description='Замер пропускной способности маршрутизации сообщений')
+    parser.add_argument('--mode', choices=['socketpair', 'tcp'], default='socketpair', help='режим замера')
+    parser.add_argument('--engine', choices=SERVER_ENGINES, default='selectors', help='движок сервера (tcp)')
+    parser.add_argument('--backend', choices=['sqlalchemy', 'memory'], default='sqlalchemy',
+                        help='реализация базы данных сервера')
+    parser.add_argument('--senders', type=int, default=10, help='количество отправителей')
+    parser.add_argument('--receivers', type=int, default=10, help='количество получателей')
+    parser.add_argument('-n', '--messages', type=int, default=10000, help='сообщений от каждого отправителя')
+    parser.add_argument('--size', type=int, default=256, help='длина текста сообщения')
+    parser.add_argument('--window', type=int, default=64,
+                        help='количество сообщений, отправляемых отправителем без ожидания')
+    parser.add_argument('--backlog', type=int, default=0,
+                        help='размер очереди подключений сервера (tcp, 0 - MAX_CONNECTIONS)')
+    parser.add_argument('--legacy-framing', action='store_true', help='не использовать кадровый режим')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Основная функция замера
+    """
+    params = get_params()
+    raise_files_limit()
+    if params.mode == 'socketpair':
+        latencies, elapsed, rss = run_socketpair(params)
+        engine = 'Server (в одном процессе)'
+    else:
+        latencies, elapsed, rss = run_tcp(params)
+        engine = params.engine
+    print(f'Режим: {params.mode}, движок: {engine}, база: {params.backend}, '
+          f'отправителей: {params.senders}, получателей: {params.receivers}, размер: {params.size}')
+    print(f'Доставлено сообщений: {len(latencies)} за {elapsed:.2f} с, '
+          f'сообщений в секунду: {len(latencies) / elapsed:.0f}')
+    print(latency_report('Задержка доставки', latencies))
+    print(f'Память сервера (RSS): {rss:.1f} МБ')
+
+
+if __name__ == '__main__':
+    main()
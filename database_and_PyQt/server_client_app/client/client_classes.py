@@ -5,21 +5,25 @@
 
 
 import binascii
-import hashlib
-import hmac
 import logging
+import select
 import socket
 import sys
 import time
 import json
 import threading
+from collections import deque
+from itertools import count
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 from PyQt5.QtCore import QObject, pyqtSignal
 
 import common.custom_exceptions as custom_exceptions
 import common.variables as vrs
 import logs.client_log_config
-from common.utils import send_message, get_message
+from common.crypto import create_crypto_executor, hash_password, challenge_digest
+from common.utils import send_message, get_message, get_messages, message_buffer, set_framing
+from common.wire_codecs import CODECS, get_codec
 
 LOG = logging.getLogger('client')
 
@@ -27,12 +31,17 @@ LOG = logging.getLogger('client')
 class Client(threading.Thread, QObject):
     """
     Основной бэк-энд класс клиента, отвечающий за передачу,
-    получение и обработку сообщений между сервером и клиентом
+    получение и обработку сообщений между сервером и клиентом.
+    Поток клиента (run) читает сокет по готовности и сразу обрабатывает сообщения.
+    Запросы к серверу получают идентификатор (REQUEST_ID) и возвращают объекты Future, которые поток чтения
+    завершает ответами сервера с тем же идентификатором, поэтому несколько запросов могут выполняться
+    одновременно; сокет блокируется только на время записи.
     """
 
     new_message = pyqtSignal(dict)
     connection_lost = pyqtSignal()
     message_205 = pyqtSignal()
+    room_message = pyqtSignal(dict)
 
     def __init__(self, client_name, password, database, server_address, server_port, keys):
         """
@@ -47,13 +56,17 @@ class Client(threading.Thread, QObject):
         self.server_address = server_address
         self.server_port = server_port
         self.keys = keys
-        self.transport = self.prepare_transport()
-        self.connection = self.send_presence()
+        self.deferred_messages = deque()
+        self.pending_requests = dict()
+        self.request_ids = count(1)
+        self.users_version = None
         self.database_locker = threading.Lock()
         self.transport_locker = threading.Lock()
+        self.requests_locker = threading.Lock()
+        self.transport = self.prepare_transport()
+        self.connection = self.send_presence()
         if self.connection:
-            self.user_list_update()
-            self.contact_list_update()
+            self.lists_update()
 
     def prepare_transport(self):
         """
@@ -70,25 +83,25 @@ class Client(threading.Thread, QObject):
     def send_presence(self):
         """
         Метод, отвечающий за отправку приветственного сообщения на сервер и прохождение аутентификации.
-        В случае успешного подключения и аутентификации возвращает True
+        В случае успешного подключения и аутентификации возвращает True.
+        Хэш пароля вычисляется в отдельном потоке, пока сообщение presence передаётся серверу.
         """
-        passwd_bytes = self.password.encode('utf-8')
-        salt = self.client_name.lower().encode('utf-8')
-        passwd_hash = hashlib.pbkdf2_hmac('sha512', passwd_bytes, salt, 10000)
-        passwd_hash_string = binascii.hexlify(passwd_hash)
+        crypto = create_crypto_executor('thread', 1)
+        passwd_hash = crypto.submit(hash_password, self.client_name, self.password)
+        crypto.shutdown(wait=False)
         pubkey = self.keys.publickey().export_key().decode('ascii')
 
-        LOG.debug(f'Passwd hash ready: {passwd_hash_string}')
-
         try:
             message = {
                 vrs.ACTION: vrs.PRESENCE,
                 vrs.TIME: time.time(),
                 vrs.PORT: self.server_port,
-                vrs.USER: {vrs.ACCOUNT_NAME: self.client_name, vrs.PUBLIC_KEY: pubkey}
+                vrs.USER: {vrs.ACCOUNT_NAME: self.client_name, vrs.PUBLIC_KEY: pubkey},
+                vrs.FRAMING: vrs.FRAMING_LENGTH_PREFIX,
+                vrs.CODECS: list(CODECS)
             }
             send_message(self.transport, message)
-            answer = self.presence_answer(passwd_hash_string)
+            answer = self.presence_answer(passwd_hash)
             LOG.info(f'Установлено соединение с сервером. Ответ сервера: {answer}')
             print(f'Установлено соединение с сервером.')
             return True if answer == '200 : OK' else False
@@ -98,28 +111,87 @@ class Client(threading.Thread, QObject):
         except custom_exceptions.NoResponseInServerMessage as error:
             LOG.error(f'Ошибка сообщения сервера {self.server_address}: {error}')
 
-    def presence_answer(self, passwd_hash_string):
+    def presence_answer(self, passwd_hash):
         """
         Метод, отвечающий за получение и расшифровку ответа сервера при установлении соединения и аутенификации.
+        :param passwd_hash: объект Future с хэшем пароля
         """
         server_message = get_message(self.transport)
         if vrs.RESPONSE in server_message:
             if server_message[vrs.RESPONSE] == 200:
                 return '200 : OK'
             elif server_message[vrs.RESPONSE] == 511:
+                if server_message.get(vrs.FRAMING) == vrs.FRAMING_LENGTH_PREFIX:
+                    set_framing(self.transport, codec=get_codec(server_message.get(vrs.CODEC)))
                 ans_data = server_message[vrs.DATA]
-                hash_string = hmac.new(passwd_hash_string, ans_data.encode('utf-8'), 'MD5')
-                digest = hash_string.digest()
+                passwd_hash_string = passwd_hash.result()
+                LOG.debug(f'Passwd hash ready: {passwd_hash_string}')
+                digest = challenge_digest(passwd_hash_string, ans_data.encode('utf-8'))
                 my_ans = {
                     vrs.RESPONSE: 511,
                     vrs.DATA: binascii.b2a_base64(digest).decode('ascii')
                 }
                 send_message(self.transport, my_ans)
-                result = self.presence_answer(passwd_hash_string)
+                result = self.presence_answer(passwd_hash)
                 return result
             return f'400 : {server_message[vrs.ERROR]}'
         raise custom_exceptions.NoResponseInServerMessage
 
+    def request(self, message):
+        """
+        Метод отправки запроса серверу. Возвращает объект Future, который завершается ответом сервера.
+        До запуска потока чтения (при инициализации клиента) ответ читается из сокета сразу.
+        """
+        future = Future()
+        with self.requests_locker:
+            request_id = message[vrs.REQUEST_ID] = next(self.request_ids)
+            self.pending_requests[request_id] = future
+        try:
+            with self.transport_locker:
+                send_message(self.transport, message)
+        except OSError as error:
+            with self.requests_locker:
+                self.pending_requests.pop(request_id, None)
+            future.set_exception(error)
+            return future
+        if not self.is_alive():
+            while not future.done():
+                self.dispatch_message(get_message(self.transport))
+        return future
+
+    def wait_response(self, future):
+        """
+        Метод ожидания ответа сервера на запрос. Возвращает ответ или None, если ответ не получен.
+        """
+        try:
+            return future.result(vrs.CLIENT_RESPONSE_TIMEOUT)
+        except FutureTimeoutError:
+            LOG.error('Сервер не ответил на запрос.')
+        except OSError as error:
+            LOG.error(f'Не удалось выполнить запрос: {error}')
+        return None
+
+    def dispatch_message(self, message):
+        """
+        Метод распределения сообщения сервера: ответ завершает запрос с тем же идентификатором,
+        остальные сообщения обрабатываются потоком чтения (до его запуска - откладываются).
+        Сообщение 205 не является ответом на запрос. Ответ без идентификатора (сервер старой версии)
+        завершает самый ранний ожидающий запрос.
+        """
+        future = None
+        if vrs.RESPONSE in message and message[vrs.RESPONSE] != 205:
+            with self.requests_locker:
+                if vrs.REQUEST_ID in message:
+                    future = self.pending_requests.pop(message[vrs.REQUEST_ID], None)
+                elif self.pending_requests:
+                    future = self.pending_requests.pop(next(iter(self.pending_requests)))
+        if future is not None:
+            future.set_result(message)
+        elif threading.current_thread() is self:
+            self.get_message_from_server(message)
+        else:
+            self.deferred_messages.append(message)
+
     def create_message(self, action, message=None, destination=None):
         """
         Метод, формирующий сообщения в виде словаря для отправки на сервер
@@ -133,6 +205,8 @@ class Client(threading.Thread, QObject):
         }
 
         if action == vrs.MESSAGE and message and destination:
+            with self.requests_locker:
+                result_message[vrs.REQUEST_ID] = next(self.request_ids)
             result_message[vrs.SENDER] = self.client_name
             result_message[vrs.MESSAGE_TEXT] = message
             result_message[vrs.DESTINATION] = destination
@@ -151,10 +225,23 @@ class Client(threading.Thread, QObject):
             if not self.database.check_user(to_client):
                 LOG.error(f'Попытка отправить сообщение незарегистрированому получателю: {to_client}')
                 return
+        self.transmit_message(message_to_send)
+
+    def send_room_message(self, room, message):
+        """
+        Метод, отвечающий за отправку на сервер сообщения в комнату (сервер рассылает его участникам комнаты).
+        Сообщение в комнату не шифруется ключом получателя, поэтому передаётся текстом.
+        """
+        self.transmit_message(self.create_message(vrs.MESSAGE, message, room))
+
+    def transmit_message(self, message_to_send):
+        """
+        Метод записи сообщения для другого пользователя или комнаты в сокет сервера
+        """
         with self.transport_locker:
             try:
                 send_message(self.transport, message_to_send)
-                LOG.info(f'{self.client_name}: Отправлено сообщение для пользователя {to_client}')
+                LOG.info(f'{self.client_name}: Отправлено сообщение для {message_to_send[vrs.DESTINATION]}')
             except OSError as error:
                 if error.errno:
                     LOG.critical('Потеряно соединение с сервером.')
@@ -171,51 +258,141 @@ class Client(threading.Thread, QObject):
                 message.get(vrs.DESTINATION) == self.client_name:
             LOG.debug(f'{self.client_name}: Получено сообщение от {message[vrs.SENDER]}')
             self.new_message.emit(message)
+        elif message.get(vrs.ACTION) == vrs.MESSAGE and \
+                vrs.SENDER in message and vrs.MESSAGE_TEXT in message and \
+                str(message.get(vrs.DESTINATION)).startswith(vrs.ROOM_PREFIX):
+            LOG.debug(f'{self.client_name}: Получено сообщение от {message[vrs.SENDER]} '
+                      f'в комнате {message[vrs.DESTINATION]}')
+            self.room_message.emit(message)
         elif message.get(vrs.RESPONSE) == 200:
             LOG.debug(f'Получен ответ сервера {message}')
             return
         elif message.get(vrs.RESPONSE) == 205:
-            self.user_list_update()
-            self.contacts_list_update()
+            self.users_changed(message)
             self.message_205.emit()
         else:
             LOG.debug(f'{self.client_name}: Получено сообщение от сервера о некорректном запросе')
 
-    def user_list_update(self):
+    @staticmethod
+    def future_answer(future):
         """
-        Метод обновления с сервера списка известных пользователей
+        Метод получения ответа сервера из завершённого объекта Future (None при ошибке запроса)
         """
-        LOG.debug(f'Запрос списка известных пользователей {self.client_name}')
-        request = {
+        return None if future.exception() else future.result()
+
+    def users_request(self):
+        """
+        Метод формирования запроса списка известных пользователей
+        """
+        return {
             vrs.ACTION: vrs.USERS_REQUEST,
             vrs.TIME: time.time(),
             vrs.ACCOUNT_NAME: self.client_name
         }
-        with self.transport_locker:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
-        if vrs.RESPONSE in answer and answer[vrs.RESPONSE] == 202:
-            self.database.add_users(answer[vrs.LIST_INFO])
-        else:
-            LOG.error('Не удалось обновить список известных пользователей.')
 
-    def contact_list_update(self):
+    def contacts_request(self):
         """
-        Метод обновления с сервера контактов пользователя
+        Метод формирования запроса контактов пользователя
         """
-        self.database.contacts_clear()
-        LOG.debug(f'Запрос контакт листа для пользователся {self.client_name}')
-        request = {
+        return {
             vrs.ACTION: vrs.GET_CONTACTS,
             vrs.TIME: time.time(),
             vrs.USER: self.client_name
         }
-        LOG.debug(f'Сформирован запрос {request}')
-        with self.transport_locker:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
+
+    def lists_update(self, wait=True):
+        """
+        Метод обновления с сервера списков известных пользователей и контактов одним пакетом запросов (BATCH).
+        Если сервер не поддерживает пакеты, списки запрашиваются отдельно.
+        :param wait: дождаться ответа сервера (в потоке чтения ответ обрабатывается по мере получения)
+        """
+        LOG.debug(f'Запрос списков пользователей и контактов для {self.client_name}')
+        request = {
+            vrs.ACTION: vrs.BATCH,
+            vrs.TIME: time.time(),
+            vrs.REQUESTS: [self.users_request(), self.contacts_request()]
+        }
+        future = self.request(request)
+        future.add_done_callback(lambda result: self.process_lists(self.future_answer(result), wait))
+        if wait:
+            self.wait_response(future)
+
+    def process_lists(self, answer, wait):
+        """
+        Метод обработки ответа сервера на пакет запросов списков
+        """
+        if answer and answer.get(vrs.RESPONSE) == 200 and len(answer.get(vrs.LIST_INFO) or []) == 2:
+            users, contacts = answer[vrs.LIST_INFO]
+            self.process_user_list(users)
+            self.process_contact_list(contacts)
+        elif answer and answer.get(vrs.RESPONSE) == 400:
+            LOG.debug('Сервер не поддерживает пакеты запросов')
+            wait = wait and threading.current_thread() is not self
+            self.user_list_update(wait)
+            self.contact_list_update(wait)
+        else:
+            LOG.error('Не удалось обновить списки пользователей и контактов.')
+
+    def users_changed(self, message):
+        """
+        Метод обработки сообщения 205 об изменении списка пользователей на сервере.
+        Изменения следующей версии применяются к списку известных пользователей без запроса к серверу,
+        уже учтённые версии пропускаются. Если версия пропущена или сервер не передал изменения,
+        списки запрашиваются полностью.
+        """
+        version = message.get(vrs.USERS_VERSION)
+        with self.database_locker:
+            if version is not None and self.users_version is not None:
+                if version <= self.users_version:
+                    return
+                if version == self.users_version + 1:
+                    LOG.debug(f'Применение изменений списка пользователей, версия {version}')
+                    self.database.update_users(message.get(vrs.USERS_ADDED, []), message.get(vrs.USERS_REMOVED, []))
+                    self.users_version = version
+                    return
+        self.lists_update(wait=False)
+
+    def user_list_update(self, wait=True):
+        """
+        Метод обновления с сервера списка известных пользователей
+        :param wait: дождаться ответа сервера (в потоке чтения ответ обрабатывается по мере получения)
+        """
+        LOG.debug(f'Запрос списка известных пользователей {self.client_name}')
+        future = self.request(self.users_request())
+        future.add_done_callback(lambda result: self.process_user_list(self.future_answer(result)))
+        if wait:
+            self.wait_response(future)
+
+    def process_user_list(self, answer):
+        """
+        Метод обработки ответа сервера со списком известных пользователей
+        (запоминается версия списка, от которой применяются изменения из сообщений 205)
+        """
+        if answer and answer.get(vrs.RESPONSE) == 202:
+            with self.database_locker:
+                self.database.add_users(answer[vrs.LIST_INFO])
+                self.users_version = answer.get(vrs.USERS_VERSION)
+        else:
+            LOG.error('Не удалось обновить список известных пользователей.')
+
+    def contact_list_update(self, wait=True):
+        """
+        Метод обновления с сервера контактов пользователя
+        :param wait: дождаться ответа сервера (в потоке чтения ответ обрабатывается по мере получения)
+        """
+        LOG.debug(f'Запрос контакт листа для пользователся {self.client_name}')
+        future = self.request(self.contacts_request())
+        future.add_done_callback(lambda result: self.process_contact_list(self.future_answer(result)))
+        if wait:
+            self.wait_response(future)
+
+    def process_contact_list(self, answer):
+        """
+        Метод обработки ответа сервера со списком контактов
+        """
         LOG.debug(f'Получен ответ {answer}')
-        if vrs.RESPONSE in answer and answer[vrs.RESPONSE] == 202:
+        if answer and answer.get(vrs.RESPONSE) == 202:
+            self.database.contacts_clear()
             for contact in answer[vrs.LIST_INFO]:
                 self.database.add_contact(contact)
         else:
@@ -232,9 +409,9 @@ class Client(threading.Thread, QObject):
             vrs.USER: self.client_name,
             vrs.ACCOUNT_NAME: contact
         }
-        with self.transport_locker:
-            send_message(self.transport, request)
-            self.get_message_from_server(get_message(self.transport))
+        answer = self.wait_response(self.request(request))
+        if answer:
+            self.get_message_from_server(answer)
 
     def remove_contact(self, contact):
         """
@@ -247,9 +424,38 @@ class Client(threading.Thread, QObject):
             vrs.USER: self.client_name,
             vrs.ACCOUNT_NAME: contact
         }
-        with self.transport_locker:
-            send_message(self.transport, request)
-            self.get_message_from_server(get_message(self.transport))
+        answer = self.wait_response(self.request(request))
+        if answer:
+            self.get_message_from_server(answer)
+
+    def join_room(self, room):
+        """
+        Метод вступления пользователя в комнату (групповой чат)
+        :return: True, если сервер подтвердил вступление
+        """
+        LOG.debug(f'Вступление в комнату {room}')
+        return self.room_request(vrs.JOIN, room)
+
+    def leave_room(self, room):
+        """
+        Метод выхода пользователя из комнаты
+        :return: True, если сервер подтвердил выход
+        """
+        LOG.debug(f'Выход из комнаты {room}')
+        return self.room_request(vrs.LEAVE, room)
+
+    def room_request(self, action, room):
+        """
+        Метод отправки запроса вступления в комнату или выхода из неё
+        """
+        request = {
+            vrs.ACTION: action,
+            vrs.TIME: time.time(),
+            vrs.USER: self.client_name,
+            vrs.ROOM: room
+        }
+        answer = self.wait_response(self.request(request))
+        return bool(answer) and answer.get(vrs.RESPONSE) == 200
 
     def get_user_pubkey(self, user):
         """
@@ -261,10 +467,8 @@ class Client(threading.Thread, QObject):
             vrs.TIME: time.time(),
             vrs.ACCOUNT_NAME: user
         }
-        with self.transport_locker:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
-        if vrs.RESPONSE in answer and answer[vrs.RESPONSE] == 511:
+        answer = self.wait_response(self.request(request))
+        if answer and answer.get(vrs.RESPONSE) == 511:
             return answer[vrs.DATA]
         else:
             LOG.error(f'Не удалось получить ключ собеседника{user}.')
@@ -280,32 +484,43 @@ class Client(threading.Thread, QObject):
             except OSError:
                 pass
         LOG.debug('Клиент завершает работу.')
-        time.sleep(0.5)
+
+    def connection_closed(self):
+        """
+        Метод обработки потери соединения: ожидающие запросы завершаются ошибкой
+        """
+        if self.connection:
+            LOG.critical(f'Потеряно соединение с сервером.')
+            self.connection = False
+            self.connection_lost.emit()
+        with self.requests_locker:
+            pending = list(self.pending_requests.values())
+            self.pending_requests.clear()
+        for future in pending:
+            future.set_exception(ConnectionResetError('Соединение с сервером закрыто'))
 
     def run(self):
         """
-        Основной метод клиента. Пока параметр соединения (connection) True,
-        раз в секунду проверяет сокет на наличие сообщений от сервера и
-        при наличии таковых отправляет их на обработку.
+        Основной метод клиента (поток чтения). Пока параметр соединения (connection) True,
+        ожидает готовности сокета к чтению и сразу обрабатывает все принятые сообщения
+        (в том числе уже находящиеся в буфере соединения).
         """
         LOG.debug('Запущен процесс - приёмник собщений с сервера.')
+        buffer = message_buffer(self.transport)
         while self.connection:
-            time.sleep(1)
-            with self.transport_locker:
-                try:
-                    self.transport.settimeout(0.5)
-                    message = get_message(self.transport)
-                except OSError as err:
-                    if err.errno:
-                        LOG.critical(f'Потеряно соединение с сервером.')
-                        self.connection = False
-                        self.connection_lost.emit()
-                except (ConnectionError, ConnectionAbortedError, ConnectionResetError, json.JSONDecodeError, TypeError):
-                    LOG.debug(f'Потеряно соединение с сервером.')
-                    self.connection = False
-                    self.connection_lost.emit()
-                else:
+            while self.deferred_messages:
+                self.get_message_from_server(self.deferred_messages.popleft())
+            message = buffer.next_message()
+            while message is not None:
+                self.dispatch_message(message)
+                message = buffer.next_message()
+            try:
+                readable, _, _ = select.select([self.transport], [], [], vrs.CLIENT_POLL_INTERVAL)
+                if not readable:
+                    continue
+                for message in get_messages(self.transport):
                     LOG.debug(f'Принято сообщение с сервера: {message}')
-                    self.get_message_from_server(message)
-                finally:
-                    self.transport.settimeout(5)
+                    self.dispatch_message(message)
+            except (OSError, ValueError, custom_exceptions.IncorrectData):
+                self.connection_closed()
+        self.connection_closed()
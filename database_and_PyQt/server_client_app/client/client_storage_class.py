@@ -72,12 +72,29 @@ class ClientStorage:
 
     def add_users(self, users_list):
         """
-        Метод добавления пользователя
-        """
-        self.session.query(self.KnownUsers).delete()
-        for user in users_list:
-            user_row = self.KnownUsers(username=user)
-            self.session.add(user_row)
+        Метод замены списка известных пользователей полным списком с сервера
+        (изменяются только отличающиеся записи)
+        """
+        known = set(self.get_users())
+        users = set(users_list)
+        self.update_users(users - known, known - users)
+
+    def update_users(self, added, removed):
+        """
+        Метод применения изменений списка известных пользователей: добавление новых имён
+        и удаление имён удалённых с сервера пользователей (вместе с контактами)
+        """
+        removed = list(removed)
+        if removed:
+            self.session.query(self.KnownUsers).filter(
+                self.KnownUsers.username.in_(removed)).delete(synchronize_session=False)
+            self.session.query(self.Contacts).filter(
+                self.Contacts.name.in_(removed)).delete(synchronize_session=False)
+        known = set(self.get_users()) if added else set()
+        for user in added:
+            if user not in known:
+                known.add(user)
+                self.session.add(self.KnownUsers(username=user))
         self.session.commit()
 
     def save_message(self, destination, user, message):
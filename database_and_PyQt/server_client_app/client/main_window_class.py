@@ -9,7 +9,7 @@ from Cryptodome.Cipher import PKCS1_OAEP
 from Cryptodome.PublicKey import RSA
 from PyQt5.QtCore import pyqtSlot, Qt
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QBrush, QColor
-from PyQt5.QtWidgets import QMainWindow, qApp, QApplication, QMessageBox
+from PyQt5.QtWidgets import QMainWindow, qApp, QApplication, QMessageBox, QInputDialog
 from client.dialog_window_classes import AddContactDialog, DelContactDialog
 from client.ui import main_window
 import common.variables as vrs
@@ -92,6 +92,7 @@ class MainWindow(QMainWindow):
         self.current_chat = None
         self.current_chat_key = None
         self.encryptor = None
+        self.rooms = set()
         self.decrypter = PKCS1_OAEP.new(client.keys)
 
         self.contacts_model = ContactsModel(self.database)
@@ -108,6 +109,9 @@ class MainWindow(QMainWindow):
         self.ui.add_contact_point.triggered.connect(self.add_contact_dialog.show)
         self.ui.del_contact_point.triggered.connect(self.del_contact_dialog.show)
         self.ui.exit_point.triggered.connect(self.close)
+        self.ui.join_room_point.triggered.connect(self.join_room)
+        self.ui.open_room_point.triggered.connect(self.open_room)
+        self.ui.leave_room_point.triggered.connect(self.leave_room)
         self.ui.add_contact_btn.clicked.connect(self.add_contact_dialog.show)
         self.ui.del_contact_btn.clicked.connect(self.del_contact_dialog.show)
         self.ui.clear_text_area_btn.clicked.connect(self.ui.message_text_area.clear)
@@ -144,15 +148,18 @@ class MainWindow(QMainWindow):
 
     def send_message(self):
         """
-        Метод отправки сообщений (с шифрованием)
+        Метод отправки сообщений (с шифрованием). Зашифрованный текст передаётся байтами,
+        кодек JSON сам передаёт их строкой base64. Сообщение в комнату передаётся текстом.
         """
         message_text = self.ui.message_text_area.toPlainText()
         self.ui.message_text_area.clear()
         if message_text:
-            message_text_encrypted = self.encryptor.encrypt(message_text.encode('utf8'))
-            message_text_encrypted_base64 = base64.b64encode(message_text_encrypted)
             try:
-                self.client.send_message_to_server(self.current_chat, message_text_encrypted_base64.decode('ascii'))
+                if self.current_chat in self.rooms:
+                    self.client.send_room_message(self.current_chat, message_text)
+                else:
+                    message_text_encrypted = self.encryptor.encrypt(message_text.encode('utf8'))
+                    self.client.send_message_to_server(self.current_chat, message_text_encrypted)
             except (ConnectionResetError, ConnectionAbortedError):
                 self.close()
             else:
@@ -178,13 +185,79 @@ class MainWindow(QMainWindow):
             self.encryptor = PKCS1_OAEP.new(
                 RSA.import_key(self.current_chat_key))
 
+    def select_room(self, room):
+        """
+        Метод установки комнаты текущим чатом (ключ шифрования не запрашивается)
+        """
+        self.current_chat = room
+        self.current_chat_key = None
+        self.encryptor = None
+        self.ui.history_label.setText(f'История сообщений комнаты {room}')
+        self.history_model.update_model(room)
+        self.change_to_enabled()
+
+    def join_room(self):
+        """
+        Метод вступления в комнату по введённому имени (префикс комнаты добавляется при необходимости)
+        и открытия её чата
+        """
+        name, ok_pressed = QInputDialog.getText(self, 'Вступить в комнату', 'Имя комнаты:')
+        name = name.strip()
+        if not ok_pressed or not name:
+            return
+        room = name if name.startswith(vrs.ROOM_PREFIX) else vrs.ROOM_PREFIX + name
+        if self.client.join_room(room):
+            self.rooms.add(room)
+            self.select_room(room)
+        else:
+            self.messages.warning(self, 'Ошибка', f'Не удалось вступить в комнату {room}.')
+
+    def choose_room(self, title):
+        """
+        Метод выбора одной из комнат, в которые пользователь вступил (по умолчанию - открытая комната)
+        :return: имя комнаты или None
+        """
+        if not self.rooms:
+            self.messages.information(self, title, 'Вы не состоите в комнатах.')
+            return None
+        rooms = sorted(self.rooms)
+        current = rooms.index(self.current_chat) if self.current_chat in self.rooms else 0
+        room, ok_pressed = QInputDialog.getItem(self, title, 'Комната:', rooms, current, False)
+        return room if ok_pressed else None
+
+    def open_room(self):
+        """
+        Метод открытия чата комнаты
+        """
+        room = self.choose_room('Открыть комнату')
+        if room:
+            self.select_room(room)
+
+    def leave_room(self):
+        """
+        Метод выхода из комнаты. Если комната была открыта, чат закрывается.
+        """
+        room = self.choose_room('Покинуть комнату')
+        if not room:
+            return
+        if not self.client.leave_room(room):
+            self.messages.warning(self, 'Ошибка', f'Не удалось выйти из комнаты {room}.')
+            return
+        self.rooms.discard(room)
+        if self.current_chat == room:
+            self.current_chat = None
+            self.change_to_disabled()
+
     @pyqtSlot(dict)
     def message(self, message):
         """
-        Метод-слот при получении сообщения (с дешифровкой)
+        Метод-слот при получении сообщения (с дешифровкой). Зашифрованный текст приходит байтами
+        (двоичный кодек) или строкой base64 (JSON).
         """
         sender = message[vrs.SENDER]
-        encrypted_message = base64.b64decode(message[vrs.MESSAGE_TEXT])
+        encrypted_message = message[vrs.MESSAGE_TEXT]
+        if isinstance(encrypted_message, str):
+            encrypted_message = base64.b64decode(encrypted_message)
         try:
             decrypted_message = self.decrypter.decrypt(encrypted_message)
         except (ValueError, TypeError):
@@ -215,6 +288,17 @@ class MainWindow(QMainWindow):
                     self.current_chat = sender
                     self.select_contact()
 
+    @pyqtSlot(dict)
+    def room_message(self, message):
+        """
+        Метод-слот при получении сообщения в комнату (передаётся текстом, без шифрования).
+        Сообщение сохраняется в историю комнаты с именем отправителя.
+        """
+        room = message[vrs.DESTINATION]
+        self.database.save_message('in', room, f'{message[vrs.SENDER]}: {message[vrs.MESSAGE_TEXT]}')
+        if room == self.current_chat:
+            self.history_model.update_model(self.current_chat)
+
     @pyqtSlot()
     def connection_lost(self):
         """
@@ -235,7 +319,7 @@ class MainWindow(QMainWindow):
         """
         Метод-слот при изменении списка пользователей на сервере
         """
-        if self.current_chat and not self.database.check_user(
+        if self.current_chat and self.current_chat not in self.rooms and not self.database.check_user(
                 self.current_chat):
             self.messages.warning(
                 self,
@@ -250,6 +334,7 @@ class MainWindow(QMainWindow):
         Метод установки соединения между методами-слотами и сигналами внешних объектов
         """
         client_obj.new_message.connect(self.message)
+        client_obj.room_message.connect(self.room_message)
         client_obj.connection_lost.connect(self.connection_lost)
         client_obj.message_205.connect(self.sig_205)
         contact_add_obj.contacts_changed.connect(self.contacts_changed)
@@ -132,6 +132,8 @@ class Ui_MainWindow(object):
         self.fail_menu.setObjectName("fail_menu")
         self.conatcs_menu = QtWidgets.QMenu(self.menubar)
         self.conatcs_menu.setObjectName("conatcs_menu")
+        self.rooms_menu = QtWidgets.QMenu(self.menubar)
+        self.rooms_menu.setObjectName("rooms_menu")
         MainWindow.setMenuBar(self.menubar)
         self.statusbar = QtWidgets.QStatusBar(MainWindow)
         self.statusbar.setObjectName("statusbar")
@@ -142,11 +144,21 @@ class Ui_MainWindow(object):
         self.del_contact_point.setObjectName("del_contact_point")
         self.exit_point = QtWidgets.QAction(MainWindow)
         self.exit_point.setObjectName("exit_point")
+        self.join_room_point = QtWidgets.QAction(MainWindow)
+        self.join_room_point.setObjectName("join_room_point")
+        self.open_room_point = QtWidgets.QAction(MainWindow)
+        self.open_room_point.setObjectName("open_room_point")
+        self.leave_room_point = QtWidgets.QAction(MainWindow)
+        self.leave_room_point.setObjectName("leave_room_point")
         self.fail_menu.addAction(self.exit_point)
         self.conatcs_menu.addAction(self.add_contact_point)
         self.conatcs_menu.addAction(self.del_contact_point)
+        self.rooms_menu.addAction(self.join_room_point)
+        self.rooms_menu.addAction(self.open_room_point)
+        self.rooms_menu.addAction(self.leave_room_point)
         self.menubar.addAction(self.fail_menu.menuAction())
         self.menubar.addAction(self.conatcs_menu.menuAction())
+        self.menubar.addAction(self.rooms_menu.menuAction())
 
         self.retranslateUi(MainWindow)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
@@ -159,6 +171,10 @@ class Ui_MainWindow(object):
         self.message_label.setText(_translate("MainWindow", "Введите сообщение:"))
         self.fail_menu.setTitle(_translate("MainWindow", "Файл"))
         self.conatcs_menu.setTitle(_translate("MainWindow", "Контакты"))
+        self.rooms_menu.setTitle(_translate("MainWindow", "Комнаты"))
         self.add_contact_point.setText(_translate("MainWindow", "Добавить контакт"))
         self.del_contact_point.setText(_translate("MainWindow", "Удалить контакт"))
         self.exit_point.setText(_translate("MainWindow", "Выход"))
+        self.join_room_point.setText(_translate("MainWindow", "Вступить в комнату"))
+        self.open_room_point.setText(_translate("MainWindow", "Открыть комнату"))
+        self.leave_room_point.setText(_translate("MainWindow", "Покинуть комнату"))
@@ -0,0 +1,86 @@
+"""
+Модуль криптографических операций авторизации (хэш пароля, ответ на вызов сервера)
+и пулов для их выполнения вне сетевого потока и потока графической оболочки
+"""
+
+import binascii
+import hashlib
+import hmac
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from common.variables import ENCODING, PASSWORD_HASH_ITERATIONS
+
+
+def hash_password(name, password):
+    """
+    Функция получения хэша пароля пользователя (PBKDF2, солью служит имя пользователя)
+    :param name: имя пользователя
+    :param password: пароль
+    :return: хэш пароля в шестнадцатеричном виде (байты)
+    """
+    passwd_hash = hashlib.pbkdf2_hmac(
+        'sha512', password.encode(ENCODING), name.lower().encode(ENCODING), PASSWORD_HASH_ITERATIONS)
+    return binascii.hexlify(passwd_hash)
+
+
+def challenge_digest(passwd_hash, challenge):
+    """
+    Функция вычисления ответа на вызов сервера
+    :param passwd_hash: хэш пароля пользователя (байты)
+    :param challenge: строка-вызов (байты)
+    :return: байты
+    """
+    return hmac.new(passwd_hash, challenge, 'MD5').digest()
+
+
+def verify_challenge(passwd_hash, challenge, answer):
+    """
+    Функция проверки ответа клиента на вызов сервера
+    :param passwd_hash: хэш пароля пользователя (байты)
+    :param challenge: строка-вызов (байты)
+    :param answer: ответ клиента (байты)
+    :return: bool
+    """
+    return hmac.compare_digest(challenge_digest(passwd_hash, challenge), answer)
+
+
+class InlineExecutor:
+    """
+    Класс исполнителя, выполняющего задачи сразу в вызывающем потоке
+    (интерфейс concurrent.futures.Executor)
+    """
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Метод выполнения задачи. Возвращает завершённый объект Future.
+        """
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Метод завершения работы исполнителя
+        """
+
+
+CRYPTO_EXECUTORS = {
+    'inline': InlineExecutor,
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+def create_crypto_executor(kind='thread', workers=None):
+    """
+    Функция создания исполнителя криптографических операций
+    :param kind: тип исполнителя: inline, thread (пул потоков) или process (пул процессов)
+    :param workers: количество рабочих потоков или процессов (по умолчанию - по числу ядер)
+    :return: объект с интерфейсом concurrent.futures.Executor
+    """
+    if kind == 'inline':
+        return InlineExecutor()
+    return CRYPTO_EXECUTORS[kind](max_workers=workers)
@@ -73,3 +73,20 @@ class IpAddressError(Exception):
     """
     def __str__(self):
         return 'Некорректный формат ip-адреса'
+
+
+class OutboundQueueOverflow(ConnectionError):
+    """
+    Класс исключения при переполнении очереди исходящих сообщений соединения
+    (клиент не успевает принимать данные)
+    """
+    def __str__(self):
+        return 'Превышен допустимый объём очереди исходящих сообщений соединения'
+
+
+class FederationAuthError(ConnectionError):
+    """
+    Класс исключения при неудачной взаимной авторизации серверов федерации
+    """
+    def __str__(self):
+        return 'Сервер федерации не прошёл авторизацию'
@@ -1,28 +1,303 @@
 """Утилиты"""
 
+import errno
 import json
-from common.variables import MAX_PACKAGE_LENGTH, ENCODING
+import struct
+import weakref
+from collections.abc import Mapping
+
+from common.variables import MAX_PACKAGE_LENGTH, ENCODING, FRAME_HEADER_LENGTH, MAX_FRAME_LENGTH
+from common.wire_codecs import JSON
 import common.custom_exceptions as custom_exceptions
 
 
-def get_message(socket):
+FRAME_HEADER = struct.Struct('>I')
+# Символы, из которых может состоять незавершённая лексема JSON (число, литерал, escape-последовательность)
+TOKEN_CHARS = frozenset('0123456789abcdefABCDEFlnrstuE.+-\\')
+
+# Буферы сборки сообщений, привязанные к сокетам
+BUFFERS = weakref.WeakKeyDictionary()
+
+
+class MessageBuffer:
     """
-    Утилита приёма и декодирования сообщения
-    принимает байты выдаёт словарь, если приняточто-то другое отдаёт ошибку значения
+    Класс буфера сборки сообщений из потока байт одного соединения.
+    В старом режиме сообщения идут в потоке подряд в виде JSON-объектов,
+    в кадровом режиме каждому сообщению предшествует заголовок с длиной тела,
+    а тело кодируется выбранным для соединения кодеком (codec).
+    """
+
+    def __init__(self, framed=False, codec=JSON):
+        """
+        Метод инициализации
+        :param framed: признак кадрового режима
+        :param codec: кодек сообщений (в старом режиме - только JSON)
+        """
+        self.data = bytearray()
+        self.framed = framed
+        self.codec = codec
+
+    def feed(self, chunk):
+        """
+        Метод добавления в буфер принятых байт
+        :param chunk: данные в байтах
+        :return: None
+        """
+        self.data += chunk
+
+    def next_message(self):
+        """
+        Метод извлечения из буфера очередного полностью принятого сообщения
+        :return: словарь или None, если сообщение получено не полностью
+        """
+        if self.framed:
+            return self.next_frame()
+        return self.next_legacy()
+
+    def next_frame(self):
+        """
+        Метод извлечения сообщения в кадровом режиме
+        """
+        if len(self.data) < FRAME_HEADER_LENGTH:
+            return None
+        length, = FRAME_HEADER.unpack_from(self.data)
+        if length > MAX_FRAME_LENGTH:
+            raise custom_exceptions.IncorrectData
+        end = FRAME_HEADER_LENGTH + length
+        if len(self.data) < end:
+            return None
+        body = bytes(self.data[FRAME_HEADER_LENGTH:end])
+        del self.data[:end]
+        return decode_message(body, self.codec)
+
+    def next_legacy(self):
+        """
+        Метод извлечения сообщения в старом режиме (JSON-объекты без разделителей).
+        Незавершённый объект остаётся в буфере до получения следующей порции данных: объект считается
+        незавершённым, если ошибка разбора приходится на конец текста или на его последнюю лексему
+        (число, литерал, escape-последовательность, разрезанные на границе порций).
+        """
+        if not self.data:
+            return None
+        try:
+            text = self.data.decode(ENCODING)
+        except UnicodeDecodeError as error:
+            if error.reason != 'unexpected end of data':
+                raise custom_exceptions.IncorrectData
+            text = self.data[:error.start].decode(ENCODING)
+        start = len(text) - len(text.lstrip())
+        if start == len(text):
+            return None
+        try:
+            response, end = json.JSONDecoder().raw_decode(text, start)
+        except json.JSONDecodeError as error:
+            if error.pos < last_token_start(text) and not error.msg.startswith('Unterminated string'):
+                raise
+            if len(self.data) > MAX_FRAME_LENGTH:
+                raise custom_exceptions.IncorrectData
+            return None
+        del self.data[:len(text[:end].encode(ENCODING))]
+        if isinstance(response, dict):
+            return response
+        raise custom_exceptions.IncorrectData
+
+
+def last_token_start(text):
+    """
+    Утилита получения позиции начала последней лексемы текста JSON (без завершающих пробелов)
+    :param text: текст
+    :return: int
+    """
+    position = len(text.rstrip())
+    while position and text[position - 1] in TOKEN_CHARS:
+        position -= 1
+    return position
+
+
+class PreparedMessage(Mapping):
+    """
+    Класс неизменяемого сообщения (например, постоянного ответа сервера).
+    Кадры сообщения кодируются один раз для каждого кодека и режима и затем отправляются
+    без повторного кодирования; изменяемую копию для построения ответа возвращает метод copy.
+    Сообщение с дополнительным полем (with_field) кодируется добавлением поля к кадрам исходного сообщения.
+    """
+
+    __slots__ = ('message', 'frames', 'base', 'field')
+
+    def __init__(self, message):
+        """
+        Метод инициализации
+        :param message: сообщение в виде словаря (копируется)
+        """
+        self.message = dict(message)
+        self.frames = dict()
+        self.base = None
+        self.field = None
+
+    def __getitem__(self, key):
+        return self.message[key]
+
+    def __iter__(self):
+        return iter(self.message)
+
+    def __len__(self):
+        return len(self.message)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.message!r})'
+
+    def copy(self):
+        """
+        Метод получения изменяемой копии сообщения
+        """
+        return dict(self.message)
+
+    def with_field(self, key, value):
+        """
+        Метод получения сообщения с дополнительным полем (например, ответа с идентификатором запроса).
+        Закодированное исходное сообщение не кодируется заново: поле добавляется к его байтам.
+        :param key: имя поля (если оно уже есть в сообщении, сообщение кодируется полностью)
+        :param value: значение поля
+        :return: объект PreparedMessage
+        """
+        message = PreparedMessage(self.message)
+        message.message[key] = value
+        if key not in self.message:
+            message.base = self
+            message.field = (key, value)
+        return message
+
+    def encode(self, framed, codec):
+        """
+        Метод получения закодированного сообщения (кодируется при первом обращении)
+        :param framed: признак кадрового режима
+        :param codec: кодек сообщений
+        :return: байты
+        """
+        key = (framed, codec.name)
+        data = self.frames.get(key)
+        if data is None:
+            if self.base is None:
+                body = codec.encode(self.message)
+            else:
+                body = codec.add_field(self.base.encode(False, codec), len(self.base), *self.field)
+            if framed:
+                body = FRAME_HEADER.pack(len(body)) + body
+            data = self.frames[key] = body
+        return data
+
+
+def message_buffer(socket):
+    """
+    Утилита получения буфера сборки сообщений сокета (буфер создаётся при первом обращении)
     :param socket: объект сокета
-    :return: словарь
+    :return: объект MessageBuffer
+    """
+    buffer = BUFFERS.get(socket)
+    if buffer is None:
+        buffer = BUFFERS[socket] = MessageBuffer()
+    return buffer
+
+
+def set_framing(socket, framed=True, codec=JSON):
+    """
+    Утилита переключения сокета в кадровый режим (или обратно)
+    :param socket: объект сокета
+    :param framed: признак кадрового режима
+    :param codec: кодек сообщений, согласованный для соединения
+    :return: None
+    """
+    buffer = message_buffer(socket)
+    buffer.framed = framed
+    buffer.codec = codec if framed else JSON
+
+
+def is_framed(socket):
+    """
+    Утилита проверки, переключён ли сокет в кадровый режим
+    :param socket: объект сокета
+    :return: bool
+    """
+    buffer = BUFFERS.get(socket)
+    return buffer is not None and buffer.framed
+
+
+def receive_chunk(socket, buffer):
     """
+    Утилита чтения очередной порции данных из сокета в буфер
+    :param socket: объект сокета
+    :param buffer: объект MessageBuffer
+    :return: None
+    """
+    chunk = socket.recv(MAX_PACKAGE_LENGTH)
+    if not chunk:
+        raise ConnectionResetError(errno.ECONNRESET, 'Соединение закрыто удалённой стороной')
+    buffer.feed(chunk)
 
-    encoded_response = socket.recv(MAX_PACKAGE_LENGTH)
-    if isinstance(encoded_response, bytes):
-        json_response = encoded_response.decode(ENCODING)
-        response = json.loads(json_response)
+
+def decode_message(data, codec=JSON):
+    """
+    Утилита декодирования тела сообщения
+    :param data: тело сообщения в байтах
+    :param codec: кодек сообщений
+    :return: словарь
+    """
+    if isinstance(data, (bytes, bytearray)):
+        response = codec.decode(data)
         if isinstance(response, dict):
             return response
         raise custom_exceptions.IncorrectData
     raise ValueError
 
 
+def encode_message(message, framed=False, codec=JSON):
+    """
+    Утилита кодирования сообщения
+    :param message: сообщение в виде словаря
+    :param framed: признак кадрового режима (добавляется заголовок с длиной тела)
+    :param codec: кодек сообщений
+    :return: байты
+    """
+    if isinstance(message, PreparedMessage):
+        return message.encode(framed, codec)
+    body = codec.encode(message)
+    if framed:
+        return FRAME_HEADER.pack(len(body)) + body
+    return body
+
+
+def get_message(socket):
+    """
+    Утилита приёма и декодирования сообщения
+    принимает байты выдаёт словарь, если приняточто-то другое отдаёт ошибку значения.
+    Если сообщение пришло не полностью, чтение из сокета продолжается.
+    :param socket: объект сокета
+    :return: словарь
+    """
+    buffer = message_buffer(socket)
+    message = buffer.next_message()
+    while message is None:
+        receive_chunk(socket, buffer)
+        message = buffer.next_message()
+    return message
+
+
+def get_messages(socket):
+    """
+    Утилита приёма всех сообщений, собранных после одного чтения из сокета.
+    Сообщения извлекаются по одному, поэтому смена режима сокета во время обработки
+    применяется к оставшимся в буфере данным.
+    :param socket: объект сокета
+    :return: генератор словарей
+    """
+    buffer = message_buffer(socket)
+    receive_chunk(socket, buffer)
+    message = buffer.next_message()
+    while message is not None:
+        yield message
+        message = buffer.next_message()
+
+
 def send_message(socket, message):
     """
     Утилита кодирования и отправки сообщения
@@ -31,7 +306,24 @@ def send_message(socket, message):
     :param message: сообщение в виде словаря
     :return: None
     """
+    buffer = BUFFERS.get(socket)
+    if buffer is None:
+        socket.sendall(encode_message(message))
+    else:
+        socket.sendall(encode_message(message, buffer.framed, buffer.codec))
 
-    json_message = json.dumps(message)
-    encoded_message = json_message.encode(ENCODING)
-    socket.send(encoded_message)
+
+def send_messages(socket, messages):
+    """
+    Утилита отправки нескольких сообщений.
+    В кадровом режиме сообщения отправляются одной записью в сокет.
+    :param socket: объект сокета
+    :param messages: итерируемый объект сообщений в виде словарей
+    :return: None
+    """
+    if is_framed(socket):
+        codec = BUFFERS[socket].codec
+        socket.sendall(b''.join(encode_message(message, True, codec) for message in messages))
+        return
+    for message in messages:
+        socket.sendall(encode_message(message))
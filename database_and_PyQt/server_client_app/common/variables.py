@@ -7,8 +7,63 @@ DEFAULT_PORT = 7777
 DEFAULT_IP_ADDRESS = '127.0.0.1'
 # Максимальная очередь подключений
 MAX_CONNECTIONS = 5
-# Максимальная длинна сообщения в байтах
-MAX_PACKAGE_LENGTH = 1024
+# Размер порции данных, считываемой из сокета за один вызов recv
+MAX_PACKAGE_LENGTH = 65536
+# Длина заголовка кадра (длина тела сообщения в байтах, big-endian)
+FRAME_HEADER_LENGTH = 4
+# Максимальная длина тела одного сообщения в байтах
+MAX_FRAME_LENGTH = 16 * 1024 * 1024
+# Объём неотправленных данных соединения, при превышении которого приостанавливается
+# чтение от клиентов, отправляющих сообщения этому соединению
+OUTBOUND_HIGH_WATERMARK = 1024 * 1024
+# Объём неотправленных данных, при снижении до которого чтение от этих клиентов возобновляется
+OUTBOUND_LOW_WATERMARK = 256 * 1024
+# Максимальный объём неотправленных данных соединения
+OUTBOUND_MAX_LENGTH = 32 * 1024 * 1024
+# Максимальное количество буферов, передаваемых сокету одним вызовом sendmsg (не больше IOV_MAX системы)
+SEND_MAX_BUFFERS = 512
+# Срок хранения сообщений для пользователей не в сети (в секундах)
+OFFLINE_MESSAGE_TTL = 7 * 24 * 60 * 60
+# Максимальное количество хранимых сообщений для одного пользователя не в сети
+OFFLINE_MESSAGE_QUOTA = 1000
+# Интервал записи накопленных счётчиков сообщений в базу (в миллисекундах)
+COUNTERS_FLUSH_INTERVAL = 500
+# Количество сообщений, после которого счётчики записываются в базу, не дожидаясь интервала
+COUNTERS_FLUSH_MESSAGES = 100
+# Режим синхронизации SQLite (в режиме журнала WAL достаточно NORMAL)
+SQLITE_SYNCHRONOUS = 'NORMAL'
+# Размер кэша страниц SQLite для одного соединения (отрицательное значение - в килобайтах)
+SQLITE_CACHE_SIZE = -16384
+# Количество постоянных соединений в пуле соединений с базой данных сервера
+DATABASE_POOL_SIZE = 5
+# Количество дополнительных соединений, открываемых сверх пула при нагрузке
+DATABASE_MAX_OVERFLOW = 10
+# Время, отведённое клиенту на авторизацию после подключения (в секундах)
+HANDSHAKE_TIMEOUT = 10
+# Максимальное количество одновременно проходящих авторизацию подключений
+MAX_PENDING_HANDSHAKES = 100
+# Количество итераций PBKDF2 при вычислении хэша пароля
+PASSWORD_HASH_ITERATIONS = 10000
+# Исполнитель криптографических операций авторизации на сервере: inline, thread или process
+CRYPTO_EXECUTOR = 'thread'
+# Количество рабочих потоков (процессов) исполнителя, 0 - по числу ядер
+CRYPTO_WORKERS = 0
+# Время ожидания завершения работы сервера и отправки данных клиентам при остановке (в секундах)
+SHUTDOWN_TIMEOUT = 5
+# Количество рабочих процессов сервера (шардов), принимающих подключения на общем порту
+SERVER_WORKERS = 1
+# Интервал повторной попытки подключения к другому шарду по шине маршрутизации (в секундах)
+BUS_RECONNECT_INTERVAL = 0.1
+# Интервал повторной попытки подключения к другому серверу федерации (в секундах)
+FEDERATION_RECONNECT_INTERVAL = 1
+# Максимальное количество сообщений, передаваемых серверу федерации одной записью
+FEDERATION_BATCH_SIZE = 500
+# Максимальное количество запросов в одном пакете (действие BATCH)
+BATCH_MAX_REQUESTS = 100
+# Время ожидания клиентом ответа сервера на запрос (в секундах)
+CLIENT_RESPONSE_TIMEOUT = 5
+# Интервал, с которым поток чтения клиента проверяет признак завершения работы (в секундах)
+CLIENT_POLL_INTERVAL = 0.5
 # Кодировка проекта
 ENCODING = 'utf-8'
 # Название базы данных
@@ -39,6 +94,60 @@ ADD_CONTACT = 'add'
 USERS_REQUEST = 'get_users'
 RESPONDEFAULT_IP_ADDRESSSE = 'respondefault_ip_addressse'
 PUBLIC_KEY_REQUEST = 'pubkey_need'
+# Необязательный идентификатор запроса, возвращаемый сервером в ответе на этот запрос
+REQUEST_ID = 'request_id'
+# Пакет запросов, выполняемых сервером за один проход с одним ответом
+BATCH = 'batch'
+REQUESTS = 'requests'
+# Версия списка пользователей сервера и изменения списка (добавленные и удалённые имена) в сообщении 205
+USERS_VERSION = 'users_version'
+USERS_ADDED = 'users_added'
+USERS_REMOVED = 'users_removed'
+# Согласование формата передачи сообщений при приветствии
+FRAMING = 'framing'
+FRAMING_LENGTH_PREFIX = 'length_prefix'
+# Согласование кодека сообщений при приветствии (в кадровом режиме):
+# клиент передаёт список поддерживаемых кодеков, сервер - выбранный кодек
+CODECS = 'codecs'
+CODEC = 'codec'
+CODEC_JSON = 'json'
+CODEC_MSGPACK = 'msgpack'
+# Комнаты (групповые чаты): вступление в комнату и выход из неё, имя комнаты.
+# Сообщение с получателем, начинающимся с префикса комнаты, рассылается всем участникам комнаты
+JOIN = 'join'
+LEAVE = 'leave'
+ROOM = 'room'
+ROOM_PREFIX = '#'
+# Получатели сообщения комнаты, пересланного на другой шард или сервер (участники комнаты, подключённые к нему)
+RECIPIENTS = 'recipients'
+
+# Состояния авторизации соединения:
+# ожидается сообщение presence, ожидается ответ на вызов, ответ проверяется, пользователь авторизован
+AUTH_PENDING = 'pending'
+AUTH_CHALLENGED = 'challenged'
+AUTH_VERIFYING = 'verifying'
+AUTH_DONE = 'authenticated'
+# Служебные сообщения шины маршрутизации между рабочими процессами сервера:
+# пересылка сообщения на шард получателя и изменение присутствия пользователя
+SHARD_ROUTE = 'shard_route'
+SHARD_PRESENCE = 'shard_presence'
+# Изменение состава комнаты (вступление или выход пользователя) на другом шарде
+SHARD_ROOM = 'shard_room'
+SHARD = 'shard'
+ONLINE = 'online'
+JOINED = 'joined'
+# Сообщения канала федерации серверов: приветствие с авторизацией, полный список пользователей сервера,
+# изменение присутствия, изменение состава комнаты, пересылка сообщения и подтверждение получения
+FEDERATION_HELLO = 'federation_hello'
+FEDERATION_SNAPSHOT = 'federation_snapshot'
+FEDERATION_PRESENCE = 'federation_presence'
+FEDERATION_ROOM = 'federation_room'
+FEDERATION_ROUTE = 'federation_route'
+FEDERATION_ACK = 'federation_ack'
+NODE = 'node'
+EPOCH = 'epoch'
+SEQUENCE = 'seq'
+DIGEST = 'digest'
 
 
 # логирование
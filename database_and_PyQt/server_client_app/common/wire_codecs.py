@@ -0,0 +1,140 @@
+"""
+Модуль кодеков сообщений протокола JIM: преобразование словаря сообщения в байты и обратно.
+JSON используется по умолчанию; компактный двоичный кодек MessagePack доступен,
+если установлен пакет msgpack, и выбирается для соединения при приветствии (presence).
+"""
+
+import base64
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import common.custom_exceptions as custom_exceptions
+from common.variables import ENCODING, CODEC_JSON, CODEC_MSGPACK
+
+
+def json_default(value):
+    """
+    Функция преобразования значений, которых нет в JSON: байты (например, зашифрованный текст сообщения)
+    передаются строкой base64, как их передавали клиенты до появления двоичного кодека
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f'Значение типа {type(value).__name__} не может быть передано в JSON')
+
+
+def map_header(size):
+    """
+    Функция кодирования заголовка словаря MessagePack (fixmap, map16 или map32 по количеству полей)
+    """
+    if size < 16:
+        return bytes((0x80 | size,))
+    if size < 0x10000:
+        return b'\xde' + size.to_bytes(2, 'big')
+    return b'\xdf' + size.to_bytes(4, 'big')
+
+
+class JsonCodec:
+    """
+    Класс кодека JSON (кодек по умолчанию)
+    """
+
+    name = CODEC_JSON
+
+    @staticmethod
+    def encode(message):
+        """
+        Метод кодирования сообщения в байты
+        """
+        return json.dumps(message, default=json_default).encode(ENCODING)
+
+    @staticmethod
+    def decode(data):
+        """
+        Метод декодирования сообщения из байт
+        """
+        return json.loads(data.decode(ENCODING))
+
+    @classmethod
+    def add_field(cls, body, size, key, value):
+        """
+        Метод добавления поля к закодированному сообщению без повторного кодирования всего сообщения
+        :param body: закодированное сообщение
+        :param size: количество полей в сообщении
+        :return: байты сообщения с добавленным полем
+        """
+        field = cls.encode(key) + b': ' + cls.encode(value)
+        return body[:-1] + (b', ' if size else b'') + field + b'}'
+
+
+class MsgpackCodec:
+    """
+    Класс двоичного кодека MessagePack. Байты передаются без преобразования в base64.
+    """
+
+    name = CODEC_MSGPACK
+
+    @staticmethod
+    def encode(message):
+        """
+        Метод кодирования сообщения в байты
+        """
+        return msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def decode(data):
+        """
+        Метод декодирования сообщения из байт
+        """
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (ValueError, TypeError, OverflowError):
+            raise custom_exceptions.IncorrectData
+
+    @classmethod
+    def add_field(cls, body, size, key, value):
+        """
+        Метод добавления поля к закодированному сообщению без повторного кодирования всего сообщения
+        (заменяется заголовок словаря с количеством полей)
+        :param body: закодированное сообщение
+        :param size: количество полей в сообщении
+        :return: байты сообщения с добавленным полем
+        """
+        return map_header(size + 1) + body[len(map_header(size)):] + cls.encode(key) + cls.encode(value)
+
+
+JSON = JsonCodec()
+
+# Доступные кодеки в порядке предпочтения
+CODECS = {CODEC_MSGPACK: MsgpackCodec()} if msgpack is not None else {}
+CODECS[CODEC_JSON] = JSON
+
+
+def get_codec(name):
+    """
+    Функция получения кодека по имени
+    :param name: имя кодека (None - кодек по умолчанию)
+    :return: объект кодека
+    """
+    if name is None:
+        return JSON
+    try:
+        return CODECS[name]
+    except (KeyError, TypeError):
+        raise custom_exceptions.IncorrectData
+
+
+def choose_codec(offered):
+    """
+    Функция выбора кодека из предложенных другой стороной (первый известный в порядке предпочтения)
+    :param offered: список имён кодеков
+    :return: объект кодека (JSON, если общих кодеков нет)
+    """
+    if isinstance(offered, list):
+        for name in CODECS:
+            if name in offered:
+                return CODECS[name]
+    return JSON
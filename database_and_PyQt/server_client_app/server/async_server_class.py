@@ -0,0 +1,328 @@
+"""
+Модуль класса бэк-энда сервера на основе asyncio
+"""
+
+
+import asyncio
+import logging
+import threading
+from socket import socket, AF_INET, SOCK_STREAM
+
+import common.custom_exceptions as custom_exceptions
+import common.variables as vrs
+import logs.server_log_config
+from common.utils import MessageBuffer, encode_message
+from common.descriptors import Port, IpAddress
+from common.metaclasses import ServerVerifier
+from common.wire_codecs import JSON
+from server.server_core import ServerCore
+from server.shard_class import enable_reuse_port
+from server.storage_backends import create_storage
+
+
+LOG = logging.getLogger('server')
+
+
+class AsyncConnection:
+    """
+    Класс соединения с клиентом для asyncio-сервера.
+    Хранит буфер сборки входящих сообщений и ограниченную очередь исходящих данных,
+    которую разбирает отдельная задача записи.
+    """
+
+    def __init__(self, reader, writer, on_drained, high_watermark=vrs.OUTBOUND_HIGH_WATERMARK,
+                 low_watermark=vrs.OUTBOUND_LOW_WATERMARK, max_length=vrs.OUTBOUND_MAX_LENGTH):
+        """
+        Метод инициализации
+        :param on_drained: функция, вызываемая при освобождении очереди до нижней границы
+        """
+        self.reader = reader
+        self.writer = writer
+        self.on_drained = on_drained
+        self.buffer = MessageBuffer()
+        self.queue = asyncio.Queue()
+        self.pending_bytes = 0
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_length = max_length
+        self.waiting_senders = set()
+        self.paused = False
+        self.readable = asyncio.Event()
+        self.readable.set()
+        self.closed = False
+        self.auth_state = vrs.AUTH_PENDING
+        self.peername = writer.get_extra_info('peername')
+
+    @property
+    def is_congested(self):
+        """
+        Признак перегрузки очереди исходящих данных (достигнута верхняя граница)
+        """
+        return self.pending_bytes >= self.high_watermark
+
+    @property
+    def is_drained(self):
+        """
+        Признак освобождения очереди исходящих данных (достигнута нижняя граница)
+        """
+        return self.pending_bytes <= self.low_watermark
+
+    def send(self, message):
+        """
+        Метод постановки сообщения в очередь исходящих данных
+        """
+        self.send_many((message,))
+
+    def send_many(self, messages):
+        """
+        Метод постановки нескольких сообщений в очередь (отправляются одной записью)
+        """
+        if self.closed:
+            raise ConnectionResetError('Соединение с клиентом закрыто')
+        frames = [encode_message(message, self.buffer.framed, self.buffer.codec) for message in messages]
+        length = sum(map(len, frames))
+        if self.pending_bytes + length > self.max_length:
+            raise custom_exceptions.OutboundQueueOverflow
+        self.pending_bytes += length
+        for frame in frames:
+            self.queue.put_nowait(frame)
+
+    def close(self):
+        """
+        Метод закрытия соединения. Данные, поставленные в очередь ранее, будут отправлены.
+        """
+        if not self.closed:
+            self.closed = True
+            self.readable.set()
+            self.queue.put_nowait(None)
+
+    def getpeername(self):
+        """
+        Метод получения адреса и порта клиента
+        """
+        return self.peername
+
+    async def write_loop(self):
+        """
+        Задача записи: отправляет накопленные в очереди данные одной записью
+        (буферы передаются транспорту списком, без объединения)
+        """
+        try:
+            while True:
+                data = await self.queue.get()
+                if data is None:
+                    break
+                chunks = [data]
+                while not self.queue.empty():
+                    data = self.queue.get_nowait()
+                    if data is None:
+                        break
+                    chunks.append(data)
+                self.writer.writelines(chunks)
+                await self.writer.drain()
+                self.pending_bytes -= sum(len(chunk) for chunk in chunks)
+                if self.waiting_senders and self.is_drained:
+                    self.on_drained(self)
+                if data is None:
+                    break
+        except OSError:
+            self.closed = True
+        finally:
+            self.pending_bytes = 0
+            if self.waiting_senders:
+                self.on_drained(self)
+            self.writer.close()
+
+
+class AsyncServer(threading.Thread, ServerCore, metaclass=ServerVerifier):
+    """
+    Класс сервера (движок на основе потоков asyncio).
+    Для каждого соединения запускаются задача чтения и задача записи.
+    """
+
+    listen_port = Port()
+    listen_address = IpAddress()
+
+    def __init__(self, listen_port, listen_address, db_path, new_connection, storage_options=None,
+                 reuse_port=False, crypto=None):
+        """
+        Метод инициализации
+        :param storage_options: дополнительные параметры базы данных сервера
+        :param reuse_port: разрешить другим процессам слушать тот же порт (SO_REUSEPORT, работа в несколько шардов)
+        :param crypto: исполнитель криптографических операций (по умолчанию создаётся по константам)
+        """
+        self.reuse_port = reuse_port
+        self.listen_port = listen_port
+        self.listen_address = listen_address
+        self.transport = self.prepare_socket()
+        self.loop = None
+        self.stopping = None
+        self.early_calls = []
+        self.loop_locker = threading.Lock()
+        self.connection_tasks = set()
+        threading.Thread.__init__(self)
+        ServerCore.__init__(self, create_storage(db_path, **(storage_options or {})), new_connection, crypto)
+        LOG.debug(f'Создан объект сервера')
+
+    def prepare_socket(self):
+        """
+        Метод подготовки и запуска сокета сервера
+        """
+        transport = socket(AF_INET, SOCK_STREAM)
+        if self.reuse_port:
+            enable_reuse_port(transport)
+        transport.bind((self.listen_address, self.listen_port))
+        transport.listen(vrs.MAX_CONNECTIONS)
+        transport.setblocking(False)
+        return transport
+
+    def send_to_client(self, client, message):
+        """
+        Метод отправки сообщения клиенту (постановка в очередь соединения)
+        """
+        client.send(message)
+
+    def send_burst(self, client, messages):
+        """
+        Метод отправки клиенту нескольких сообщений одной записью
+        """
+        client.send_many(messages)
+
+    def enable_framing(self, client, codec=JSON):
+        """
+        Метод переключения соединения клиента в кадровый режим с согласованным кодеком сообщений
+        """
+        client.buffer.framed = True
+        client.buffer.codec = codec
+
+    def pause_reading(self, client):
+        """
+        Метод приостановки чтения сообщений клиента
+        """
+        client.paused = True
+        client.readable.clear()
+
+    def resume_reading(self, client):
+        """
+        Метод возобновления чтения сообщений клиента
+        """
+        client.paused = False
+        client.readable.set()
+
+    def outside_loop(self):
+        """
+        Метод проверки, что вызов выполняется не в потоке цикла событий
+        (методы сервера вызываются в том числе из потока графической оболочки)
+        """
+        return self.loop is not None and threading.current_thread() is not self
+
+    def call_soon(self, func, *args):
+        """
+        Метод передачи вызова в цикл событий сервера. Вызовы, переданные до запуска цикла,
+        выполняются при его запуске; после остановки сервера вызовы не выполняются.
+        """
+        with self.loop_locker:
+            if self.loop is None:
+                self.early_calls.append((func, args))
+            elif not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.run_call, func, args)
+
+    def stop(self):
+        """
+        Метод остановки сервера (повторный вызов после остановки ничего не делает)
+        """
+        with self.loop_locker:
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def disconnect_client(self, client):
+        """
+        Метод закрытия соединения с неавторизованным клиентом
+        """
+        self.handshakes.pop(client, None)
+        client.close()
+
+    def remove_client(self, client):
+        """
+        Метод обработчик клиента с которым прервана связь.
+        Ищет клиента и удаляет его из списков и базы:
+        """
+        if self.outside_loop():
+            self.loop.call_soon_threadsafe(self.remove_client, client)
+            return
+        LOG.info(f'Клиент {client.getpeername()} отключился от сервера.')
+        self.unregister_client(client)
+        self.disconnect_client(client)
+
+    def service_update_lists(self, added=(), removed=()):
+        """
+        Метод рассылки клиентам сообщения об обновлении списков клиентов на сервере
+        """
+        if self.outside_loop():
+            self.loop.call_soon_threadsafe(self.service_update_lists, added, removed)
+            return
+        super().service_update_lists(added, removed)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Задача чтения сообщений одного клиента
+        """
+        client = AsyncConnection(reader, writer, self.release_senders)
+        LOG.info(f'Установлено соедение с клиентом {client.getpeername()}')
+        writer_task = asyncio.create_task(client.write_loop())
+        if not self.open_handshake(client):
+            client.close()
+            await writer_task
+            return
+        self.connection_tasks.add(asyncio.current_task())
+        try:
+            while not client.closed:
+                await client.readable.wait()
+                data = await reader.read(vrs.MAX_PACKAGE_LENGTH)
+                if not data:
+                    break
+                client.buffer.feed(data)
+                self.process_buffered(client)
+        except Exception as err:
+            LOG.debug(f'Ошибка обработки сообщений клиента {client.getpeername()}', exc_info=err)
+        if not client.closed:
+            self.remove_client(client)
+        await writer_task
+        self.connection_tasks.discard(asyncio.current_task())
+
+    async def watch_handshakes(self):
+        """
+        Задача закрытия соединений, не завершивших авторизацию в отведённое время
+        """
+        while True:
+            await asyncio.sleep(1)
+            self.expire_handshakes()
+
+    async def serve(self):
+        """
+        Метод запуска asyncio-сервера на подготовленном сокете
+        """
+        self.stopping = asyncio.Event()
+        with self.loop_locker:
+            self.loop = asyncio.get_running_loop()
+            for func, args in self.early_calls:
+                self.loop.call_soon(self.run_call, func, args)
+            self.early_calls.clear()
+        handshakes_task = asyncio.create_task(self.watch_handshakes())
+        server = await asyncio.start_server(self.handle_connection, sock=self.transport)
+        # Соединения закрываются до выхода из блока: начиная с Python 3.12.1 выход из него
+        # (wait_closed) ожидает завершения обработчиков всех соединений
+        async with server:
+            await self.stopping.wait()
+            handshakes_task.cancel()
+            self.close_connections()
+            if self.connection_tasks:
+                await asyncio.wait(self.connection_tasks, timeout=vrs.SHUTDOWN_TIMEOUT)
+        LOG.info('Сервер остановлен')
+
+    def run(self):
+        """
+        Основной метод сервера.
+        """
+        LOG.info(f'Запущен сервер. Порт подключений: {self.listen_port}, адрес прослушивания: {self.listen_address}')
+        asyncio.run(self.serve())
@@ -0,0 +1,164 @@
+"""
+Модуль класса соединения с клиентом для движков сервера на неблокирующих сокетах
+"""
+
+
+from collections import deque
+from itertools import islice
+
+import common.custom_exceptions as custom_exceptions
+import common.variables as vrs
+from common.utils import MessageBuffer, encode_message, receive_chunk
+
+
+class ClientConnection:
+    """
+    Класс соединения с клиентом.
+    Хранит неблокирующий сокет, буфер сборки входящих сообщений и ограниченную очередь
+    исходящих данных, которые отправляются по мере готовности сокета к записи.
+    Очередь содержит закодированные сообщения (в том числе общие для всех соединений
+    заранее закодированные ответы) и передаётся сокету без копирования в общий буфер.
+    """
+
+    def __init__(self, sock, high_watermark=vrs.OUTBOUND_HIGH_WATERMARK,
+                 low_watermark=vrs.OUTBOUND_LOW_WATERMARK, max_length=vrs.OUTBOUND_MAX_LENGTH):
+        """
+        Метод инициализации
+        :param sock: неблокирующий сокет клиента
+        :param high_watermark: объём очереди, начиная с которого соединение считается перегруженным
+        :param low_watermark: объём очереди, до которого она должна освободиться для снятия перегрузки
+        :param max_length: максимальный объём очереди
+        """
+        self.sock = sock
+        self.buffer = MessageBuffer()
+        self.outbound = deque()
+        self.pending_bytes = 0
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_length = max_length
+        self.waiting_senders = set()
+        self.paused = False
+        self.closed = False
+        self.auth_state = vrs.AUTH_PENDING
+        self.events = 0
+        # sendmsg есть не на всех платформах (нет в Windows), без него буферы отправляются по одному
+        self.vectored = hasattr(sock, 'sendmsg')
+        self.peername = sock.getpeername()
+
+    def fileno(self):
+        """
+        Метод получения файлового дескриптора сокета
+        """
+        return self.sock.fileno()
+
+    def getpeername(self):
+        """
+        Метод получения адреса и порта клиента
+        """
+        return self.peername
+
+    @property
+    def has_pending_output(self):
+        """
+        Признак наличия неотправленных данных
+        """
+        return bool(self.outbound)
+
+    @property
+    def is_congested(self):
+        """
+        Признак перегрузки очереди исходящих данных (достигнута верхняя граница)
+        """
+        return self.pending_bytes >= self.high_watermark
+
+    @property
+    def is_drained(self):
+        """
+        Признак освобождения очереди исходящих данных (достигнута нижняя граница)
+        """
+        return self.pending_bytes <= self.low_watermark
+
+    def send(self, message):
+        """
+        Метод постановки сообщения в очередь исходящих данных
+        """
+        self.send_many((message,))
+
+    def send_many(self, messages):
+        """
+        Метод постановки нескольких сообщений в очередь (отправляются одной записью)
+        """
+        if self.closed:
+            raise ConnectionResetError('Соединение с клиентом закрыто')
+        frames = [encode_message(message, self.buffer.framed, self.buffer.codec) for message in messages]
+        length = sum(map(len, frames))
+        if self.pending_bytes + length > self.max_length:
+            raise custom_exceptions.OutboundQueueOverflow
+        self.outbound.extend(frames)
+        self.pending_bytes += length
+
+    def flush(self):
+        """
+        Метод отправки накопленных данных без блокировки.
+        Буферы очереди передаются сокету одним вызовом sendmsg без объединения
+        (если sendmsg недоступен - по одному буферу вызовом send).
+        Если сокет принял только часть данных, в начале очереди остаётся memoryview
+        неотправленного остатка (без копирования).
+        Возвращает True, если часть данных осталась неотправленной.
+        """
+        while self.outbound:
+            if self.vectored:
+                chunks = list(islice(self.outbound, vrs.SEND_MAX_BUFFERS))
+            else:
+                chunks = [self.outbound[0]]
+            try:
+                sent = self.sock.sendmsg(chunks) if self.vectored else self.sock.send(chunks[0])
+            except (BlockingIOError, InterruptedError):
+                break
+            self.pending_bytes -= sent
+            for chunk in chunks:
+                if sent < len(chunk):
+                    if sent:
+                        self.outbound[0] = memoryview(chunk)[sent:]
+                    return True
+                sent -= len(chunk)
+                self.outbound.popleft()
+        return self.has_pending_output
+
+    def receive(self):
+        """
+        Метод чтения данных из сокета. Возвращает генератор всех полностью принятых сообщений.
+        Сообщения, оставшиеся в буфере после приостановки чтения, выдаются до чтения из сокета.
+        Если при обработке сообщения чтение приостановлено (например, на время проверки ответа
+        на вызов авторизации), следующие сообщения остаются в буфере.
+        """
+        yield from self.buffered_messages()
+        if self.closed or self.paused:
+            return
+        receive_chunk(self.sock, self.buffer)
+        yield from self.buffered_messages()
+
+    def buffered_messages(self):
+        """
+        Метод получения полностью принятых сообщений из буфера, пока чтение не приостановлено
+        """
+        while not self.closed and not self.paused:
+            message = self.buffer.next_message()
+            if message is None:
+                return
+            yield message
+
+    def close(self):
+        """
+        Метод закрытия соединения (с попыткой отправить оставшиеся данные)
+        """
+        if self.closed:
+            return
+        try:
+            self.flush()
+        except OSError:
+            pass
+        self.closed = True
+        self.outbound.clear()
+        self.pending_bytes = 0
+        self.sock.close()
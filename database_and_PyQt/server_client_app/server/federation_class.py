@@ -0,0 +1,401 @@
+"""
+Модуль классов федерации серверов: постоянные соединения между серверами (узлами),
+по которым передаются изменения присутствия пользователей и сообщения для пользователей других узлов.
+
+Каждый узел открывает исходящее соединение к каждому известному узлу и передаёт по нему свои данные,
+а входящие соединения принимает на отдельном порту федерации. Соединения используют кадровый режим JIM.
+При подключении узлы проверяют друг друга по общему секрету (ответ на вызов, как при авторизации клиента;
+подписываемые данные включают направление ответа и имена обоих узлов, поэтому ответ одной стороны
+нельзя переслать как ответ другой), затем передаётся полный список пользователей узла.
+Изменения присутствия и сообщения нумеруются и хранятся у отправителя до подтверждения получения;
+после переподключения неподтверждённые сообщения передаются повторно, а получатель пропускает
+уже обработанные номера.
+"""
+
+
+import binascii
+import json
+import logging
+import os
+import threading
+from collections import deque
+from itertools import islice
+from socket import create_connection, socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+
+import common.variables as vrs
+import logs.server_log_config
+from common.crypto import challenge_digest, verify_challenge
+from common.custom_exceptions import FederationAuthError, IncorrectData
+from common.utils import get_message, get_messages, send_message, send_messages, set_framing
+
+
+LOG = logging.getLogger('server')
+
+# Ошибки соединения с узлом и некорректных данных узла (в том числе сообщений без нужных ключей),
+# при которых соединение закрывается
+PEER_ERRORS = (OSError, ValueError, KeyError, TypeError, IncorrectData)
+
+# Назначение подписи: ответ принимающего узла на вызов подключающегося и ответ подключающегося узла
+SIGN_HELLO = 'hello'
+SIGN_REPLY = 'reply'
+
+
+def make_challenge():
+    """
+    Функция получения случайной строки-вызова
+    """
+    return binascii.hexlify(os.urandom(32)).decode('ascii')
+
+
+def signed_data(purpose, initiator, responder, challenge):
+    """
+    Функция получения подписываемых данных: назначение подписи, имена подключающегося
+    и принимающего узлов и строка-вызов
+    """
+    return json.dumps([purpose, initiator, responder, challenge]).encode(vrs.ENCODING)
+
+
+def sign_challenge(secret, purpose, initiator, responder, challenge):
+    """
+    Функция вычисления ответа на вызов по общему секрету федерации
+    :param purpose: назначение подписи (SIGN_HELLO или SIGN_REPLY)
+    :param initiator: имя подключающегося узла
+    :param responder: имя принимающего узла
+    :return: ответ в base64 (строка)
+    """
+    digest = challenge_digest(secret, signed_data(purpose, initiator, responder, challenge))
+    return binascii.b2a_base64(digest).decode('ascii')
+
+
+def check_signature(secret, purpose, initiator, responder, challenge, signature):
+    """
+    Функция проверки ответа на вызов
+    """
+    try:
+        return verify_challenge(secret, signed_data(purpose, initiator, responder, challenge),
+                                binascii.a2b_base64(signature))
+    except (TypeError, AttributeError, binascii.Error):
+        return False
+
+
+def parse_peers(peers):
+    """
+    Функция разбора списка узлов федерации из конфигурации
+    :param peers: строка вида "имя@адрес:порт, имя@адрес:порт"
+    :return: словарь {имя узла: (адрес, порт)}
+    """
+    result = dict()
+    for peer in filter(None, (item.strip() for item in peers.split(','))):
+        node, address = peer.split('@', 1)
+        host, port = address.rsplit(':', 1)
+        result[node] = (host, int(port))
+    return result
+
+
+class FederationPeer:
+    """
+    Класс исходящего соединения с узлом федерации. Изменения присутствия и сообщения получают
+    порядковые номера и хранятся в очереди до подтверждения; поток отправки передаёт накопившиеся
+    сообщения одной записью, поток чтения обрабатывает подтверждения.
+    """
+
+    def __init__(self, federation, node, address):
+        """
+        Метод инициализации
+        :param federation: объект Federation своего узла
+        :param node: имя узла-получателя
+        :param address: адрес и порт федерации узла-получателя
+        """
+        self.federation = federation
+        self.node = node
+        self.address = address
+        self.epoch = make_challenge()
+        self.condition = threading.Condition()
+        self.unacked = deque()
+        self.next_sequence = 1
+        self.send_from = 1
+        self.sock = None
+        self.broken = False
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def enqueue(self, message):
+        """
+        Метод постановки сообщения в очередь отправки (вызывается из потока сервера)
+        """
+        with self.condition:
+            message[vrs.SEQUENCE] = self.next_sequence
+            self.unacked.append(message)
+            self.next_sequence += 1
+            self.condition.notify()
+
+    def acknowledge(self, sequence):
+        """
+        Метод удаления из очереди сообщений, получение которых подтверждено узлом
+        """
+        with self.condition:
+            while self.unacked and self.unacked[0][vrs.SEQUENCE] <= sequence:
+                self.unacked.popleft()
+
+    def close(self):
+        """
+        Метод завершения работы соединения
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def open_socket(self):
+        """
+        Метод подключения к узлу и взаимной проверки по общему секрету
+        """
+        sock = create_connection(self.address, timeout=vrs.SHUTDOWN_TIMEOUT)
+        try:
+            set_framing(sock)
+            challenge = make_challenge()
+            send_message(sock, {
+                vrs.ACTION: vrs.FEDERATION_HELLO,
+                vrs.NODE: self.federation.node,
+                vrs.EPOCH: self.epoch,
+                vrs.DATA: challenge,
+            })
+            answer = get_message(sock)
+            if answer.get(vrs.RESPONSE) != 511 or answer.get(vrs.NODE) != self.node or \
+                    not isinstance(answer.get(vrs.DATA), str) or \
+                    not check_signature(self.federation.secret, SIGN_HELLO, self.federation.node, self.node,
+                                        challenge, answer.get(vrs.DIGEST)):
+                raise FederationAuthError
+            send_message(sock, {
+                vrs.RESPONSE: 511,
+                vrs.DIGEST: sign_challenge(self.federation.secret, SIGN_REPLY, self.federation.node, self.node,
+                                           answer[vrs.DATA])})
+            if get_message(sock).get(vrs.RESPONSE) != 200:
+                raise FederationAuthError
+            sock.settimeout(None)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def read_acks(self, sock):
+        """
+        Метод потока чтения подтверждений получения
+        """
+        try:
+            while True:
+                message = get_message(sock)
+                if message.get(vrs.ACTION) == vrs.FEDERATION_ACK:
+                    self.acknowledge(message[vrs.SEQUENCE])
+        except PEER_ERRORS:
+            pass
+        with self.condition:
+            if self.sock is sock:
+                self.broken = True
+                self.condition.notify()
+
+    def run(self):
+        """
+        Метод потока отправки: подключение, передача полного списка пользователей узла,
+        затем передача очереди пачками; при разрыве соединения - переподключение и повторная передача
+        неподтверждённых сообщений
+        """
+        while not self.closed:
+            try:
+                sock = self.open_socket()
+            except PEER_ERRORS as err:
+                LOG.debug(f'Федерация: узел {self.node} недоступен: {err}')
+                with self.condition:
+                    self.condition.wait(vrs.FEDERATION_RECONNECT_INTERVAL)
+                continue
+            LOG.info(f'Федерация: установлено соединение с узлом {self.node}')
+            with self.condition:
+                self.sock = sock
+                self.broken = False
+                self.send_from = self.unacked[0][vrs.SEQUENCE] if self.unacked else self.next_sequence
+            threading.Thread(target=self.read_acks, args=(sock,), daemon=True).start()
+            try:
+                send_message(sock, {
+                    vrs.ACTION: vrs.FEDERATION_SNAPSHOT, vrs.LIST_INFO: self.federation.local_users()})
+                self.send_loop(sock)
+            except OSError as err:
+                LOG.warning(f'Федерация: соединение с узлом {self.node} прервано: {err}')
+            sock.close()
+
+    def send_loop(self, sock):
+        """
+        Метод передачи очереди сообщений до закрытия или разрыва соединения
+        """
+        while True:
+            with self.condition:
+                while not self.closed and not self.broken and self.send_from >= self.next_sequence:
+                    self.condition.wait()
+                if self.closed or self.broken:
+                    return
+                start = self.send_from - self.unacked[0][vrs.SEQUENCE] if self.unacked else 0
+                batch = list(islice(self.unacked, start, start + vrs.FEDERATION_BATCH_SIZE))
+                self.send_from += len(batch)
+            send_messages(sock, batch)
+
+
+class Federation:
+    """
+    Класс канала федерации узла (канал связи сервера): принимает соединения других узлов
+    и держит исходящие соединения к ним.
+    """
+
+    def __init__(self, node, listen_address, listen_port, peers, secret):
+        """
+        Метод инициализации
+        :param node: имя своего узла
+        :param peers: словарь {имя узла: (адрес, порт федерации)}
+        :param secret: общий секрет узлов федерации (не может быть пустым)
+        """
+        if not secret:
+            raise ValueError('Не задан общий секрет федерации (federation_secret)')
+        self.node = node
+        self.secret = secret.encode(vrs.ENCODING)
+        self.server = None
+        self.users = set()
+        self.users_lock = threading.Lock()
+        self.received = dict()
+        self.connections = dict()
+        self.peers = {name: FederationPeer(self, name, address) for name, address in peers.items()}
+        self.transport = socket(AF_INET, SOCK_STREAM)
+        self.transport.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.transport.bind((listen_address, listen_port))
+        self.transport.listen(len(peers) + 1)
+
+    def start(self, server):
+        """
+        Метод запуска приёма соединений и подключения к узлам федерации
+        """
+        self.server = server
+        threading.Thread(target=self.accept_peers, daemon=True).start()
+        for peer in self.peers.values():
+            peer.thread.start()
+        LOG.info(f'Федерация: узел {self.node}, порт {self.transport.getsockname()[1]}, '
+                 f'узлы: {", ".join(self.peers) or "нет"}')
+
+    def local_users(self):
+        """
+        Метод получения списка пользователей, подключённых к своему узлу
+        """
+        with self.users_lock:
+            return list(self.users)
+
+    def publish_presence(self, account_name, online):
+        """
+        Метод оповещения всех узлов о подключении или отключении пользователя
+        """
+        with self.users_lock:
+            if online:
+                self.users.add(account_name)
+            else:
+                self.users.discard(account_name)
+        for peer in self.peers.values():
+            peer.enqueue({vrs.ACTION: vrs.FEDERATION_PRESENCE, vrs.ACCOUNT_NAME: account_name, vrs.ONLINE: online})
+
+    def publish_room(self, account_name, room, joined):
+        """
+        Метод оповещения всех узлов о вступлении пользователя в комнату или выходе из неё
+        """
+        for peer in self.peers.values():
+            peer.enqueue({vrs.ACTION: vrs.FEDERATION_ROOM, vrs.USER: account_name, vrs.ROOM: room, vrs.JOINED: joined})
+
+    def route(self, node, message):
+        """
+        Метод пересылки сообщения пользователю другого узла
+        """
+        self.peers[node].enqueue({vrs.ACTION: vrs.FEDERATION_ROUTE, vrs.DATA: message})
+
+    def close(self):
+        """
+        Метод закрытия канала федерации
+        """
+        self.transport.close()
+        for peer in self.peers.values():
+            peer.close()
+
+    def accept_peers(self):
+        """
+        Метод потока приёма соединений других узлов
+        """
+        while True:
+            try:
+                sock, address = self.transport.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_peer, args=(sock, address), daemon=True).start()
+
+    def authorize_peer(self, sock):
+        """
+        Метод проверки подключившегося узла по общему секрету (с ответом на его вызов)
+        :return: имя узла и идентификатор его сеанса отправки
+        """
+        sock.settimeout(vrs.SHUTDOWN_TIMEOUT)
+        hello = get_message(sock)
+        node = hello.get(vrs.NODE)
+        if hello.get(vrs.ACTION) != vrs.FEDERATION_HELLO or node not in self.peers or \
+                not isinstance(hello.get(vrs.DATA), str):
+            raise FederationAuthError
+        challenge = make_challenge()
+        send_message(sock, {
+            vrs.RESPONSE: 511,
+            vrs.NODE: self.node,
+            vrs.DATA: challenge,
+            vrs.DIGEST: sign_challenge(self.secret, SIGN_HELLO, node, self.node, hello[vrs.DATA]),
+        })
+        if not check_signature(self.secret, SIGN_REPLY, node, self.node, challenge, get_message(sock).get(vrs.DIGEST)):
+            send_message(sock, {vrs.RESPONSE: 400, vrs.ERROR: 'Неверный ответ на вызов.'})
+            raise FederationAuthError
+        send_message(sock, {vrs.RESPONSE: 200})
+        sock.settimeout(None)
+        return node, hello.get(vrs.EPOCH)
+
+    def serve_peer(self, sock, address):
+        """
+        Метод потока входящего соединения узла: обработка сообщений с пропуском уже полученных номеров,
+        подтверждение получения после каждой прочитанной пачки. При разрыве соединения пользователи узла
+        перестают считаться подключёнными (до получения нового списка при переподключении).
+        """
+        set_framing(sock)
+        with sock:
+            try:
+                node, epoch = self.authorize_peer(sock)
+            except PEER_ERRORS as err:
+                LOG.warning(f'Федерация: отклонено соединение {address}: {err}')
+                return
+            LOG.info(f'Федерация: узел {node} подключился с адреса {address}')
+            self.connections[node] = sock
+            last = self.received.get((node, epoch), 0)
+            try:
+                while True:
+                    for message in get_messages(sock):
+                        sequence = message.get(vrs.SEQUENCE)
+                        if sequence is None:
+                            self.process_message(node, message)
+                        elif sequence > last:
+                            last = sequence
+                            self.process_message(node, message)
+                    self.received[(node, epoch)] = last
+                    send_message(sock, {vrs.ACTION: vrs.FEDERATION_ACK, vrs.SEQUENCE: last})
+            except PEER_ERRORS as err:
+                LOG.info(f'Федерация: соединение узла {node} закрыто: {err}')
+            if self.connections.get(node) is sock:
+                del self.connections[node]
+                self.server.call_soon(self.server.remote_snapshot, self, node, [])
+
+    def process_message(self, node, message):
+        """
+        Метод передачи полученного от узла сообщения в поток сервера
+        """
+        action = message.get(vrs.ACTION)
+        if action == vrs.FEDERATION_SNAPSHOT:
+            self.server.call_soon(self.server.remote_snapshot, self, node, message[vrs.LIST_INFO])
+        elif action == vrs.FEDERATION_PRESENCE:
+            self.server.call_soon(self.server.remote_presence, self, node,
+                                  message[vrs.ACCOUNT_NAME], message[vrs.ONLINE])
+        elif action == vrs.FEDERATION_ROOM:
+            self.server.call_soon(self.server.remote_room, message[vrs.USER], message[vrs.ROOM], message[vrs.JOINED])
+        elif action == vrs.FEDERATION_ROUTE:
+            self.server.call_soon(self.server.deliver_routed, message[vrs.DATA])
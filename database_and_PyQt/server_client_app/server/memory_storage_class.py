@@ -0,0 +1,250 @@
+"""
+Модуль класса базы данных сервера, хранящей данные в памяти процесса
+"""
+
+
+import datetime
+import threading
+from collections import deque
+
+from common.variables import OFFLINE_MESSAGE_TTL, OFFLINE_MESSAGE_QUOTA
+from server.server_storage_class import UserRecord
+
+
+class MemoryStorage:
+    """
+    Класс базы данных сервера в памяти (без SQL и без записи на диск).
+    Реализует тот же набор методов, что и ServerStorage; используется для тестов
+    и замеров производительности. Данные теряются при остановке сервера.
+    """
+
+    def __init__(self, db_path=None, offline_ttl=OFFLINE_MESSAGE_TTL, offline_quota=OFFLINE_MESSAGE_QUOTA):
+        """
+        Метод инициализации
+        :param db_path: не используется (для совместимости с ServerStorage)
+        :param offline_ttl: срок хранения сообщений для пользователей не в сети (в секундах)
+        :param offline_quota: максимальное количество хранимых сообщений для одного пользователя
+        """
+        self.offline_ttl = datetime.timedelta(seconds=offline_ttl)
+        self.offline_quota = offline_quota
+        self.users = dict()
+        self.pubkeys = dict()
+        self.last_login = dict()
+        self.active_users = dict()
+        self.history = list()
+        self.contacts = dict()
+        self.counters = dict()
+        self.offline_messages = dict()
+        self.rooms = dict()
+        self.next_id = 1
+        self.locker = threading.RLock()
+
+    def close(self):
+        """
+        Метод завершения работы с базой
+        """
+
+    def batch(self, operations):
+        """
+        Метод выполнения нескольких операций как одной (под общей блокировкой)
+        :param operations: функция без аргументов, выполняющая операции с базой
+        :return: результат функции
+        """
+        with self.locker:
+            return operations()
+
+    def get_user_record(self, name):
+        """
+        Метод получения записи пользователя (id, хэш пароля).
+        Возвращает None, если пользователь не зарегистрирован.
+        """
+        return self.users.get(name)
+
+    def cache_stats(self):
+        """
+        Метод получения статистики кэша пользователей (все записи всегда в памяти)
+        """
+        return {'hits': 0, 'misses': 0, 'size': len(self.users)}
+
+    def login_user(self, username, ip_address, port, key):
+        """
+        Метод для записи данных о входе пользователя
+        """
+        with self.locker:
+            user = self.users.get(username)
+            if not user:
+                raise ValueError('Пользователь не зарегистрирован.')
+            login_time = datetime.datetime.now()
+            self.pubkeys[username] = key
+            self.last_login[username] = login_time
+            self.active_users[username] = (ip_address, port, login_time)
+            self.history.append((username, login_time, ip_address, port))
+
+    def logout_user(self, username):
+        """
+        Метод, удаляющий пользователя из списка активных при выходе из чата
+        """
+        with self.locker:
+            self.active_users.pop(username, None)
+
+    def add_user(self, name, passwd_hash):
+        """
+        Метод регистрации пользователя.
+        Принимает имя и хэш пароля, создаёт запись статистики.
+        """
+        with self.locker:
+            self.users[name] = UserRecord(self.next_id, passwd_hash)
+            self.next_id += 1
+            self.last_login[name] = None
+            self.contacts[name] = dict()
+            self.counters[name] = [0, 0]
+
+    def remove_user(self, name):
+        """
+        Метод, удаляющий пользователя
+        """
+        with self.locker:
+            for storage in (self.users, self.pubkeys, self.last_login, self.active_users, self.contacts,
+                            self.counters, self.offline_messages):
+                storage.pop(name, None)
+            for contacts in self.contacts.values():
+                contacts.pop(name, None)
+            for members in self.rooms.values():
+                members.discard(name)
+            self.history = [row for row in self.history if row[0] != name]
+
+    def users_all(self):
+        """
+        Метод получения всех пользователей (логины и дата последнего входа)
+        """
+        with self.locker:
+            return [(name, self.last_login[name]) for name in self.users]
+
+    def users_active(self):
+        """
+        Метод получения всех активных пользователей
+        """
+        with self.locker:
+            return [(name, *data) for name, data in self.active_users.items()]
+
+    def login_history(self, username=None):
+        """
+        Метод получения всех записей или записей по конкретному пользователю из истории входа
+        """
+        with self.locker:
+            return [row for row in self.history if not username or row[0] == username]
+
+    def process_message(self, sender, receiver):
+        """
+        Метод обновления количества полученных и отправленных сообщений
+        """
+        with self.locker:
+            if sender in self.counters:
+                self.counters[sender][0] += 1
+            if receiver in self.counters:
+                self.counters[receiver][1] += 1
+
+    def add_contact(self, user, contact):
+        """
+        Метод добавления контакта
+        """
+        with self.locker:
+            if user in self.contacts and contact in self.users:
+                self.contacts[user][contact] = None
+
+    def remove_contact(self, user, contact):
+        """
+        Метод удаления контакта
+        """
+        with self.locker:
+            self.contacts.get(user, {}).pop(contact, None)
+
+    def get_contacts(self, username):
+        """
+        Метод получения списка контактов пользователя
+        """
+        with self.locker:
+            return list(self.contacts[username])
+
+    def join_room(self, username, room):
+        """
+        Метод добавления пользователя в комнату.
+        Возвращает False, если пользователь не зарегистрирован.
+        """
+        with self.locker:
+            if username not in self.users:
+                return False
+            self.rooms.setdefault(room, set()).add(username)
+            return True
+
+    def leave_room(self, username, room):
+        """
+        Метод удаления пользователя из комнаты
+        """
+        with self.locker:
+            self.rooms.get(room, set()).discard(username)
+
+    def rooms_all(self):
+        """
+        Метод получения состава всех комнат
+        :return: словарь имя комнаты -> множество имён участников
+        """
+        with self.locker:
+            return {room: set(members) for room, members in self.rooms.items() if members}
+
+    def room_members(self, room):
+        """
+        Метод получения состава комнаты
+        :return: множество имён участников
+        """
+        with self.locker:
+            return set(self.rooms.get(room, ()))
+
+    def message_history(self):
+        """
+        Метод получения истории сообщений
+        """
+        with self.locker:
+            return [(name, self.last_login[name], *self.counters[name]) for name in self.users]
+
+    def get_hash(self, name):
+        """
+        Метод получения хэша пароля пользователя.
+        """
+        return self.users[name].passwd_hash
+
+    def get_pubkey(self, name):
+        """
+        Метод получения публичного ключа пользователя.
+        """
+        return self.pubkeys.get(name)
+
+    def check_user(self, name):
+        """
+        Метод проверяющий существование пользователя.
+        """
+        return name in self.users
+
+    def store_offline_message(self, sender, receiver, message):
+        """
+        Метод сохранения сообщения для пользователя не в сети.
+        Возвращает False, если получатель не найден или его квота сообщений исчерпана.
+        """
+        with self.locker:
+            if receiver not in self.users:
+                return False
+            messages = self.offline_messages.setdefault(receiver, deque())
+            if len(messages) >= self.offline_quota:
+                return False
+            messages.append((message, datetime.datetime.now()))
+            return True
+
+    def pop_offline_messages(self, username):
+        """
+        Метод получения и удаления всех сохранённых сообщений пользователя.
+        Сообщения с истёкшим сроком хранения удаляются без выдачи.
+        """
+        with self.locker:
+            messages = self.offline_messages.pop(username, ())
+        expire_time = datetime.datetime.now() - self.offline_ttl
+        return [message for message, created in messages if created >= expire_time]
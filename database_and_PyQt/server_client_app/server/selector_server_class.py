@@ -0,0 +1,279 @@
+"""
+Модуль класса бэк-энда сервера на основе selectors (epoll/kqueue)
+"""
+
+
+import logging
+import selectors
+import threading
+from collections import deque
+from socket import socket, socketpair, AF_INET, SOCK_STREAM
+
+import common.variables as vrs
+import logs.server_log_config
+from common.descriptors import Port, IpAddress
+from common.metaclasses import ServerVerifier
+from common.wire_codecs import JSON
+from server.connection_class import ClientConnection
+from server.server_core import ServerCore
+from server.shard_class import enable_reuse_port
+from server.storage_backends import create_storage
+
+
+LOG = logging.getLogger('server')
+
+
+class SelectorServer(threading.Thread, ServerCore, metaclass=ServerVerifier):
+    """
+    Класс сервера (движок на основе selectors.DefaultSelector).
+    Сокеты клиентов всегда отслеживаются на чтение, а на запись -
+    только пока у соединения есть неотправленные данные.
+    """
+
+    listen_port = Port()
+    listen_address = IpAddress()
+
+    def __init__(self, listen_port, listen_address, db_path, new_connection, storage_options=None,
+                 reuse_port=False, crypto=None):
+        """
+        Метод инициализации
+        :param storage_options: дополнительные параметры базы данных сервера
+        :param reuse_port: разрешить другим процессам слушать тот же порт (SO_REUSEPORT, работа в несколько шардов)
+        :param crypto: исполнитель криптографических операций (по умолчанию создаётся по константам)
+        """
+        self.reuse_port = reuse_port
+        self.listen_port = listen_port
+        self.listen_address = listen_address
+        self.selector = selectors.DefaultSelector()
+        self.transport = self.prepare_socket()
+        self.wakeup_receiver, self.wakeup_sender = socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ, self.wakeup_receiver)
+        self.calls = deque()
+        self.dirty = set()
+        self.running = True
+        threading.Thread.__init__(self)
+        ServerCore.__init__(self, create_storage(db_path, **(storage_options or {})), new_connection, crypto)
+        LOG.debug(f'Создан объект сервера')
+
+    def prepare_socket(self):
+        """
+        Метод подготовки и запуска сокета сервера
+        """
+        transport = socket(AF_INET, SOCK_STREAM)
+        if self.reuse_port:
+            enable_reuse_port(transport)
+        transport.bind((self.listen_address, self.listen_port))
+        transport.listen(vrs.MAX_CONNECTIONS)
+        transport.setblocking(False)
+        self.selector.register(transport, selectors.EVENT_READ, None)
+        return transport
+
+    def outside_loop(self):
+        """
+        Метод проверки, что вызов выполняется не в потоке сервера
+        (методы сервера вызываются в том числе из потока графической оболочки)
+        """
+        return self.is_alive() and threading.current_thread() is not self
+
+    def call_soon(self, func, *args):
+        """
+        Метод передачи вызова в поток сервера
+        """
+        self.calls.append((func, args))
+        self.wakeup()
+
+    def wakeup(self):
+        """
+        Метод пробуждения цикла сервера, ожидающего событий сокетов
+        """
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def stop(self):
+        """
+        Метод остановки сервера: цикл завершится после текущей итерации
+        """
+        self.running = False
+        self.wakeup()
+
+    def send_to_client(self, client, message):
+        """
+        Метод отправки сообщения клиенту (данные отправляются в конце итерации цикла)
+        """
+        client.send(message)
+        self.dirty.add(client)
+
+    def send_burst(self, client, messages):
+        """
+        Метод отправки клиенту нескольких сообщений одной записью
+        """
+        client.send_many(messages)
+        self.dirty.add(client)
+
+    def enable_framing(self, client, codec=JSON):
+        """
+        Метод переключения соединения клиента в кадровый режим с согласованным кодеком сообщений
+        """
+        client.buffer.framed = True
+        client.buffer.codec = codec
+
+    def pause_reading(self, client):
+        """
+        Метод приостановки чтения сообщений клиента
+        """
+        client.paused = True
+        self.update_events(client)
+
+    def resume_reading(self, client):
+        """
+        Метод возобновления чтения сообщений клиента
+        """
+        client.paused = False
+        self.update_events(client)
+
+    def update_events(self, client):
+        """
+        Метод обновления набора отслеживаемых событий сокета клиента: чтение, если оно
+        не приостановлено, и запись, если есть неотправленные данные
+        """
+        events = 0 if client.paused else selectors.EVENT_READ
+        if client.has_pending_output:
+            events |= selectors.EVENT_WRITE
+        if events == client.events:
+            return
+        if not client.events:
+            self.selector.register(client.sock, events, client)
+        elif not events:
+            self.selector.unregister(client.sock)
+        else:
+            self.selector.modify(client.sock, events, client)
+        client.events = events
+
+    def disconnect_client(self, client):
+        """
+        Метод закрытия соединения с неавторизованным клиентом
+        """
+        self.handshakes.pop(client, None)
+        self.dirty.discard(client)
+        if client.closed:
+            return
+        if client.events:
+            self.selector.unregister(client.sock)
+        client.close()
+        self.release_senders(client)
+
+    def remove_client(self, client):
+        """
+        Метод обработчик клиента с которым прервана связь.
+        Ищет клиента и удаляет его из списков и базы:
+        """
+        if self.outside_loop():
+            self.call_soon(self.remove_client, client)
+            return
+        LOG.info(f'Клиент {client.getpeername()} отключился от сервера.')
+        self.unregister_client(client)
+        self.disconnect_client(client)
+
+    def service_update_lists(self, added=(), removed=()):
+        """
+        Метод рассылки клиентам сообщения об обновлении списков клиентов на сервере
+        """
+        if self.outside_loop():
+            self.call_soon(self.service_update_lists, added, removed)
+            return
+        super().service_update_lists(added, removed)
+
+    def accept_clients(self):
+        """
+        Метод приёма всех ожидающих подключений
+        """
+        while True:
+            try:
+                client, client_address = self.transport.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as err:
+                LOG.error(f'Ошибка приёма подключения: {err}')
+                return
+            LOG.info(f'Установлено соедение с клиентом {client_address}')
+            client.setblocking(False)
+            client = ClientConnection(client)
+            if self.open_handshake(client):
+                self.update_events(client)
+            else:
+                client.close()
+
+    def read_client(self, client):
+        """
+        Метод чтения и обработки сообщений клиента
+        """
+        try:
+            for message in client.receive():
+                self.process_client_message(message, client)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except Exception as err:
+            LOG.debug(f'Ошибка обработки сообщений клиента {client.getpeername()}', exc_info=err)
+            if not client.closed:
+                self.remove_client(client)
+
+    def flush_clients(self):
+        """
+        Метод отправки накопленных данных. Сокеты, у которых данные отправлены не полностью,
+        регистрируются на событие готовности к записи, остальные с него снимаются.
+        При освобождении очереди возобновляется чтение от ожидавших отправителей.
+        """
+        while self.dirty:
+            client = self.dirty.pop()
+            if client.closed:
+                continue
+            try:
+                client.flush()
+            except OSError:
+                self.remove_client(client)
+                continue
+            if client.waiting_senders and client.is_drained:
+                self.release_senders(client)
+            self.update_events(client)
+
+    def run_calls(self):
+        """
+        Метод выполнения вызовов, переданных из других потоков
+        """
+        try:
+            while self.wakeup_receiver.recv(vrs.MAX_PACKAGE_LENGTH):
+                pass
+        except BlockingIOError:
+            pass
+        while self.calls:
+            func, args = self.calls.popleft()
+            self.run_call(func, args)
+
+    def run(self):
+        """
+        Основной метод сервера.
+        """
+        LOG.info(f'Запущен сервер. Порт подключений: {self.listen_port}, адрес прослушивания: {self.listen_address}')
+        timeout = None
+        while self.running:
+            for key, events in self.selector.select(timeout):
+                if key.data is None:
+                    self.accept_clients()
+                elif key.data is self.wakeup_receiver:
+                    self.run_calls()
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ and not client.closed:
+                        self.read_client(client)
+                    if events & selectors.EVENT_WRITE and not client.closed:
+                        self.dirty.add(client)
+            timeout = self.expire_handshakes()
+            self.flush_clients()
+        self.close_connections()
+        self.selector.close()
+        self.transport.close()
+        LOG.info('Сервер остановлен')
@@ -3,21 +3,21 @@
 """
 
 
-import binascii
-import hmac
 import logging
-import os
 import select
 import threading
 from collections import deque
-from socket import socket, AF_INET, SOCK_STREAM
+from socket import socket, socketpair, AF_INET, SOCK_STREAM
 
 import common.variables as vrs
 import logs.server_log_config
-from common.utils import get_message, send_message
 from common.descriptors import Port, IpAddress
 from common.metaclasses import ServerVerifier
-from server.server_storage_class import ServerStorage
+from common.wire_codecs import JSON
+from server.connection_class import ClientConnection
+from server.server_core import ServerCore
+from server.shard_class import enable_reuse_port
+from server.storage_backends import create_storage
 
 
 LOG = logging.getLogger('server')
@@ -33,38 +33,39 @@ class NewConnection:
         self.locker = threading.Lock()
 
 
-class Server(threading.Thread, metaclass=ServerVerifier):
+class Server(threading.Thread, ServerCore, metaclass=ServerVerifier):
     """
-    Класс сервера
+    Класс сервера (движок на основе опроса сокетов через select).
+    Цикл сервера ожидает в select готовности сокетов клиентов, новых подключений и вызовов
+    из других потоков (call_soon пробуждает цикл записью в служебную пару сокетов).
     """
 
-    RESPONSES = {
-        '200': {vrs.RESPONSE: 200},
-        '202': {vrs.RESPONSE: 202, vrs.LIST_INFO: None},
-        '205': {vrs.RESPONSE: 205},
-        '400': {vrs.RESPONSE: 400, vrs.ERROR: 'Bad Request'},
-        '511': {vrs.RESPONSE: 511, vrs.DATA: None},
-    }
-
     listen_port = Port()
     listen_address = IpAddress()
 
-    def __init__(self, listen_port, listen_address, db_path, new_connection):
+    def __init__(self, listen_port, listen_address, db_path, new_connection, storage_options=None,
+                 reuse_port=False, crypto=None):
         """
         Метод инициализации
+        :param storage_options: дополнительные параметры базы данных сервера
+        :param reuse_port: разрешить другим процессам слушать тот же порт (SO_REUSEPORT, работа в несколько шардов)
+        :param crypto: исполнитель криптографических операций (по умолчанию создаётся по константам)
         """
-        self.clients_names = dict()
+        self.reuse_port = reuse_port
         self.clients_list = []
-        self.messages_deque = deque()
         self.receive_data_list = []
         self.send_data_list = []
         self.errors_list = []
+        self.calls = deque()
+        self.running = True
         self.listen_port = listen_port
         self.listen_address = listen_address
         self.transport = self.prepare_socket()
-        self.new_connection = new_connection
-        self.database = ServerStorage(db_path)
-        super().__init__()
+        self.wakeup_receiver, self.wakeup_sender = socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        threading.Thread.__init__(self)
+        ServerCore.__init__(self, create_storage(db_path, **(storage_options or {})), new_connection, crypto)
         LOG.debug(f'Создан объект сервера')
 
     def prepare_socket(self):
@@ -72,213 +73,176 @@ class Server(threading.Thread, metaclass=ServerVerifier):
         Метод подготовки и запуска сокета сервера
         """
         transport = socket(AF_INET, SOCK_STREAM)
+        if self.reuse_port:
+            enable_reuse_port(transport)
         transport.bind((self.listen_address, self.listen_port))
-        transport.settimeout(1)
         transport.listen(vrs.MAX_CONNECTIONS)
+        transport.setblocking(False)
         return transport
 
-    def process_client_message(self, message, client):
+    def outside_loop(self):
         """
-        Метод обработки сообщений клиентов
+        Метод проверки, что вызов выполняется не в потоке сервера
+        (методы сервера вызываются в том числе из потока графической оболочки)
         """
-        if message.get(vrs.ACTION) == vrs.PRESENCE and vrs.USER in message and \
-                vrs.TIME in message and vrs.PORT in message:
-            self.autorize_user(message, client)
-            return
-
-        if message.get(vrs.ACTION) == vrs.MESSAGE and vrs.MESSAGE_TEXT in message and \
-                vrs.SENDER in message and vrs.DESTINATION in message and \
-                message.get(vrs.DESTINATION) in self.clients_names:
-            self.messages_deque.append(message)
-            LOG.debug(f'Сообщение клиента {message[vrs.SENDER]} '
-                      f'для клиента {message[vrs.DESTINATION]} добавлено в очередь сообщений')
-            return
-
-        if message.get(vrs.ACTION) == vrs.EXIT and vrs.ACCOUNT_NAME in message:
-            self.clients_list.remove(self.clients_names[message[vrs.ACCOUNT_NAME]])
-            self.database.logout_user(message[vrs.ACCOUNT_NAME])
-            self.clients_names[message[vrs.ACCOUNT_NAME]].close()
-            LOG.debug(f'Клиент {message[vrs.ACCOUNT_NAME]} вышел из чата. Клиент отключён от сервера.')
-            del self.clients_names[message[vrs.ACCOUNT_NAME]]
-            with self.new_connection.locker:
-                self.new_connection.value = True
-            return
-
-        if vrs.ACTION in message and message[vrs.ACTION] == vrs.GET_CONTACTS and vrs.USER in message and \
-                self.clients_names[message[vrs.USER]] == client:
-            response = self.RESPONSES['202']
-            response[vrs.LIST_INFO] = self.database.get_contacts(message[vrs.USER])
-            send_message(client, response)
-            return
-
-        if vrs.ACTION in message and message[vrs.ACTION] == vrs.ADD_CONTACT and vrs.ACCOUNT_NAME in message and \
-                vrs.USER in message and self.clients_names[message[vrs.USER]] == client:
-            self.database.add_contact(message[vrs.USER], message[vrs.ACCOUNT_NAME])
-            send_message(client, self.RESPONSES['200'])
-            return
+        return self.is_alive() and threading.current_thread() is not self
 
-        if vrs.ACTION in message and message[vrs.ACTION] == vrs.REMOVE_CONTACT and vrs.ACCOUNT_NAME in message and \
-                vrs.USER in message and self.clients_names[message[vrs.USER]] == client:
-            self.database.remove_contact(message[vrs.USER], message[vrs.ACCOUNT_NAME])
-            send_message(client, self.RESPONSES['200'])
-            return
+    def call_soon(self, func, *args):
+        """
+        Метод передачи вызова в поток сервера (выполняется на очередной итерации цикла)
+        """
+        self.calls.append((func, args))
+        self.wakeup()
 
-        if vrs.ACTION in message and message[vrs.ACTION] == vrs.USERS_REQUEST and vrs.ACCOUNT_NAME in message and \
-                self.clients_names[message[vrs.ACCOUNT_NAME]] == client:
-            response = self.RESPONSES['202']
-            response[vrs.LIST_INFO] = [user[0] for user in self.database.users_all()]
-            send_message(client, response)
-            return
+    def wakeup(self):
+        """
+        Метод пробуждения цикла сервера, ожидающего событий сокетов
+        """
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            pass
 
-        if vrs.ACTION in message and message[vrs.ACTION] == vrs.PUBLIC_KEY_REQUEST and vrs.ACCOUNT_NAME in message:
-            response = self.RESPONSES['511']
-            response[vrs.DATA] = self.database.get_pubkey(message[vrs.ACCOUNT_NAME])
-            if response[vrs.DATA]:
-                try:
-                    send_message(client, response)
-                except OSError:
-                    self.remove_client(client)
-            else:
-                response = self.RESPONSES['400']
-                response[vrs.ERROR] = 'Нет публичного ключа для данного пользователя'
-                try:
-                    send_message(client, response)
-                except OSError:
-                    self.remove_client(client)
-            return
+    def stop(self):
+        """
+        Метод остановки сервера: цикл завершится на очередной итерации
+        """
+        self.running = False
+        self.wakeup()
 
-        response = self.RESPONSES['400']
-        response[vrs.ERROR] = 'Запрос некорректен.'
+    def run_calls(self):
+        """
+        Метод выполнения вызовов, переданных из других потоков
+        """
         try:
-            send_message(client, response)
-        except OSError:
-            self.remove_client(client)
+            while self.wakeup_receiver.recv(vrs.MAX_PACKAGE_LENGTH):
+                pass
+        except BlockingIOError:
+            pass
+        while self.calls:
+            func, args = self.calls.popleft()
+            self.run_call(func, args)
 
-    def autorize_user(self, message, client):
+    def accept_clients(self):
         """
-        Метод, реализующий авторизцию пользователей
+        Метод приёма всех ожидающих подключений
         """
-        LOG.debug(f'Начата авторизация для {message[vrs.USER]}')
-        if message[vrs.USER][vrs.ACCOUNT_NAME] in self.clients_names:
-            response = self.RESPONSES['400']
-            response[vrs.ERROR] = 'Имя пользователя уже занято.'
-            try:
-                LOG.debug(f'Имя пользователя уже занято: {response}')
-                send_message(client, response)
-            except OSError:
-                LOG.debug('OS Error')
-                pass
-            self.clients_list.remove(client)
-            client.close()
-        elif not self.database.check_user(message[vrs.USER][vrs.ACCOUNT_NAME]):
-            response = self.RESPONSES['400']
-            response[vrs.ERROR] = 'Пользователь не зарегистрирован.'
-            try:
-                LOG.debug(f'Пользователь не зарегистрирован: {response}')
-                send_message(client, response)
-            except OSError:
-                pass
-            self.clients_list.remove(client)
-            client.close()
-        else:
-            LOG.debug('Correct username, starting passwd check.')
-            message_auth = self.RESPONSES['511']
-            random_str = binascii.hexlify(os.urandom(64))
-            message_auth[vrs.DATA] = random_str.decode('ascii')
-            hash_string = hmac.new(self.database.get_hash(message[vrs.USER][vrs.ACCOUNT_NAME]), random_str, 'MD5')
-            digest = hash_string.digest()
-            LOG.debug(f'Auth message = {message_auth}')
+        while True:
             try:
-                send_message(client, message_auth)
-                ans = get_message(client)
-                LOG.debug(f'Auth client message = {ans}')
+                client, client_address = self.transport.accept()
+            except (BlockingIOError, InterruptedError):
+                return
             except OSError as err:
-                LOG.debug('Error in auth, data:', exc_info=err)
-                client.close()
+                LOG.error(f'Ошибка приёма подключения: {err}')
                 return
-            client_digest = binascii.a2b_base64(ans[vrs.DATA])
-            if vrs.RESPONSE in ans and ans[vrs.RESPONSE] == 511 and hmac.compare_digest(
-                    digest, client_digest):
-                self.clients_names[message[vrs.USER][vrs.ACCOUNT_NAME]] = client
-                client_ip, client_port = client.getpeername()
-                try:
-                    send_message(client, self.RESPONSES['200'])
-                    LOG.debug(f'Auth client complete')
-                    with self.new_connection.locker:
-                        self.new_connection.value = True
-                except OSError:
-                    self.remove_client(message[vrs.USER][vrs.ACCOUNT_NAME])
-                self.database.login_user(
-                    message[vrs.USER][vrs.ACCOUNT_NAME],
-                    client_ip,
-                    client_port,
-                    message[vrs.USER][vrs.PUBLIC_KEY])
+            LOG.info(f'Установлено соедение с клиентом {client_address}')
+            client.setblocking(False)
+            client = ClientConnection(client)
+            if self.open_handshake(client):
+                self.clients_list.append(client)
             else:
-                response = self.RESPONSES['400']
-                response[vrs.ERROR] = 'Неверный пароль.'
-                LOG.debug(f'Auth wrong = {response}')
-                try:
-                    send_message(client, response)
-                except OSError:
-                    pass
-                self.clients_list.remove(client)
                 client.close()
 
+    def send_to_client(self, client, message):
+        """
+        Метод отправки сообщения клиенту. Сообщение ставится в очередь соединения,
+        неотправленный остаток будет передан при готовности сокета к записи.
+        """
+        client.send(message)
+        self.flush_client(client)
+
+    def send_burst(self, client, messages):
+        """
+        Метод отправки клиенту нескольких сообщений одной записью
+        """
+        client.send_many(messages)
+        self.flush_client(client)
+
+    def flush_client(self, client):
+        """
+        Метод отправки накопленных данных клиента. При освобождении очереди возобновляется
+        чтение от ожидавших отправителей (сокет, очередь которого освободилась при отправке,
+        не попадёт в список готовых к записи).
+        """
+        client.flush()
+        if client.waiting_senders and client.is_drained:
+            self.release_senders(client)
+
+    def enable_framing(self, client, codec=JSON):
+        """
+        Метод переключения соединения клиента в кадровый режим с согласованным кодеком сообщений
+        """
+        client.buffer.framed = True
+        client.buffer.codec = codec
+
+    def pause_reading(self, client):
+        """
+        Метод приостановки чтения сообщений клиента
+        """
+        client.paused = True
+
+    def resume_reading(self, client):
+        """
+        Метод возобновления чтения сообщений клиента
+        """
+        client.paused = False
+
+    def disconnect_client(self, client):
+        """
+        Метод закрытия соединения с неавторизованным клиентом
+        """
+        self.handshakes.pop(client, None)
+        if client in self.clients_list:
+            self.clients_list.remove(client)
+        client.close()
+        self.release_senders(client)
+
     def received_messages_processing(self):
         """
         Метод получения сообщений от сокетов клиентов
         """
         for client_with_message in self.receive_data_list:
             try:
-                self.process_client_message(get_message(client_with_message), client_with_message)
+                for message in client_with_message.receive():
+                    self.process_client_message(message, client_with_message)
+            except (BlockingIOError, InterruptedError):
+                pass
             except Exception:
-                self.remove_client(client_with_message)
+                if not client_with_message.closed:
+                    self.remove_client(client_with_message)
 
     def send_messages_to_clients(self):
         """
-        Метод отправки сообщений клиентам
-        """
-        while self.messages_deque:
-            message = self.messages_deque.popleft()
-            waiting_client = self.clients_names[message[vrs.DESTINATION]]
-            if waiting_client in self.send_data_list and message[vrs.DESTINATION] in self.clients_names:
-                try:
-                    send_message(waiting_client, message)
-                    self.database.process_message(message[vrs.SENDER], message[vrs.DESTINATION])
-                    LOG.info(f'Сообщение клиента {message[vrs.SENDER]} отправлено клиенту {message[vrs.DESTINATION]}')
-                except (ConnectionAbortedError, ConnectionError, ConnectionResetError, ConnectionRefusedError):
-                    LOG.info(f'Клиент {waiting_client.getpeername()} отключился от сервера.')
-                    waiting_client.close()
-                    self.clients_list.remove(waiting_client)
-                    self.database.logout_user(message[vrs.DESTINATION])
-                    del self.clients_names[message[vrs.DESTINATION]]
-            else:
-                LOG.error(f'Пользователь {message[vrs.DESTINATION]} не зарегистрирован на сервере, '
-                          f'отправка сообщения невозможна.')
+        Метод отправки клиентам накопленных в их очередях данных
+        """
+        for waiting_client in self.send_data_list:
+            if waiting_client.closed:
+                continue
+            try:
+                self.flush_client(waiting_client)
+            except OSError:
+                self.remove_client(waiting_client)
 
     def remove_client(self, client):
         """
         Метод обработчик клиента с которым прервана связь.
         Ищет клиента и удаляет его из списков и базы:
         """
+        if self.outside_loop():
+            self.call_soon(self.remove_client, client)
+            return
         LOG.info(f'Клиент {client.getpeername()} отключился от сервера.')
-        for name in self.clients_names:
-            if self.clients_names[name] == client:
-                self.database.logout_user(name)
-                del self.clients_names[name]
-                break
-        self.clients_list.remove(client)
-        client.close()
+        self.unregister_client(client)
+        self.disconnect_client(client)
 
-    def service_update_lists(self):
+    def service_update_lists(self, added=(), removed=()):
         """
         Метод рассылки клиентам сообщения об обновлении списков клиентов на сервере
         """
-        for client in self.clients_names:
-            try:
-                send_message(self.clients_names[client], self.RESPONSES['205'])
-            except OSError:
-                self.remove_client(self.clients_names[client])
+        if self.outside_loop():
+            self.call_soon(self.service_update_lists, added, removed)
+            return
+        super().service_update_lists(added, removed)
 
     def run(self):
         """
@@ -286,26 +250,31 @@ class Server(threading.Thread, metaclass=ServerVerifier):
         """
 
         LOG.info(f'Запущен сервер. Порт подключений: {self.listen_port}, адрес прослушивания: {self.listen_address}')
-        while True:
-            try:
-                client, client_address = self.transport.accept()
-            except OSError:
-                pass
-            else:
-                LOG.info(f'Установлено соедение с клиентом {client_address}')
-                self.clients_list.append(client)
-
+        timeout = None
+        while self.running:
             self.receive_data_list = []
             self.send_data_list = []
             self.errors_list = []
             try:
-                if self.clients_list:
-                    self.receive_data_list, self.send_data_list, self.errors_list = \
-                        select.select(self.clients_list, self.clients_list, [], 0)
+                self.receive_data_list, self.send_data_list, self.errors_list = select.select(
+                    [self.transport, self.wakeup_receiver] +
+                    [client for client in self.clients_list if not client.paused],
+                    [client for client in self.clients_list if client.has_pending_output],
+                    [], timeout)
             except OSError:
                 pass
 
+            if self.transport in self.receive_data_list:
+                self.receive_data_list.remove(self.transport)
+                self.accept_clients()
+            if self.wakeup_receiver in self.receive_data_list:
+                self.receive_data_list.remove(self.wakeup_receiver)
             self.received_messages_processing()
+            self.run_calls()
+            timeout = self.expire_handshakes()
 
-            if self.messages_deque and self.send_data_list:
+            if self.send_data_list:
                 self.send_messages_to_clients()
+        self.close_connections()
+        self.transport.close()
+        LOG.info('Сервер остановлен')
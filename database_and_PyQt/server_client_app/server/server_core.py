@@ -0,0 +1,766 @@
+"""
+Модуль базового класса обработки сообщений сервера, общего для всех движков сервера
+"""
+
+
+import binascii
+import logging
+import os
+import time
+
+import common.variables as vrs
+import logs.server_log_config
+from common.crypto import create_crypto_executor, verify_challenge
+from common.utils import PreparedMessage
+from common.wire_codecs import JSON, choose_codec
+from server.shard_class import PresenceDirectory
+
+
+LOG = logging.getLogger('server')
+
+
+class Handshake:
+    """
+    Класс данных авторизации соединения: срок её завершения и, после отправки вызова,
+    имя пользователя, публичный ключ, хэш пароля и строка-вызов
+    """
+
+    def __init__(self, deadline):
+        """
+        Метод инициализации
+        :param deadline: момент (по time.monotonic), до которого клиент должен авторизоваться
+        """
+        self.deadline = deadline
+        self.account_name = None
+        self.pubkey = None
+        self.passwd_hash = None
+        self.challenge = None
+
+
+class ServerCore:
+    """
+    Базовый класс сервера: обработка сообщений протокола JIM и авторизация пользователей.
+    Работа с соединениями (отправка, отключение) реализуется в классах движков сервера.
+
+    Авторизация - конечный автомат соединения (атрибут auth_state):
+    AUTH_PENDING (ожидается presence) -> AUTH_CHALLENGED (отправлен вызов, ожидается ответ) ->
+    AUTH_VERIFYING (ответ проверяется исполнителем crypto) -> AUTH_DONE.
+    Каждый переход выполняется при обработке очередного сообщения клиента или результата проверки,
+    поэтому авторизация не блокирует цикл сервера. Не авторизовавшиеся за handshake_timeout соединения закрываются,
+    количество одновременно авторизующихся соединений ограничено max_pending_handshakes.
+
+    При работе в несколько процессов (шардов) или в федерации серверов к серверу подключаются каналы связи
+    (attach_link): шина маршрутизации между шардами или канал федерации. Пользователи, подключённые
+    к другим шардам и серверам, учитываются в справочнике присутствия directory, сообщения для них
+    пересылаются по соответствующему каналу. Справочник обновляется асинхронно: сообщение, отправленное
+    до получения оповещения о подключении пользователя к другому серверу, сохраняется до его следующего входа.
+
+    Состав комнат (групповых чатов) хранится в базе и в памяти (rooms: имя комнаты -> множество участников),
+    поэтому рассылка сообщения комнаты не требует запросов к базе. Вступление в комнату и выход из неё
+    передаются другим шардам и серверам по каналам связи. Сообщение кодируется один раз для всех подключённых
+    участников, участникам других шардов и серверов пересылается по одной копии на шард или сервер,
+    для остальных участников сохраняется до их входа.
+    """
+
+    # Постоянные ответы сервера неизменяемы и кодируются один раз для каждого кодека;
+    # ответы с данными строятся на их копиях (метод copy)
+    RESPONSES = {
+        '200': PreparedMessage({vrs.RESPONSE: 200}),
+        '202': PreparedMessage({vrs.RESPONSE: 202, vrs.LIST_INFO: None}),
+        '205': PreparedMessage({vrs.RESPONSE: 205}),
+        '400': PreparedMessage({vrs.RESPONSE: 400, vrs.ERROR: 'Bad Request'}),
+        '511': PreparedMessage({vrs.RESPONSE: 511, vrs.DATA: None}),
+    }
+
+    def __init__(self, database, new_connection, crypto=None):
+        """
+        Метод инициализации
+        :param crypto: исполнитель криптографических операций, если не задан - создаётся по константам
+        """
+        self.clients_names = dict()
+        self.directory = PresenceDirectory()
+        self.users_version = 0
+        self.rooms = database.rooms_all()
+        self.links = []
+        self.handshakes = dict()
+        self.handshake_timeout = vrs.HANDSHAKE_TIMEOUT
+        self.max_pending_handshakes = vrs.MAX_PENDING_HANDSHAKES
+        self.crypto = crypto or create_crypto_executor(vrs.CRYPTO_EXECUTOR, vrs.CRYPTO_WORKERS or None)
+        self.database = database
+        self.new_connection = new_connection
+
+    def call_soon(self, func, *args):
+        """
+        Метод передачи вызова в поток сервера (может вызываться из других потоков).
+        Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def run_call(self, func, args):
+        """
+        Метод выполнения вызова, переданного в поток сервера через call_soon.
+        Ошибка вызова записывается в журнал и не останавливает сервер; если среди аргументов вызова
+        есть соединение клиента, это соединение закрывается.
+        """
+        try:
+            func(*args)
+        except Exception as err:
+            LOG.error(f'Ошибка выполнения {getattr(func, "__name__", func)} в потоке сервера: {err!r}',
+                      exc_info=err)
+            connections = list(self.handshakes) + list(self.clients_names.values())
+            for arg in args:
+                if any(arg is connection for connection in connections) and not arg.closed:
+                    self.remove_client(arg)
+
+    def send_to_client(self, client, message):
+        """
+        Метод отправки сообщения клиенту. Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def send_burst(self, client, messages):
+        """
+        Метод отправки клиенту нескольких сообщений одной записью. Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def enable_framing(self, client, codec=JSON):
+        """
+        Метод переключения соединения клиента в кадровый режим с согласованным кодеком сообщений.
+        Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def pause_reading(self, client):
+        """
+        Метод приостановки чтения сообщений клиента. Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def resume_reading(self, client):
+        """
+        Метод возобновления чтения сообщений клиента. Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def disconnect_client(self, client):
+        """
+        Метод закрытия соединения с неавторизованным клиентом. Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def remove_client(self, client):
+        """
+        Метод обработчик клиента с которым прервана связь. Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Метод остановки сервера (может вызываться из других потоков). Реализуется в движке сервера.
+        """
+        raise NotImplementedError
+
+    def attach_link(self, link):
+        """
+        Метод подключения канала связи с другими шардами или серверами.
+        Канал передаёт полученные изменения присутствия и сообщения в поток сервера через call_soon.
+        """
+        self.links.append(link)
+        link.start(self)
+
+    def publish_presence(self, account_name, online):
+        """
+        Метод оповещения других шардов и серверов о подключении или отключении пользователя
+        """
+        for link in self.links:
+            link.publish_presence(account_name, online)
+
+    def remote_presence(self, link, location, account_name, online):
+        """
+        Метод учёта подключения или отключения пользователя другого шарда или сервера.
+        Выполняется в потоке сервера.
+        :param location: номер шарда или имя сервера, к которому подключён пользователь
+        """
+        if online:
+            self.directory.set_online(account_name, (link, location))
+        else:
+            self.directory.set_offline(account_name, (link, location))
+
+    def remote_snapshot(self, link, location, account_names):
+        """
+        Метод замены всех записей справочника о пользователях шарда или сервера полным списком,
+        полученным при установке соединения. Выполняется в потоке сервера.
+        """
+        self.directory.reset((link, location), account_names)
+
+    def remote_room(self, account_name, room, joined):
+        """
+        Метод учёта вступления в комнату или выхода из неё пользователя другого шарда или сервера
+        (только в составе комнат в памяти, база изменена сервером пользователя). Выполняется в потоке сервера.
+        """
+        if joined:
+            self.rooms.setdefault(room, set()).add(account_name)
+        else:
+            self.discard_member(account_name, room)
+
+    def deliver_routed(self, message):
+        """
+        Метод доставки сообщения, пересланного другим шардом или сервером. Выполняется в потоке сервера.
+        Сообщение комнаты доставляется перечисленным в нём получателям (RECIPIENTS).
+        Если получатель успел отключиться, сообщение сохраняется до его подключения.
+        """
+        recipients = message.pop(vrs.RECIPIENTS, None) or [message[vrs.DESTINATION]]
+        for recipient in recipients:
+            waiting_client = self.clients_names.get(recipient)
+            if waiting_client is not None:
+                try:
+                    self.send_to_client(waiting_client, message)
+                    continue
+                except OSError:
+                    self.remove_client(waiting_client)
+            self.database.store_offline_message(message[vrs.SENDER], recipient, message)
+
+    def unregister_client(self, client):
+        """
+        Метод удаления авторизованного клиента из списка подключённых пользователей
+        с отметкой о выходе в базе и оповещением других шардов
+        """
+        for name, connection in self.clients_names.items():
+            if connection == client:
+                self.database.logout_user(name)
+                del self.clients_names[name]
+                self.publish_presence(name, False)
+                return
+
+    def close_connections(self):
+        """
+        Метод закрытия всех соединений при остановке сервера
+        (неотправленные данные по возможности отправляются, пользователи отмечаются как вышедшие)
+        """
+        for client in list(self.clients_names.values()) + list(self.handshakes):
+            self.remove_client(client)
+
+    def route_message(self, message, client):
+        """
+        Метод передачи сообщения в очередь соединения получателя.
+        Если очередь получателя перегружена, чтение от отправителя приостанавливается
+        до её освобождения, поэтому медленный получатель не задерживает остальных клиентов.
+        Сообщение для пользователя другого шарда или сервера пересылается по каналу связи с ним.
+        """
+        waiting_client = self.clients_names.get(message[vrs.DESTINATION])
+        route = self.directory.route_of(message[vrs.DESTINATION])
+        if waiting_client is None and route is not None:
+            link, location = route
+            link.route(location, message)
+            self.database.process_message(message[vrs.SENDER], message[vrs.DESTINATION])
+            LOG.info(f'Сообщение клиента {message[vrs.SENDER]} передано на {location} '
+                     f'для клиента {message[vrs.DESTINATION]}')
+            return
+        if waiting_client is None:
+            LOG.error(f'Пользователь {message[vrs.DESTINATION]} не зарегистрирован на сервере, '
+                      f'отправка сообщения невозможна.')
+            return
+        try:
+            self.send_to_client(waiting_client, message)
+        except OSError as err:
+            LOG.warning(f'Не удалось передать сообщение клиенту {message[vrs.DESTINATION]}: {err}')
+            self.remove_client(waiting_client)
+            return
+        self.database.process_message(message[vrs.SENDER], message[vrs.DESTINATION])
+        LOG.info(f'Сообщение клиента {message[vrs.SENDER]} отправлено клиенту {message[vrs.DESTINATION]}')
+        if waiting_client.is_congested and waiting_client is not client and not client.paused:
+            LOG.debug(f'Очередь клиента {message[vrs.DESTINATION]} перегружена, '
+                      f'чтение от клиента {message[vrs.SENDER]} приостановлено')
+            waiting_client.waiting_senders.add(client)
+            self.pause_reading(client)
+
+    def reply(self, client, request, response):
+        """
+        Метод отправки ответа на запрос клиента. Если в запросе есть идентификатор (REQUEST_ID),
+        он возвращается в ответе, что позволяет клиенту отправлять запросы не дожидаясь ответов.
+        """
+        self.send_to_client(client, self.with_request_id(request, response))
+
+    @staticmethod
+    def with_request_id(request, response):
+        """
+        Метод получения ответа с идентификатором запроса (если он указан в запросе).
+        К постоянному ответу (PreparedMessage) идентификатор добавляется без повторного кодирования ответа.
+        """
+        if isinstance(request, dict) and vrs.REQUEST_ID in request:
+            if isinstance(response, PreparedMessage):
+                return response.with_field(vrs.REQUEST_ID, request[vrs.REQUEST_ID])
+            response = dict(response)
+            response[vrs.REQUEST_ID] = request[vrs.REQUEST_ID]
+        return response
+
+    def release_senders(self, client):
+        """
+        Метод возобновления чтения от клиентов, ожидавших освобождения очереди соединения
+        """
+        while client.waiting_senders:
+            sender = client.waiting_senders.pop()
+            if not sender.closed and sender.paused:
+                self.continue_reading(sender)
+
+    def continue_reading(self, client):
+        """
+        Метод возобновления чтения сообщений клиента. Сообщения, уже принятые в буфер соединения
+        до приостановки чтения, обрабатываются отдельным вызовом в потоке сервера
+        (новых данных в сокете может не быть, и события чтения не произойдёт).
+        """
+        self.resume_reading(client)
+        self.call_soon(self.process_buffered, client)
+
+    def process_buffered(self, client):
+        """
+        Метод обработки сообщений, принятых в буфер соединения. Обработка прекращается
+        при приостановке чтения или закрытии соединения, оставшиеся сообщения остаются в буфере.
+        """
+        while not client.closed and not client.paused:
+            message = client.buffer.next_message()
+            if message is None:
+                return
+            self.process_client_message(message, client)
+
+    def store_offline_message(self, message, client):
+        """
+        Метод сохранения сообщения для пользователя не в сети до его подключения
+        """
+        if self.database.store_offline_message(message[vrs.SENDER], message[vrs.DESTINATION], message):
+            self.database.process_message(message[vrs.SENDER], message[vrs.DESTINATION])
+            LOG.info(f'Сообщение клиента {message[vrs.SENDER]} для клиента {message[vrs.DESTINATION]} '
+                     f'сохранено до подключения получателя')
+            return
+        response = self.RESPONSES['400'].copy()
+        response[vrs.ERROR] = 'Получатель не зарегистрирован или превышен лимит сообщений для него.'
+        try:
+            self.reply(client, message, response)
+        except OSError:
+            self.remove_client(client)
+
+    @staticmethod
+    def is_room(name):
+        """
+        Метод проверки, является ли получатель сообщения комнатой (имя начинается с префикса комнаты)
+        """
+        return isinstance(name, str) and len(name) > len(vrs.ROOM_PREFIX) and name.startswith(vrs.ROOM_PREFIX)
+
+    def join_room(self, account_name, room):
+        """
+        Метод добавления пользователя в комнату (в базе и в составе комнат в памяти)
+        """
+        if self.database.join_room(account_name, room):
+            self.rooms.setdefault(room, set()).add(account_name)
+            for link in self.links:
+                link.publish_room(account_name, room, True)
+            LOG.info(f'Пользователь {account_name} вступил в комнату {room}')
+
+    def leave_room(self, account_name, room):
+        """
+        Метод удаления пользователя из комнаты
+        """
+        self.database.leave_room(account_name, room)
+        self.discard_member(account_name, room)
+        for link in self.links:
+            link.publish_room(account_name, room, False)
+        LOG.info(f'Пользователь {account_name} вышел из комнаты {room}')
+
+    def discard_member(self, account_name, room):
+        """
+        Метод удаления участника из состава комнаты в памяти. Комната без участников удаляется из памяти.
+        """
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(account_name)
+            if not members:
+                del self.rooms[room]
+
+    def room_members(self, room, sender):
+        """
+        Метод получения состава комнаты. Если отправителя нет в составе комнаты в памяти
+        (оповещение о его вступлении ещё не получено или потеряно при разрыве соединения между шардами),
+        состав комнаты дополняется из базы.
+        """
+        members = self.rooms.get(room, set())
+        if sender not in members:
+            stored = self.database.room_members(room)
+            if stored:
+                members = self.rooms.setdefault(room, set())
+                members.update(stored)
+        return members
+
+    def route_room_message(self, message, client):
+        """
+        Метод рассылки сообщения участникам комнаты (кроме отправителя).
+        Подключённым к этому серверу участникам сообщение рассылается одним вызовом broadcast
+        (кодируется один раз), участникам других шардов и серверов пересылается одна копия на шард или сервер
+        со списком получателей, для остальных участников (и тех, отправка которым не удалась) сохраняется
+        одной транзакцией базы до их подключения. Отправитель должен состоять в комнате.
+        """
+        sender, room = message[vrs.SENDER], message[vrs.DESTINATION]
+        members = self.room_members(room, sender)
+        if sender not in members:
+            response = self.RESPONSES['400'].copy()
+            response[vrs.ERROR] = f'Пользователь не состоит в комнате {room}.'
+            try:
+                self.reply(client, message, response)
+            except OSError:
+                self.remove_client(client)
+            return
+        online, remote, offline = dict(), dict(), []
+        for name in members:
+            if name == sender:
+                continue
+            connection = self.clients_names.get(name)
+            route = self.directory.route_of(name) if connection is None else None
+            if connection is not None:
+                online[name] = connection
+            elif route is not None:
+                remote.setdefault(route, []).append(name)
+            else:
+                offline.append(name)
+        self.broadcast(message, online.values())
+        delivered = []
+        for name, connection in online.items():
+            if connection.closed:
+                offline.append(name)
+            else:
+                delivered.append(name)
+        for (link, location), names in remote.items():
+            routed = dict(message)
+            routed[vrs.RECIPIENTS] = names
+            link.route(location, routed)
+            delivered.extend(names)
+        stored = self.database.batch(
+            lambda: [name for name in offline if self.database.store_offline_message(sender, name, message)])
+        for name in delivered + stored:
+            self.database.process_message(sender, name)
+        LOG.info(f'Сообщение клиента {sender} в комнату {room}: отправлено {len(delivered)}, '
+                 f'сохранено до подключения {len(stored)}')
+
+    def deliver_offline_messages(self, account_name, client):
+        """
+        Метод доставки пользователю сообщений, сохранённых пока он был не в сети (одной записью)
+        """
+        messages = self.database.pop_offline_messages(account_name)
+        if not messages:
+            return
+        try:
+            self.send_burst(client, messages)
+        except OSError:
+            LOG.error(f'Не удалось доставить клиенту {account_name} сохранённые сообщения')
+            self.remove_client(client)
+            return
+        LOG.info(f'Клиенту {account_name} доставлено сохранённых сообщений: {len(messages)}')
+
+    def open_handshake(self, client):
+        """
+        Метод регистрации нового соединения в ожидании авторизации.
+        Возвращает False (соединение нужно закрыть), если достигнут предел одновременных авторизаций.
+        """
+        if len(self.handshakes) >= self.max_pending_handshakes:
+            LOG.warning(f'Превышено количество одновременных авторизаций, '
+                        f'соединение {self.client_address(client)} отклонено')
+            return False
+        client.auth_state = vrs.AUTH_PENDING
+        self.handshakes[client] = Handshake(time.monotonic() + self.handshake_timeout)
+        return True
+
+    def expire_handshakes(self):
+        """
+        Метод закрытия соединений, не завершивших авторизацию в отведённое время.
+        Возвращает время (в секундах) до ближайшего срока или None, если авторизаций нет.
+        """
+        now = time.monotonic()
+        for client, handshake in list(self.handshakes.items()):
+            if handshake.deadline <= now:
+                LOG.info(f'Клиент {self.client_address(client)} не авторизовался за отведённое время')
+                self.reject_client(client, 'Время авторизации истекло.')
+        if not self.handshakes:
+            return None
+        return max(min(handshake.deadline for handshake in self.handshakes.values()) - now, 0)
+
+    def client_address(self, client):
+        """
+        Метод получения адреса и порта клиента
+        """
+        return client.getpeername()
+
+    def process_client_message(self, message, client):
+        """
+        Метод обработки сообщений клиентов
+        """
+        if client.auth_state == vrs.AUTH_CHALLENGED:
+            self.check_auth_answer(message, client)
+            return
+
+        if client.auth_state != vrs.AUTH_DONE:
+            if client.auth_state == vrs.AUTH_PENDING and message.get(vrs.ACTION) == vrs.PRESENCE and \
+                    vrs.USER in message and vrs.TIME in message and vrs.PORT in message:
+                self.autorize_user(message, client)
+            else:
+                self.reject_client(client, 'Пользователь не авторизован.')
+            return
+
+        if message.get(vrs.ACTION) == vrs.MESSAGE and vrs.MESSAGE_TEXT in message and \
+                vrs.SENDER in message and vrs.DESTINATION in message:
+            if self.is_room(message[vrs.DESTINATION]) and self.clients_names.get(message[vrs.SENDER]) == client:
+                self.route_room_message(message, client)
+                return
+            if message[vrs.DESTINATION] in self.clients_names or message[vrs.DESTINATION] in self.directory:
+                self.route_message(message, client)
+                return
+            if self.clients_names.get(message[vrs.SENDER]) == client:
+                self.store_offline_message(message, client)
+                return
+
+        if message.get(vrs.ACTION) == vrs.EXIT and vrs.ACCOUNT_NAME in message:
+            self.remove_client(self.clients_names[message[vrs.ACCOUNT_NAME]])
+            LOG.debug(f'Клиент {message[vrs.ACCOUNT_NAME]} вышел из чата. Клиент отключён от сервера.')
+            with self.new_connection.locker:
+                self.new_connection.value = True
+            return
+
+        if message.get(vrs.ACTION) == vrs.BATCH and isinstance(message.get(vrs.REQUESTS), list):
+            self.process_batch(message, client)
+            return
+
+        response = self.handle_request(message, client)
+        if response is None:
+            response = self.RESPONSES['400'].copy()
+            response[vrs.ERROR] = 'Запрос некорректен.'
+        try:
+            self.reply(client, message, response)
+        except OSError:
+            self.remove_client(client)
+
+    def handle_request(self, message, client):
+        """
+        Метод выполнения запроса клиента (контакты, пользователи, публичный ключ).
+        Возвращает ответ или None, если сообщение не является корректным запросом.
+        """
+        action = message.get(vrs.ACTION)
+        if action == vrs.GET_CONTACTS and vrs.USER in message and self.clients_names.get(message[vrs.USER]) == client:
+            response = self.RESPONSES['202'].copy()
+            response[vrs.LIST_INFO] = self.database.get_contacts(message[vrs.USER])
+            return response
+
+        if action == vrs.ADD_CONTACT and vrs.ACCOUNT_NAME in message and \
+                vrs.USER in message and self.clients_names.get(message[vrs.USER]) == client:
+            self.database.add_contact(message[vrs.USER], message[vrs.ACCOUNT_NAME])
+            return self.RESPONSES['200']
+
+        if action == vrs.REMOVE_CONTACT and vrs.ACCOUNT_NAME in message and \
+                vrs.USER in message and self.clients_names.get(message[vrs.USER]) == client:
+            self.database.remove_contact(message[vrs.USER], message[vrs.ACCOUNT_NAME])
+            return self.RESPONSES['200']
+
+        if action in (vrs.JOIN, vrs.LEAVE) and self.is_room(message.get(vrs.ROOM)) and \
+                vrs.USER in message and self.clients_names.get(message[vrs.USER]) == client:
+            if action == vrs.JOIN:
+                self.join_room(message[vrs.USER], message[vrs.ROOM])
+            else:
+                self.leave_room(message[vrs.USER], message[vrs.ROOM])
+            return self.RESPONSES['200']
+
+        if action == vrs.USERS_REQUEST and vrs.ACCOUNT_NAME in message and \
+                self.clients_names.get(message[vrs.ACCOUNT_NAME]) == client:
+            response = self.RESPONSES['202'].copy()
+            response[vrs.LIST_INFO] = [user[0] for user in self.database.users_all()]
+            response[vrs.USERS_VERSION] = self.users_version
+            return response
+
+        if action == vrs.PUBLIC_KEY_REQUEST and vrs.ACCOUNT_NAME in message:
+            response = self.RESPONSES['511'].copy()
+            response[vrs.DATA] = self.database.get_pubkey(message[vrs.ACCOUNT_NAME])
+            if not response[vrs.DATA]:
+                response = self.RESPONSES['400'].copy()
+                response[vrs.ERROR] = 'Нет публичного ключа для данного пользователя'
+            return response
+        return None
+
+    def process_batch(self, message, client):
+        """
+        Метод выполнения пакета запросов (действие BATCH): все запросы выполняются за один проход
+        одной транзакцией базы данных, ответы отправляются одним сообщением в порядке запросов.
+        """
+        requests = message[vrs.REQUESTS]
+        if len(requests) > vrs.BATCH_MAX_REQUESTS:
+            response = self.RESPONSES['400'].copy()
+            response[vrs.ERROR] = f'Пакет содержит больше {vrs.BATCH_MAX_REQUESTS} запросов.'
+        else:
+            response = self.RESPONSES['200'].copy()
+            response[vrs.LIST_INFO] = self.database.batch(lambda: [self.batch_response(request, client)
+                                                                   for request in requests])
+        try:
+            self.reply(client, message, response)
+        except OSError:
+            self.remove_client(client)
+
+    def batch_response(self, request, client):
+        """
+        Метод получения ответа на один запрос пакета
+        """
+        response = self.handle_request(request, client) if isinstance(request, dict) else None
+        if response is None:
+            response = self.RESPONSES['400'].copy()
+            response[vrs.ERROR] = 'Запрос некорректен.'
+        return dict(self.with_request_id(request, response))
+
+    def reject_client(self, client, error):
+        """
+        Метод отправки клиенту сообщения об ошибке авторизации и закрытия соединения
+        """
+        response = self.RESPONSES['400'].copy()
+        response[vrs.ERROR] = error
+        try:
+            LOG.debug(f'Авторизация отклонена: {response}')
+            self.send_to_client(client, response)
+        except OSError:
+            pass
+        self.disconnect_client(client)
+
+    def autorize_user(self, message, client):
+        """
+        Метод, реализующий авторизцию пользователей (первый этап, AUTH_PENDING -> AUTH_CHALLENGED).
+        Клиенту отправляется случайная строка-вызов, ожидаемый ответ сохраняется
+        до получения следующего сообщения клиента, поэтому ожидание не блокирует сервер.
+        Если клиент запросил кадровый режим и передал список кодеков, для соединения выбирается
+        первый поддерживаемый сервером кодек; кадровый режим и кодек действуют после отправки вызова.
+        """
+        LOG.debug(f'Начата авторизация для {message[vrs.USER]}')
+        account_name = message[vrs.USER][vrs.ACCOUNT_NAME]
+        if account_name in self.clients_names or account_name in self.directory:
+            self.reject_client(client, 'Имя пользователя уже занято.')
+        elif not self.database.check_user(account_name):
+            self.reject_client(client, 'Пользователь не зарегистрирован.')
+        else:
+            LOG.debug('Correct username, starting passwd check.')
+            message_auth = self.RESPONSES['511'].copy()
+            random_str = binascii.hexlify(os.urandom(64))
+            message_auth[vrs.DATA] = random_str.decode('ascii')
+            framed = message.get(vrs.FRAMING) == vrs.FRAMING_LENGTH_PREFIX
+            codec = JSON
+            if framed:
+                message_auth[vrs.FRAMING] = vrs.FRAMING_LENGTH_PREFIX
+                if vrs.CODECS in message:
+                    codec = choose_codec(message[vrs.CODECS])
+                    message_auth[vrs.CODEC] = codec.name
+            handshake = self.handshakes[client]
+            handshake.account_name = account_name
+            handshake.pubkey = message[vrs.USER].get(vrs.PUBLIC_KEY)
+            handshake.passwd_hash = self.database.get_hash(account_name)
+            handshake.challenge = random_str
+            client.auth_state = vrs.AUTH_CHALLENGED
+            LOG.debug(f'Auth message = {message_auth}')
+            try:
+                self.send_to_client(client, message_auth)
+            except OSError as err:
+                LOG.debug('Error in auth, data:', exc_info=err)
+                self.disconnect_client(client)
+                return
+            if framed:
+                self.enable_framing(client, codec)
+
+    def check_auth_answer(self, answer, client):
+        """
+        Метод, реализующий авторизцию пользователей (второй этап, AUTH_CHALLENGED -> AUTH_VERIFYING):
+        ответ клиента передаётся на проверку исполнителю криптографических операций,
+        чтение от клиента приостанавливается до получения результата
+        """
+        handshake = self.handshakes[client]
+        LOG.debug(f'Auth client message = {answer}')
+        try:
+            client_digest = binascii.a2b_base64(answer[vrs.DATA])
+        except (KeyError, TypeError, binascii.Error):
+            client_digest = b''
+        if answer.get(vrs.RESPONSE) != 511 or not client_digest:
+            self.reject_client(client, 'Неверный пароль.')
+            return
+        client.auth_state = vrs.AUTH_VERIFYING
+        self.pause_reading(client)
+        future = self.crypto.submit(verify_challenge, handshake.passwd_hash, handshake.challenge, client_digest)
+        future.add_done_callback(lambda result: self.call_soon(self.finish_auth, client, result))
+
+    def finish_auth(self, client, result):
+        """
+        Метод завершения авторизации по результату проверки ответа (AUTH_VERIFYING -> AUTH_DONE).
+        Выполняется в потоке сервера. Чтение от клиента возобновляется после авторизации,
+        поэтому сообщения, отправленные клиентом сразу за ответом, обрабатываются уже авторизованными.
+        """
+        handshake = self.handshakes.pop(client, None)
+        if handshake is None or client.closed:
+            return
+        try:
+            verified = result.result()
+        except Exception as err:
+            LOG.error(f'Ошибка проверки ответа клиента {handshake.account_name}: {err}')
+            verified = False
+        if not verified:
+            self.reject_client(client, 'Неверный пароль.')
+            return
+        account_name = handshake.account_name
+        if account_name in self.clients_names or account_name in self.directory:
+            self.reject_client(client, 'Имя пользователя уже занято.')
+            return
+        self.clients_names[account_name] = client
+        self.publish_presence(account_name, True)
+        client.auth_state = vrs.AUTH_DONE
+        client_ip, client_port = self.client_address(client)
+        try:
+            self.send_to_client(client, self.RESPONSES['200'])
+            LOG.debug(f'Auth client complete')
+            with self.new_connection.locker:
+                self.new_connection.value = True
+        except OSError:
+            self.remove_client(client)
+            return
+        self.database.login_user(account_name, client_ip, client_port, handshake.pubkey)
+        self.deliver_offline_messages(account_name, client)
+        self.continue_reading(client)
+
+    def service_update_lists(self, added=(), removed=()):
+        """
+        Метод рассылки клиентам сообщения об обновлении списка пользователей на сервере.
+        Каждое изменение увеличивает версию списка (users_version, её же содержит ответ на запрос пользователей).
+        Сообщение 205 содержит версию и изменения списка: клиент применяет их к своему списку
+        и запрашивает список полностью, только если пропустил версию.
+        Без переданных изменений рассылается сообщение 205 без версии - клиенты запрашивают список полностью.
+        :param added: имена зарегистрированных пользователей
+        :param removed: имена удалённых пользователей
+        """
+        self.users_version += 1
+        for members in self.rooms.values():
+            members.difference_update(removed)
+        message = self.RESPONSES['205']
+        if added or removed:
+            message = message.copy()
+            message[vrs.USERS_VERSION] = self.users_version
+            message[vrs.USERS_ADDED] = list(added)
+            message[vrs.USERS_REMOVED] = list(removed)
+        self.broadcast(message, self.clients_names.values())
+
+    def broadcast(self, message, clients):
+        """
+        Метод рассылки одного сообщения нескольким клиентам. Сообщение кодируется один раз
+        для каждого кодека и режима соединений (PreparedMessage), в очереди всех соединений
+        ставятся одни и те же данные. Соединения, отправка в которые не удалась,
+        отключаются после завершения рассылки.
+        :param message: сообщение (словарь или PreparedMessage)
+        :param clients: соединения получателей
+        :return: количество получателей, которым сообщение поставлено в очередь
+        """
+        if not isinstance(message, PreparedMessage):
+            message = PreparedMessage(message)
+        clients = [client for client in clients if not client.closed]
+        failed = []
+        for client in clients:
+            try:
+                self.send_to_client(client, message)
+            except OSError:
+                failed.append(client)
+        for client in failed:
+            self.remove_client(client)
+        return len(clients) - len(failed)
@@ -3,52 +3,242 @@
 """
 
 
+import common.variables as vrs
+import logs.server_log_config
+from common.crypto import create_crypto_executor
 from server.server_class import Server, NewConnection
-from server.server_gui_classes import ServerGuiManager
+from server.async_server_class import AsyncServer
+from server.federation_class import Federation, parse_peers
+from server.selector_server_class import SelectorServer
+from server.shard_class import ShardBus, sharding_supported
+from server.storage_backends import create_storage
 
 import configparser
+import logging
+import multiprocessing
 import os
 import argparse
+import shutil
+import signal
+import tempfile
+import threading
 
 
-def get_params(default_port, default_address):
+LOG = logging.getLogger('server')
+
+
+SERVER_ENGINES = {
+    'thread': Server,
+    'asyncio': AsyncServer,
+    'selectors': SelectorServer,
+}
+
+
+def get_params():
     """
     Функция получения параметров при запуске из комадной строки
+    (порт и адрес по умолчанию берутся из конфигурации)
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument('-p', type=int, default=default_port)
-    parser.add_argument('-a', type=str, default=default_address)
-    args = parser.parse_args()
-    return args.p, args.a
+    parser.add_argument('-p', type=int, default=None)
+    parser.add_argument('-a', type=str, default=None)
+    parser.add_argument('-c', '--config', type=str, default=None,
+                        help='файл конфигурации (по умолчанию server/server.ini)')
+    parser.add_argument('--headless', action='store_true', help='запуск без графической оболочки')
+    return parser.parse_args()
 
 
-def get_config():
+def get_config(path=None):
     """
     Функция получения конфигурации сервера из файла ini в конфигрутор
     """
     config = configparser.ConfigParser()
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    config.read(f"{dir_path}/{'server.ini'}")
+    if path is None:
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        path = f"{dir_path}/{'server.ini'}"
+    config.read(path)
     return config
 
 
-def start_server():
+def get_storage_options(config):
     """
-    Функция, запускающая сервер
+    Функция получения параметров базы данных сервера из конфигурации
     """
-    new_connection = NewConnection()
+    settings = config['SETTINGS']
+    options = {
+        'backend': settings.get('storage_backend', 'sqlalchemy'),
+        'offline_ttl': settings.getint('offline_message_ttl', vrs.OFFLINE_MESSAGE_TTL),
+        'offline_quota': settings.getint('offline_message_quota', vrs.OFFLINE_MESSAGE_QUOTA),
+    }
+    if options['backend'] == 'sqlalchemy':
+        options.update({
+            'counters_flush_interval': settings.getint('counters_flush_interval', vrs.COUNTERS_FLUSH_INTERVAL),
+            'counters_flush_messages': settings.getint('counters_flush_messages', vrs.COUNTERS_FLUSH_MESSAGES),
+            'sqlite_synchronous': settings.get('sqlite_synchronous', vrs.SQLITE_SYNCHRONOUS),
+            'sqlite_cache_size': settings.getint('sqlite_cache_size', vrs.SQLITE_CACHE_SIZE),
+            'database_url': settings.get('database_url') or None,
+            'pool_size': settings.getint('database_pool_size', vrs.DATABASE_POOL_SIZE),
+            'max_overflow': settings.getint('database_max_overflow', vrs.DATABASE_MAX_OVERFLOW),
+        })
+    return options
 
-    server_config = get_config()
-    listen_port, listen_address = get_params(
-        server_config['SETTINGS']['default_port'], server_config['SETTINGS']['listen_address'])
 
-    db_path = os.path.join(server_config['SETTINGS']['Database_path'], server_config['SETTINGS']['Database_file'])
+def create_federation(server_config, listen_address, listen_port):
+    """
+    Функция создания канала федерации по конфигурации (None, если порт федерации не задан).
+    Без общего секрета федерации (federation_secret) федерация не запускается (возвращается None).
+    """
+    settings = server_config['SETTINGS']
+    federation_port = settings.getint('federation_port', 0)
+    if not federation_port:
+        return None
+    if not settings.get('federation_secret', ''):
+        LOG.critical('Не задан federation_secret, запуск федерации серверов невозможен')
+        return None
+    return Federation(
+        settings.get('node_name') or f'{listen_address or "0.0.0.0"}:{listen_port}',
+        listen_address,
+        federation_port,
+        parse_peers(settings.get('federation_peers', '')),
+        settings.get('federation_secret', ''))
 
-    server = Server(listen_port, listen_address, db_path, new_connection)
-    server.daemon = True
-    server.start()
+
+def run_headless():
+    """
+    Функция работы сервера без графической оболочки: ожидание сигнала SIGINT или SIGTERM
+    """
+    stop_event = threading.Event()
+
+    def stop_handler(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+    stop_event.wait()
+
+
+def run_gui(server, new_connection, server_config):
+    """
+    Функция работы сервера с графической оболочкой (PyQt импортируется только в этом режиме)
+    """
+    from server.server_gui_classes import ServerGuiManager
 
     server_manager = ServerGuiManager(server.database, new_connection, server, server_config)
     server_manager.start_timer()
     server_manager.show_main_window()
     server_manager.app.exec_()
+
+
+def create_server(server_config, listen_port, listen_address, new_connection, reuse_port=False):
+    """
+    Функция создания сервера по конфигурации
+    """
+    settings = server_config['SETTINGS']
+    db_path = os.path.join(settings['Database_path'], settings['Database_file'])
+    engine = SERVER_ENGINES[settings.get('engine', 'thread')]
+    crypto = create_crypto_executor(
+        settings.get('crypto_executor', vrs.CRYPTO_EXECUTOR),
+        settings.getint('crypto_workers', vrs.CRYPTO_WORKERS) or None)
+    server = engine(listen_port, listen_address, db_path, new_connection, get_storage_options(server_config),
+                    reuse_port, crypto)
+    server.handshake_timeout = settings.getint('handshake_timeout', vrs.HANDSHAKE_TIMEOUT)
+    server.max_pending_handshakes = settings.getint('max_pending_handshakes', vrs.MAX_PENDING_HANDSHAKES)
+    server.daemon = True
+    return server
+
+
+def shutdown_server(server):
+    """
+    Функция остановки сервера: закрытие соединений, завершение исполнителя и базы данных
+    """
+    server.stop()
+    server.join(vrs.SHUTDOWN_TIMEOUT)
+    server.crypto.shutdown(wait=False)
+    server.database.close()
+    for link in server.links:
+        link.close()
+
+
+def run_shard(shard, bus_paths, server_config, listen_port, listen_address):
+    """
+    Функция рабочего процесса (шарда): сервер на общем порту с шиной маршрутизации
+    к остальным шардам, работа до сигнала SIGINT или SIGTERM
+    """
+    server = create_server(server_config, listen_port, listen_address, NewConnection(), reuse_port=True)
+    server.attach_link(ShardBus(shard, bus_paths))
+    server.start()
+    LOG.info(f'Шард {shard} запущен (процесс {os.getpid()})')
+    run_headless()
+    shutdown_server(server)
+
+
+def run_shards(workers, server_config, listen_port, listen_address):
+    """
+    Функция запуска сервера в несколько рабочих процессов. Процессы принимают подключения на общем порту
+    (SO_REUSEPORT, распределение выполняет ядро) и пересылают друг другу сообщения по шине маршрутизации.
+    Схема базы данных готовится один раз до запуска процессов; все шарды работают с общей базой.
+    """
+    settings = server_config['SETTINGS']
+    storage_options = get_storage_options(server_config)
+    if storage_options['backend'] != 'sqlalchemy':
+        LOG.warning(f'База {storage_options["backend"]} не разделяется между процессами, '
+                    f'каждый шард будет работать со своей базой')
+    create_storage(os.path.join(settings['Database_path'], settings['Database_file']), **storage_options).close()
+
+    bus_dir = tempfile.mkdtemp(prefix='jim-shards-')
+    bus_paths = [os.path.join(bus_dir, f'shard{shard}.sock') for shard in range(workers)]
+    processes = [
+        multiprocessing.Process(
+            target=run_shard, args=(shard, bus_paths, server_config, listen_port, listen_address))
+        for shard in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    LOG.info(f'Запущено шардов: {workers}, порт {listen_port}')
+
+    run_headless()
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(vrs.SHUTDOWN_TIMEOUT * 2)
+        if process.is_alive():
+            process.kill()
+    shutil.rmtree(bus_dir, ignore_errors=True)
+
+
+def start_server():
+    """
+    Функция, запускающая сервер
+    """
+    new_connection = NewConnection()
+
+    params = get_params()
+    server_config = get_config(params.config)
+    listen_port = params.p or server_config['SETTINGS'].getint('default_port', vrs.DEFAULT_PORT)
+    listen_address = server_config['SETTINGS']['listen_address'] if params.a is None else params.a
+
+    workers = server_config['SETTINGS'].getint('workers', vrs.SERVER_WORKERS)
+    if workers > 1 and not sharding_supported():
+        LOG.error('Платформа не поддерживает работу сервера в несколько процессов, сервер запущен в одном процессе')
+        workers = 1
+    if workers > 1:
+        if not params.headless:
+            LOG.warning('Сервер в несколько процессов работает без графической оболочки')
+        if server_config['SETTINGS'].getint('federation_port', 0):
+            LOG.warning('Федерация серверов не поддерживается при работе в несколько процессов')
+        run_shards(workers, server_config, listen_port, listen_address)
+        return
+
+    server = create_server(server_config, listen_port, listen_address, new_connection)
+    federation = create_federation(server_config, listen_address, listen_port)
+    if federation is not None:
+        server.attach_link(federation)
+    server.start()
+
+    if params.headless:
+        run_headless()
+    else:
+        run_gui(server, new_connection, server_config)
+
+    shutdown_server(server)
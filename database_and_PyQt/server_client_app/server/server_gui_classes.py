@@ -3,14 +3,14 @@
 """
 
 
-import binascii
-import hashlib
 import sys
 import configparser
 
 from PyQt5.QtWidgets import QMainWindow, QAction, qApp, QApplication, QLabel, QTableView, QMessageBox
 from PyQt5.QtGui import QStandardItemModel, QStandardItem
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from common.crypto import hash_password
 
 from server.server_gui_dialog_classes import HistoryWindow, ConfigWindow, RegisterUser, DelUserDialog
 
@@ -149,6 +149,14 @@ class MainWindow(QMainWindow):
         self.statusBar()
 
 
+class CryptoNotifier(QObject):
+    """
+    Класс передачи результатов криптографических операций из рабочих потоков в поток графической оболочки
+    """
+
+    password_hashed = pyqtSignal(str, bytes)
+
+
 class ServerGuiManager:
     """
     Класс управления графической оболочкой сервера
@@ -162,6 +170,8 @@ class ServerGuiManager:
         self.database = database
         self.server = server
         self.new_connection = new_connection
+        self.crypto_notifier = CryptoNotifier()
+        self.crypto_notifier.password_hashed.connect(self.register_user)
         self.create_widgets()
         self.config = config if config else configparser.ConfigParser()
         self.timer = QTimer()
@@ -257,12 +267,12 @@ class ServerGuiManager:
         """
         Метод удаления пользователя с сервера
         """
-        self.database.remove_user(self.del_user_window.selector.currentText())
-        if self.del_user_window.selector.currentText() in self.server.clients_names:
-            sock = self.server.clients_names[self.del_user_window.selector.currentText()]
-            del self.server.clients_names[self.del_user_window.selector.currentText()]
-            self.server.remove_client(sock)
-        self.server.service_update_lists()
+        name = self.del_user_window.selector.currentText()
+        self.database.remove_user(name)
+        client = self.server.clients_names.get(name)
+        if client is not None:
+            self.server.remove_client(client)
+        self.server.service_update_lists(removed=[name])
         self.del_user_window.hide()
 
     def save_data(self):
@@ -282,17 +292,22 @@ class ServerGuiManager:
                 self.add_user_window, 'Ошибка', 'Пользователь уже существует.')
             return
         else:
-            passwd_bytes = self.add_user_window.client_passwd.text().encode('utf-8')
-            salt = self.add_user_window.client_name.text().lower().encode('utf-8')
-            passwd_hash = hashlib.pbkdf2_hmac(
-                'sha512', passwd_bytes, salt, 10000)
-            self.database.add_user(
-                self.add_user_window.client_name.text(),
-                binascii.hexlify(passwd_hash))
-            self.add_user_window.messages.information(
-                self.add_user_window, 'Успех', 'Пользователь успешно зарегистрирован.')
-            self.server.service_update_lists()
-            self.add_user_window.hide()
+            self.add_user_window.btn_ok.setEnabled(False)
+            name = self.add_user_window.client_name.text()
+            passwd_hash = self.server.crypto.submit(hash_password, name, self.add_user_window.client_passwd.text())
+            passwd_hash.add_done_callback(
+                lambda result: self.crypto_notifier.password_hashed.emit(name, result.result()))
+
+    def register_user(self, name, passwd_hash):
+        """
+        Метод записи нового пользователя в базу после вычисления хэша пароля в пуле исполнителя
+        """
+        self.add_user_window.btn_ok.setEnabled(True)
+        self.database.add_user(name, passwd_hash)
+        self.add_user_window.messages.information(
+            self.add_user_window, 'Успех', 'Пользователь успешно зарегистрирован.')
+        self.server.service_update_lists(added=[name])
+        self.add_user_window.hide()
 
     def save_server_settings(self):
         """
@@ -3,11 +3,265 @@
 """
 
 
+import atexit
 import datetime
-
-from sqlalchemy import Column, create_engine, Integer, String, DateTime, ForeignKey, Text
+import json
+import logging
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+from sqlalchemy import Column, create_engine, event, Integer, String, DateTime, ForeignKey, Text, Index, \
+    bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, sessionmaker
-from common.variables import DATABASE_SERVER
+from sqlalchemy.pool import QueuePool
+from common.variables import DATABASE_SERVER, OFFLINE_MESSAGE_TTL, OFFLINE_MESSAGE_QUOTA, \
+    COUNTERS_FLUSH_INTERVAL, COUNTERS_FLUSH_MESSAGES, SQLITE_SYNCHRONOUS, SQLITE_CACHE_SIZE, \
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW
+from common.wire_codecs import json_default
+
+
+LOG = logging.getLogger('server')
+
+
+UserRecord = namedtuple('UserRecord', ['id', 'passwd_hash'])
+
+
+class UsersCache:
+    """
+    Класс кэша справочника пользователей: имя -> (id, хэш пароля).
+    Публичный ключ не кэшируется: он меняется при входе пользователя через любой процесс сервера,
+    работающий с этой базой. Ведёт статистику попаданий и промахов.
+    """
+
+    def __init__(self):
+        """
+        Метод инициализации
+        """
+        self.records = dict()
+        self.hits = 0
+        self.misses = 0
+        self.locker = threading.Lock()
+
+    def get(self, name):
+        """
+        Метод получения записи пользователя из кэша (None при отсутствии)
+        """
+        with self.locker:
+            record = self.records.get(name)
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return record
+
+    def put(self, name, record):
+        """
+        Метод сохранения записи пользователя в кэше
+        """
+        with self.locker:
+            self.records[name] = record
+
+    def invalidate(self, name):
+        """
+        Метод удаления записи пользователя из кэша
+        """
+        with self.locker:
+            self.records.pop(name, None)
+
+    def stats(self):
+        """
+        Метод получения статистики кэша
+        """
+        with self.locker:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.records)}
+
+
+class StorageWriter:
+    """
+    Класс потока записи в базу данных.
+    Все изменяющие базу операции выполняются по очереди в одном потоке со своей сессией,
+    поэтому транзакции из потока сервера и потока графической оболочки не пересекаются.
+    """
+
+    def __init__(self, session_factory):
+        """
+        Метод инициализации. Запускается поток записи.
+        :param session_factory: фабрика сессий базы данных
+        """
+        self.session_factory = session_factory
+        self.commands = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, transaction, *args):
+        """
+        Метод постановки операции в очередь записи.
+        Операция - функция, принимающая сессию и аргументы; после неё выполняется commit.
+        Операция, поставленная из самого потока записи, выполняется сразу в транзакции текущей операции.
+        Возвращает объект Future с результатом операции.
+        """
+        future = Future()
+        if threading.current_thread() is self.thread:
+            try:
+                future.set_result(transaction(self.session, *args))
+            except Exception as err:
+                future.set_exception(err)
+        else:
+            self.commands.put((transaction, args, future))
+        return future
+
+    def call(self, transaction, *args):
+        """
+        Метод выполнения операции в потоке записи с ожиданием результата
+        """
+        return self.submit(transaction, *args).result()
+
+    @staticmethod
+    def execute(session, transaction, args, future):
+        """
+        Метод выполнения одной операции в транзакции
+        """
+        try:
+            result = transaction(session, *args)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            LOG.error(f'Ошибка записи в базу данных: {err}')
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+
+    def run(self):
+        """
+        Основной метод потока записи
+        """
+        self.session = self.session_factory()
+        while True:
+            command = self.commands.get()
+            if command is None:
+                break
+            self.execute(self.session, *command)
+        self.session.close()
+
+    def stop(self):
+        """
+        Метод остановки потока записи после выполнения всех поставленных операций
+        """
+        if self.thread.is_alive():
+            self.commands.put(None)
+            self.thread.join()
+
+
+class MessageCounters:
+    """
+    Класс агрегатора счётчиков сообщений (отложенная запись).
+    Приращения счётчиков отправленных и полученных сообщений накапливаются в памяти
+    и передаются потоку записи одним пакетным UPDATE раз в flush_interval миллисекунд
+    или после flush_messages сообщений.
+    """
+
+    def __init__(self, writer, users_table, history_table, flush_interval, flush_messages):
+        """
+        Метод инициализации. Запускается поток периодической записи счётчиков.
+        """
+        self.writer = writer
+        self.users_table = users_table
+        self.history_table = history_table
+        self.flush_interval = flush_interval / 1000
+        self.flush_messages = flush_messages
+        self.deltas = dict()
+        self.messages_count = 0
+        self.locker = threading.Lock()
+        self.flush_locker = threading.Lock()
+        self.flush_needed = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, sender, receiver):
+        """
+        Метод учёта сообщения: увеличивает счётчик отправленных у отправителя и полученных у получателя
+        """
+        with self.locker:
+            self.deltas.setdefault(sender, [0, 0])[0] += 1
+            self.deltas.setdefault(receiver, [0, 0])[1] += 1
+            self.messages_count += 1
+            if self.messages_count >= self.flush_messages:
+                self.flush_needed.set()
+
+    def flush(self):
+        """
+        Метод записи накопленных приращений счётчиков в базу одной транзакцией.
+        Если запись не удалась, приращения возвращаются в накопленные и будут записаны при следующей записи.
+        """
+        with self.flush_locker:
+            with self.locker:
+                deltas, self.deltas = self.deltas, dict()
+                self.messages_count = 0
+            if not deltas:
+                return
+            try:
+                self.writer.call(self.write_deltas, deltas)
+            except Exception:
+                with self.locker:
+                    for name, (sent, accepted) in deltas.items():
+                        counters = self.deltas.setdefault(name, [0, 0])
+                        counters[0] += sent
+                        counters[1] += accepted
+                raise
+
+    def write_deltas(self, session, deltas):
+        """
+        Операция записи приращений счётчиков (выполняется в потоке записи)
+        """
+        users_ids = dict(session.execute(
+            select(self.users_table.c.name, self.users_table.c.id).where(
+                self.users_table.c.name.in_(list(deltas)))).all())
+        params = [
+            {'user_id': users_ids[name], 'sent_delta': sent, 'accepted_delta': accepted}
+            for name, (sent, accepted) in deltas.items() if name in users_ids
+        ]
+        if params:
+            session.execute(
+                update(self.history_table).where(
+                    self.history_table.c.user == bindparam('user_id')
+                ).values(
+                    sent=self.history_table.c.sent + bindparam('sent_delta'),
+                    accepted=self.history_table.c.accepted + bindparam('accepted_delta')
+                ),
+                params
+            )
+
+    def run(self):
+        """
+        Основной метод потока записи счётчиков
+        """
+        while not self.stopped.is_set():
+            self.flush_needed.wait(self.flush_interval)
+            self.flush_needed.clear()
+            try:
+                self.flush()
+            except Exception:
+                LOG.exception('Ошибка записи счётчиков сообщений, запись будет повторена')
+
+    def stop(self):
+        """
+        Метод остановки потока с записью оставшихся счётчиков
+        """
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.flush_needed.set()
+        self.thread.join()
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception('Ошибка записи счётчиков сообщений при остановке, счётчики не записаны')
 
 
 class ServerStorage:
@@ -44,6 +298,9 @@ class ServerStorage:
         Класс модели таблицы историзации входа пользователей
         """
         __tablename__ = 'login_history'
+        __table_args__ = (
+            Index('ix_login_history_name_date_time', 'name', 'date_time'),
+        )
         id = Column(Integer, primary_key=True)
         name = Column(ForeignKey('users.id'))
         ip_address = Column(String)
@@ -55,6 +312,10 @@ class ServerStorage:
         Класс модели таблицы контактов пользователей
         """
         __tablename__ = 'users_contacts'
+        __table_args__ = (
+            Index('ix_users_contacts_user_contact', 'user', 'contact', unique=True),
+            Index('ix_users_contacts_contact', 'contact'),
+        )
         id = Column(Integer, primary_key=True)
         user = Column(ForeignKey('users.id'))
         contact = Column(ForeignKey('users.id'))
@@ -64,206 +325,500 @@ class ServerStorage:
         Класс модели таблицы истории сообщений
         """
         __tablename__ = 'history'
+        __table_args__ = (
+            Index('ix_history_user', 'user'),
+        )
         id = Column(Integer, primary_key=True)
         user = Column(ForeignKey('users.id'))
         sent = Column(Integer, default=0)
         accepted = Column(Integer, default=0)
 
-    def __init__(self, db_path=DATABASE_SERVER):
+    class OfflineMessages(Base):
         """
-        Метод инициализации. В нём создаётся движок базы данных,
-        создаются таблицы (при необходимости), объект сессии и очищается таблица активных пользователей.
+        Класс модели таблицы сообщений, ожидающих доставки пользователям не в сети
+        """
+        __tablename__ = 'offline_messages'
+        id = Column(Integer, primary_key=True)
+        recipient = Column(ForeignKey('users.id'), index=True)
+        sender = Column(String)
+        message = Column(Text)
+        created = Column(DateTime)
+
+    class RoomMembers(Base):
+        """
+        Класс модели таблицы участников комнат (групповых чатов)
+        """
+        __tablename__ = 'room_members'
+        __table_args__ = (
+            Index('ix_room_members_room_user', 'room', 'user', unique=True),
+            Index('ix_room_members_user', 'user'),
+        )
+        id = Column(Integer, primary_key=True)
+        room = Column(String)
+        user = Column(ForeignKey('users.id'))
+
+    class SchemaVersion(Base):
+        """
+        Класс модели таблицы версии схемы базы данных
+        """
+        __tablename__ = 'schema_version'
+        id = Column(Integer, primary_key=True)
+        version = Column(Integer, default=0)
+
+    def __init__(self, db_path=DATABASE_SERVER, offline_ttl=OFFLINE_MESSAGE_TTL, offline_quota=OFFLINE_MESSAGE_QUOTA,
+                 counters_flush_interval=COUNTERS_FLUSH_INTERVAL, counters_flush_messages=COUNTERS_FLUSH_MESSAGES,
+                 sqlite_synchronous=SQLITE_SYNCHRONOUS, sqlite_cache_size=SQLITE_CACHE_SIZE,
+                 database_url=None, pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW):
         """
-        self.engine = create_engine(f'sqlite:///{db_path}', echo=False,
-                                    pool_recycle=7200, connect_args={'check_same_thread': False})
+        Метод инициализации. В нём создаётся движок базы данных,
+        создаются таблицы (при необходимости), схема существующей базы обновляется до текущей версии,
+        запускается поток записи и очищается таблица активных пользователей.
+        Изменения базы выполняются только потоком записи, для чтения каждый вызов открывает свою сессию.
+        :param offline_ttl: срок хранения сообщений для пользователей не в сети (в секундах)
+        :param offline_quota: максимальное количество хранимых сообщений для одного пользователя
+        :param counters_flush_interval: интервал записи счётчиков сообщений в базу (в миллисекундах)
+        :param counters_flush_messages: количество сообщений, после которого счётчики записываются в базу
+        :param sqlite_synchronous: режим PRAGMA synchronous
+        :param sqlite_cache_size: значение PRAGMA cache_size (отрицательное - в килобайтах)
+        :param database_url: адрес базы данных SQLAlchemy (например, postgresql://...),
+        если не задан - используется файл SQLite db_path
+        :param pool_size: количество постоянных соединений в пуле
+        :param max_overflow: количество дополнительных соединений сверх pool_size
+        """
+        url = make_url(database_url or f'sqlite:///{db_path}')
+        connect_args = {'check_same_thread': False} if url.get_backend_name() == 'sqlite' else {}
+        self.engine = create_engine(url, echo=False, poolclass=QueuePool, pool_size=pool_size,
+                                    max_overflow=max_overflow, pool_recycle=7200, pool_pre_ping=True,
+                                    connect_args=connect_args)
+        self.sqlite_synchronous = sqlite_synchronous
+        self.sqlite_cache_size = sqlite_cache_size
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', self.set_pragmas)
         self.Base.metadata.create_all(self.engine)
-        self.session = sessionmaker(bind=self.engine)()
-        self.session.query(self.ActiveUsers).delete()
-        self.session.commit()
+        self.migrate()
+        self.Session = sessionmaker(bind=self.engine)
+        self.offline_ttl = datetime.timedelta(seconds=offline_ttl)
+        self.offline_quota = offline_quota
+        self.users_cache = UsersCache()
+        self.writer = StorageWriter(self.Session)
+        self.writer.call(self.clear_sessions_data)
+        self.counters = MessageCounters(
+            self.writer, self.Users.__table__, self.UsersHistory.__table__,
+            counters_flush_interval, counters_flush_messages)
+        atexit.register(self.close)
+
+    def set_pragmas(self, dbapi_connection, connection_record):
+        """
+        Метод настройки нового соединения SQLite: журнал WAL (чтение не блокируется записью),
+        режим синхронизации и размер кэша страниц
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={self.sqlite_synchronous}')
+        cursor.execute(f'PRAGMA cache_size={int(self.sqlite_cache_size)}')
+        cursor.close()
+
+    def clear_sessions_data(self, session):
+        """
+        Операция очистки таблицы активных пользователей и сообщений с истёкшим сроком хранения
+        """
+        session.query(self.ActiveUsers).delete()
+        session.query(self.OfflineMessages).filter(
+            self.OfflineMessages.created < datetime.datetime.now() - self.offline_ttl).delete()
+
+    def migrate(self):
+        """
+        Метод обновления схемы базы данных. Выполняет по порядку все миграции
+        с номером больше записанной в базе версии схемы, в одной транзакции.
+        """
+        version_table = self.SchemaVersion.__table__
+        with self.engine.begin() as connection:
+            version = connection.execute(select(version_table.c.version)).scalar()
+            if version is None:
+                connection.execute(insert(version_table).values(id=1, version=0))
+                version = 0
+            for number, migration in enumerate(self.MIGRATIONS, start=1):
+                if number > version:
+                    migration(self, connection)
+            if version < len(self.MIGRATIONS):
+                connection.execute(update(version_table).values(version=len(self.MIGRATIONS)))
+
+    def migration_indexes(self, connection):
+        """
+        Миграция 1: индексы для поиска по пользователю и уникальность пары (пользователь, контакт).
+        Перед созданием уникального индекса удаляются повторяющиеся записи контактов.
+        """
+        contacts = self.UsersContacts.__table__
+        connection.execute(delete(contacts).where(contacts.c.id.notin_(
+            select(func.min(contacts.c.id)).group_by(contacts.c.user, contacts.c.contact)
+        )))
+        for model in (self.UsersContacts, self.LoginHistory, self.UsersHistory):
+            for index in model.__table__.indexes:
+                index.create(connection, checkfirst=True)
+
+    MIGRATIONS = (
+        migration_indexes,
+    )
+
+    def insert_ignore(self, table):
+        """
+        Метод построения запроса вставки, не выполняющего ничего при нарушении уникальности
+        (upsert для SQLite и PostgreSQL)
+        """
+        dialect = {'sqlite': sqlite, 'postgresql': postgresql}[self.engine.dialect.name]
+        return dialect.insert(table).on_conflict_do_nothing()
+
+    def read_session(self):
+        """
+        Метод получения сессии для чтения: в потоке записи (внутри пакета операций) - сессия текущей
+        транзакции, в остальных потоках - новая сессия
+        """
+        if threading.current_thread() is self.writer.thread:
+            return nullcontext(self.writer.session)
+        return self.Session()
+
+    def batch(self, operations):
+        """
+        Метод выполнения нескольких операций одной транзакцией в потоке записи
+        (чтения внутри пакета видят изменения предыдущих операций пакета)
+        :param operations: функция без аргументов, выполняющая операции с базой
+        :return: результат функции
+        """
+        return self.writer.call(lambda session: operations())
+
+    def close(self):
+        """
+        Метод завершения работы с базой: записываются накопленные счётчики сообщений,
+        выполняются оставшиеся операции записи
+        """
+        self.counters.stop()
+        self.writer.stop()
+
+    def get_user_record(self, name):
+        """
+        Метод получения записи пользователя (id, хэш пароля).
+        Запись берётся из кэша, при промахе - из базы с сохранением в кэш.
+        Возвращает None, если пользователь не зарегистрирован.
+        """
+        record = self.users_cache.get(name)
+        if record is None:
+            with self.read_session() as session:
+                row = session.query(self.Users.id, self.Users.passwd_hash).filter_by(name=name).first()
+            if row:
+                record = UserRecord(*row)
+                self.users_cache.put(name, record)
+        return record
+
+    def cache_stats(self):
+        """
+        Метод получения статистики кэша пользователей (попадания, промахи, размер)
+        """
+        return self.users_cache.stats()
 
     def login_user(self, username, ip_address, port, key):
         """
-        Метод для записи данных в базу о входе пользователя
+        Метод для записи данных в базу о входе пользователя.
+        Запись выполняется потоком записи без ожидания результата. Запись активного пользователя,
+        оставшаяся от предыдущего подключения (например, к другому шарду), заменяется.
         """
-        user = self.session.query(self.Users).filter_by(name=username).first()
+        user = self.get_user_record(username)
+        if not user:
+            raise ValueError('Пользователь не зарегистрирован.')
         login_time = datetime.datetime.now()
 
-        if user:
-            user.last_login = login_time
-            if user.pubkey != key:
-                user.pubkey = key
-        else:
-            raise ValueError('Пользователь не зарегистрирован.')
+        def transaction(session):
+            session.query(self.Users).filter_by(id=user.id).update({'last_login': login_time, 'pubkey': key})
+            session.query(self.ActiveUsers).filter_by(user=user.id).delete()
 
-        active_users = {
-            'user': user.id,
-            'ip_address': ip_address,
-            'port': port,
-            'login_time': login_time
-        }
+            active_users = {
+                'user': user.id,
+                'ip_address': ip_address,
+                'port': port,
+                'login_time': login_time
+            }
 
-        history = {
-            'name': user.id,
-            'ip_address': ip_address,
-            'port': port,
-            'date_time': login_time
-        }
+            history = {
+                'name': user.id,
+                'ip_address': ip_address,
+                'port': port,
+                'date_time': login_time
+            }
 
-        self.session.add_all([self.ActiveUsers(**active_users), self.LoginHistory(**history)])
-        self.session.commit()
+            session.add_all([self.ActiveUsers(**active_users), self.LoginHistory(**history)])
+
+        self.writer.submit(transaction)
 
     def logout_user(self, username):
         """
         Метод, удаляющий запись из таблицы активных пользователей при выходе пользователя из чата
         """
-        user = self.session.query(self.Users).filter_by(name=username).first()
-        self.session.query(self.ActiveUsers).filter_by(user=user.id).delete()
-        self.session.commit()
+        user = self.get_user_record(username)
+        if not user:
+            return
+
+        def transaction(session):
+            session.query(self.ActiveUsers).filter_by(user=user.id).delete()
+
+        self.writer.submit(transaction)
 
     def add_user(self, name, passwd_hash):
         """
         Метод регистрации пользователя.
         Принимает имя и хэш пароля, создаёт запись в таблице статистики.
         """
-        user_row = self.Users(name=name, passwd_hash=passwd_hash)
-        self.session.add(user_row)
-        self.session.commit()
-        history_row = self.UsersHistory(user=user_row.id)
-        self.session.add(history_row)
-        self.session.commit()
+        def transaction(session):
+            user_row = self.Users(name=name, passwd_hash=passwd_hash)
+            session.add(user_row)
+            session.flush()
+            session.add(self.UsersHistory(user=user_row.id))
+            return user_row.id
+
+        user_id = self.writer.call(transaction)
+        self.users_cache.put(name, UserRecord(user_id, passwd_hash))
 
     def remove_user(self, name):
         """
         Метод, удаляющий пользователя из базы.
         """
-        user = self.session.query(self.Users).filter_by(name=name).first()
-        self.session.query(self.ActiveUsers).filter_by(user=user.id).delete()
-        self.session.query(self.LoginHistory).filter_by(name=user.id).delete()
-        self.session.query(self.UsersContacts).filter_by(user=user.id).delete()
-        self.session.query(
-            self.UsersContacts).filter_by(
-            contact=user.id).delete()
-        self.session.query(self.UsersHistory).filter_by(user=user.id).delete()
-        self.session.query(self.Users).filter_by(name=name).delete()
-        self.session.commit()
+        user = self.get_user_record(name)
+
+        def transaction(session):
+            session.query(self.ActiveUsers).filter_by(user=user.id).delete()
+            session.query(self.LoginHistory).filter_by(name=user.id).delete()
+            session.query(self.UsersContacts).filter_by(user=user.id).delete()
+            session.query(
+                self.UsersContacts).filter_by(
+                contact=user.id).delete()
+            session.query(self.UsersHistory).filter_by(user=user.id).delete()
+            session.query(self.OfflineMessages).filter_by(recipient=user.id).delete()
+            session.query(self.RoomMembers).filter_by(user=user.id).delete()
+            session.query(self.Users).filter_by(name=name).delete()
+
+        self.writer.call(transaction)
+        self.users_cache.invalidate(name)
 
     def users_all(self):
         """
         Метод получения всех записей из таблицы пользователей (только логины и дата последнего входа)
         """
-        query = self.session.query(self.Users.name, self.Users.last_login)
-        return query.all()
+        with self.read_session() as session:
+            query = session.query(self.Users.name, self.Users.last_login)
+            return query.all()
 
     def users_active(self):
         """
         Метод получения всех записей из таблицы активных пользователей
         """
-        query = self.session.query(
-            self.Users.name,
-            self.ActiveUsers.ip_address,
-            self.ActiveUsers.port,
-            self.ActiveUsers.login_time
-        ).join(self.Users)
-        return query.all()
+        with self.read_session() as session:
+            query = session.query(
+                self.Users.name,
+                self.ActiveUsers.ip_address,
+                self.ActiveUsers.port,
+                self.ActiveUsers.login_time
+            ).join(self.Users)
+            return query.all()
 
     def login_history(self, username=None):
         """
         Метод получения всех записей или записей по конкретному пользователю
         из таблицы историзации входа пользователей
         """
-        query = self.session.query(
-            self.Users.name,
-            self.LoginHistory.date_time,
-            self.LoginHistory.ip_address,
-            self.LoginHistory.port
-        ).join(self.Users)
-        if username:
-            query = query.filter(self.Users.name == username)
-        return query.all()
+        with self.read_session() as session:
+            query = session.query(
+                self.Users.name,
+                self.LoginHistory.date_time,
+                self.LoginHistory.ip_address,
+                self.LoginHistory.port
+            ).join(self.Users)
+            if username:
+                query = query.filter(self.Users.name == username)
+            return query.all()
 
     def process_message(self, sender, receiver):
         """
-        Метод обновления количества полученных и отправленных сообщений в соотвествующих записях
+        Метод обновления количества полученных и отправленных сообщений в соотвествующих записях.
+        Приращения накапливаются в памяти и записываются в базу пакетно (см. MessageCounters).
         """
-        sender_id = self.session.query(self.Users).filter_by(name=sender).first().id
-        receiver_id = self.session.query(self.Users).filter_by(name=receiver).first().id
-        sender_obj = self.session.query(self.UsersHistory).filter_by(user=sender_id).first()
-        receiver_obj = self.session.query(self.UsersHistory).filter_by(user=receiver_id).first()
-        sender_obj.sent += 1
-        receiver_obj.accepted += 1
-        self.session.commit()
+        self.counters.add(sender, receiver)
 
     def add_contact(self, user, contact):
         """
-        Метод добавления контакта
+        Метод добавления контакта (повторное добавление игнорируется уникальным индексом)
         """
-        user = self.session.query(self.Users).filter_by(name=user).first()
-        contact = self.session.query(self.Users).filter_by(name=contact).first()
+        user = self.get_user_record(user)
+        contact = self.get_user_record(contact)
 
-        if contact and not self.session.query(self.UsersContacts).filter_by(user=user.id, contact=contact.id).all():
-            contact_row = self.UsersContacts(user=user.id, contact=contact.id)
-            self.session.add(contact_row)
-            self.session.commit()
+        def transaction(session):
+            session.execute(
+                self.insert_ignore(self.UsersContacts.__table__).values(user=user.id, contact=contact.id))
+
+        if contact:
+            self.writer.call(transaction)
 
     def remove_contact(self, user, contact):
         """
         Метод удаления контакта
         """
-        user = self.session.query(self.Users).filter_by(name=user).first()
-        contact = self.session.query(self.Users).filter_by(name=contact).first()
+        user = self.get_user_record(user)
+        contact = self.get_user_record(contact)
 
-        if contact:
-            self.session.query(self.UsersContacts).filter(
+        def transaction(session):
+            session.query(self.UsersContacts).filter(
                 self.UsersContacts.user == user.id,
                 self.UsersContacts.contact == contact.id
             ).delete()
-            self.session.commit()
+
+        if contact:
+            self.writer.call(transaction)
 
     def get_contacts(self, username):
         """
         Метод получения списка контактов пользователя
         """
-        user = self.session.query(self.Users).filter_by(name=username).first()
+        user = self.get_user_record(username)
 
-        query = self.session.query(
-            self.UsersContacts, self.Users.name
-        ).filter_by(user=user.id).join(
-            self.Users,
-            self.UsersContacts.contact == self.Users.id
-        )
-        return [contact[1] for contact in query.all()]
+        with self.read_session() as session:
+            query = session.query(
+                self.UsersContacts, self.Users.name
+            ).filter_by(user=user.id).join(
+                self.Users,
+                self.UsersContacts.contact == self.Users.id
+            )
+            return [contact[1] for contact in query.all()]
+
+    def join_room(self, username, room):
+        """
+        Метод добавления пользователя в комнату (повторное вступление игнорируется уникальным индексом).
+        Возвращает False, если пользователь не зарегистрирован.
+        """
+        user = self.get_user_record(username)
+        if not user:
+            return False
+
+        def transaction(session):
+            session.execute(
+                self.insert_ignore(self.RoomMembers.__table__).values(room=room, user=user.id))
+
+        self.writer.call(transaction)
+        return True
+
+    def leave_room(self, username, room):
+        """
+        Метод удаления пользователя из комнаты
+        """
+        user = self.get_user_record(username)
+        if not user:
+            return
+
+        def transaction(session):
+            session.query(self.RoomMembers).filter_by(room=room, user=user.id).delete()
+
+        self.writer.call(transaction)
+
+    def rooms_all(self):
+        """
+        Метод получения состава всех комнат
+        :return: словарь имя комнаты -> множество имён участников
+        """
+        rooms = dict()
+        with self.read_session() as session:
+            query = session.query(self.RoomMembers.room, self.Users.name).join(self.Users)
+            for room, name in query.all():
+                rooms.setdefault(room, set()).add(name)
+        return rooms
+
+    def room_members(self, room):
+        """
+        Метод получения состава комнаты
+        :return: множество имён участников
+        """
+        with self.read_session() as session:
+            query = session.query(self.Users.name).join(
+                self.RoomMembers, self.RoomMembers.user == self.Users.id).filter(self.RoomMembers.room == room)
+            return {name for name, in query.all()}
 
     def message_history(self):
         """
         Метод получения истории сообщений
         """
-        query = self.session.query(
-            self.Users.name,
-            self.Users.last_login,
-            self.UsersHistory.sent,
-            self.UsersHistory.accepted
-        ).join(self.Users)
-        return query.all()
+        self.counters.flush()
+        with self.read_session() as session:
+            query = session.query(
+                self.Users.name,
+                self.Users.last_login,
+                self.UsersHistory.sent,
+                self.UsersHistory.accepted
+            ).join(self.Users)
+            return query.all()
 
     def get_hash(self, name):
         """
         Метод получения хэша пароля пользователя.
         """
-        user = self.session.query(self.Users).filter_by(name=name).first()
+        user = self.get_user_record(name)
         return user.passwd_hash
 
     def get_pubkey(self, name):
         """
-        Метод получения публичного ключа пользователя.
+        Метод получения публичного ключа пользователя (None, если пользователь не найден).
+        Ключ читается из базы потоком записи, поэтому запрос видит ключ, записанный при входе
+        пользователя в этом процессе, даже если запись входа ещё стоит в очереди.
         """
-        user = self.session.query(self.Users).filter_by(name=name).first()
-        return user.pubkey
+        def transaction(session):
+            return session.query(self.Users.pubkey).filter_by(name=name).scalar()
+
+        return self.writer.call(transaction)
 
     def check_user(self, name):
         """
         Метод проверяющий существование пользователя.
         """
-        if self.session.query(self.Users).filter_by(name=name).count():
+        if self.get_user_record(name):
             return True
         else:
             return False
+
+    def store_offline_message(self, sender, receiver, message):
+        """
+        Метод сохранения сообщения для пользователя не в сети.
+        Возвращает False, если получатель не найден или его квота сообщений исчерпана.
+        Проверка квоты и запись выполняются в одной операции потока записи.
+        """
+        receiver = self.get_user_record(receiver)
+        if not receiver:
+            return False
+
+        def transaction(session):
+            if session.query(self.OfflineMessages).filter_by(recipient=receiver.id).count() >= self.offline_quota:
+                return False
+            session.add(self.OfflineMessages(
+                recipient=receiver.id,
+                sender=sender,
+                message=json.dumps(message, default=json_default),
+                created=datetime.datetime.now()
+            ))
+            return True
+
+        return self.writer.call(transaction)
+
+    def pop_offline_messages(self, username):
+        """
+        Метод получения и удаления всех сохранённых сообщений пользователя
+        (одним запросом на выборку и одним на удаление). Сообщения с истёкшим сроком хранения
+        удаляются без выдачи.
+        """
+        user = self.get_user_record(username)
+        if not user:
+            return []
+        expire_time = datetime.datetime.now() - self.offline_ttl
+
+        def transaction(session):
+            query = session.query(
+                self.OfflineMessages.message,
+                self.OfflineMessages.created
+            ).filter_by(recipient=user.id).order_by(self.OfflineMessages.id)
+            rows = query.all()
+            session.query(self.OfflineMessages).filter_by(recipient=user.id).delete()
+            return rows
+
+        return [json.loads(row.message) for row in self.writer.call(transaction) if row.created >= expire_time]
@@ -0,0 +1,295 @@
+"""
+Модуль классов работы сервера в несколько процессов (шардов): справочник присутствия пользователей
+и шина маршрутизации сообщений между шардами через локальные сокеты Unix
+"""
+
+
+import logging
+import os
+import queue
+import socket as socket_module
+import threading
+import time
+from socket import socket, SOCK_STREAM, SOL_SOCKET
+
+import common.variables as vrs
+import logs.server_log_config
+from common.custom_exceptions import IncorrectData
+from common.utils import encode_message, get_message, set_framing
+
+
+LOG = logging.getLogger('server')
+
+
+def sharding_supported():
+    """
+    Функция проверки, поддерживает ли платформа работу сервера в несколько процессов
+    (общий порт SO_REUSEPORT и локальные сокеты Unix для шины маршрутизации)
+    """
+    return hasattr(socket_module, 'SO_REUSEPORT') and hasattr(socket_module, 'AF_UNIX')
+
+
+def enable_reuse_port(sock):
+    """
+    Функция разрешения другим процессам слушать тот же порт (SO_REUSEPORT).
+    Вызывает OSError, если платформа не поддерживает SO_REUSEPORT.
+    """
+    option = getattr(socket_module, 'SO_REUSEPORT', None)
+    if option is None:
+        raise OSError('Платформа не поддерживает SO_REUSEPORT')
+    sock.setsockopt(SOL_SOCKET, option, 1)
+
+
+class PresenceDirectory:
+    """
+    Класс справочника присутствия: через какой канал связи и на каком шарде (сервере) подключён пользователь.
+    Пользователи, подключённые к своему процессу, хранятся в clients_names сервера,
+    справочник содержит пользователей других шардов и серверов и обновляется сообщениями каналов связи.
+    Маршрут пользователя - кортеж (канал связи, номер шарда или имя сервера).
+    """
+
+    def __init__(self):
+        """
+        Метод инициализации
+        """
+        self.remote = dict()
+
+    def __contains__(self, account_name):
+        return account_name in self.remote
+
+    def set_online(self, account_name, route):
+        """
+        Метод отметки пользователя как подключённого к другому шарду или серверу
+        """
+        self.remote[account_name] = route
+
+    def set_offline(self, account_name, route):
+        """
+        Метод отметки пользователя как отключившегося
+        (запись другого шарда, на который пользователь успел переподключиться, не удаляется)
+        """
+        if self.remote.get(account_name) == route:
+            del self.remote[account_name]
+
+    def reset(self, route, account_names):
+        """
+        Метод замены всех записей с данным маршрутом полным списком пользователей
+        """
+        for account_name in [name for name, current in self.remote.items() if current == route]:
+            del self.remote[account_name]
+        for account_name in account_names:
+            self.remote[account_name] = route
+
+    def route_of(self, account_name):
+        """
+        Метод получения маршрута пользователя (None, если пользователь не подключён к другим шардам и серверам)
+        """
+        return self.remote.get(account_name)
+
+
+class ShardLink:
+    """
+    Класс исходящего соединения с другим шардом: очередь сообщений и поток отправки.
+    Накопившиеся в очереди сообщения отправляются одной записью; пока шард недоступен,
+    подключение повторяется, а сообщения остаются в очереди.
+    """
+
+    def __init__(self, path):
+        """
+        Метод инициализации
+        :param path: путь к сокету Unix шарда-получателя
+        """
+        self.path = path
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, message):
+        """
+        Метод постановки сообщения в очередь отправки (может вызываться из любого потока)
+        """
+        self.queue.put(message)
+
+    def close(self):
+        """
+        Метод завершения потока отправки. Уже поставленные в очередь сообщения по возможности отправляются
+        (одной попыткой, без повторных подключений к недоступному шарду).
+        """
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join(vrs.SHUTDOWN_TIMEOUT)
+
+    def open_socket(self):
+        """
+        Метод подключения к шарду-получателю
+        """
+        sock = socket(socket_module.AF_UNIX, SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        set_framing(sock)
+        return sock
+
+    @staticmethod
+    def send_batch(sock, batch):
+        """
+        Метод отправки пачки сообщений одной записью. При ошибке записи из пачки удаляются сообщения,
+        полностью переданные сокету, поэтому после переподключения они не передаются повторно.
+        """
+        frames = [encode_message(message, True) for message in batch]
+        data = memoryview(b''.join(frames))
+        sent = 0
+        try:
+            while sent < len(data):
+                sent += sock.send(data[sent:])
+        except OSError:
+            done = 0
+            for frame in frames:
+                if sent < len(frame):
+                    break
+                sent -= len(frame)
+                done += 1
+            del batch[:done]
+            raise
+
+    def run(self):
+        """
+        Метод потока отправки
+        """
+        sock = None
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in batch
+            if stopping:
+                batch = batch[:batch.index(None)]
+            while batch:
+                try:
+                    if sock is None:
+                        sock = self.open_socket()
+                    self.send_batch(sock, batch)
+                    break
+                except OSError as err:
+                    LOG.debug(f'Шина маршрутизации: шард {self.path} недоступен: {err}')
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                    if self.closed:
+                        LOG.warning(f'Шина маршрутизации: при остановке не переданы шарду {self.path} '
+                                    f'сообщений: {len(batch)}')
+                        break
+                    time.sleep(vrs.BUS_RECONNECT_INTERVAL)
+            if stopping:
+                break
+        if sock is not None:
+            sock.close()
+
+
+class ShardBus:
+    """
+    Класс шины маршрутизации между шардами (канал связи сервера). Каждый шард принимает соединения
+    на своём сокете Unix и открывает по одному исходящему соединению к каждому другому шарду.
+    Сообщения передаются в кадровом режиме JIM; полученные сообщения передаются в поток сервера.
+    """
+
+    def __init__(self, shard, paths):
+        """
+        Метод инициализации
+        :param shard: номер своего шарда
+        :param paths: пути к сокетам Unix всех шардов (по номерам шардов)
+        """
+        self.shard = shard
+        self.paths = paths
+        self.server = None
+        self.links = {number: ShardLink(path) for number, path in enumerate(paths) if number != shard}
+        if os.path.exists(paths[shard]):
+            os.unlink(paths[shard])
+        self.listener = socket(socket_module.AF_UNIX, SOCK_STREAM)
+        self.listener.bind(paths[shard])
+        self.listener.listen(len(paths))
+
+    def start(self, server):
+        """
+        Метод запуска приёма сообщений от других шардов
+        """
+        self.server = server
+        threading.Thread(target=self.accept_links, daemon=True).start()
+
+    def accept_links(self):
+        """
+        Метод потока приёма соединений от других шардов
+        """
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.read_link, args=(sock,), daemon=True).start()
+
+    def read_link(self, sock):
+        """
+        Метод потока чтения сообщений из соединения с другим шардом
+        """
+        set_framing(sock)
+        with sock:
+            while True:
+                try:
+                    message = get_message(sock)
+                except (OSError, ValueError, IncorrectData) as err:
+                    LOG.debug(f'Шина маршрутизации: соединение закрыто: {err}')
+                    return
+                self.process_message(message)
+
+    def process_message(self, message):
+        """
+        Метод передачи полученного сообщения шины в поток сервера
+        """
+        if message.get(vrs.ACTION) == vrs.SHARD_PRESENCE:
+            self.server.call_soon(self.server.remote_presence, self, message[vrs.SHARD],
+                                  message[vrs.ACCOUNT_NAME], message[vrs.ONLINE])
+        elif message.get(vrs.ACTION) == vrs.SHARD_ROOM:
+            self.server.call_soon(self.server.remote_room, message[vrs.USER], message[vrs.ROOM], message[vrs.JOINED])
+        elif message.get(vrs.ACTION) == vrs.SHARD_ROUTE:
+            self.server.call_soon(self.server.deliver_routed, message[vrs.DATA])
+
+    def publish_presence(self, account_name, online):
+        """
+        Метод оповещения всех других шардов о подключении или отключении пользователя
+        """
+        for link in self.links.values():
+            link.send({
+                vrs.ACTION: vrs.SHARD_PRESENCE,
+                vrs.ACCOUNT_NAME: account_name,
+                vrs.ONLINE: online,
+                vrs.SHARD: self.shard,
+            })
+
+    def publish_room(self, account_name, room, joined):
+        """
+        Метод оповещения всех других шардов о вступлении пользователя в комнату или выходе из неё
+        """
+        for link in self.links.values():
+            link.send({vrs.ACTION: vrs.SHARD_ROOM, vrs.USER: account_name, vrs.ROOM: room, vrs.JOINED: joined})
+
+    def route(self, shard, message):
+        """
+        Метод пересылки сообщения пользователю другого шарда
+        """
+        self.links[shard].send({vrs.ACTION: vrs.SHARD_ROUTE, vrs.DATA: message})
+
+    def close(self):
+        """
+        Метод закрытия шины
+        """
+        self.listener.close()
+        for link in self.links.values():
+            link.close()
+        if os.path.exists(self.paths[self.shard]):
+            os.unlink(self.paths[self.shard])
@@ -0,0 +1,23 @@
+"""
+Модуль выбора реализации базы данных сервера
+"""
+
+
+from server.memory_storage_class import MemoryStorage
+from server.server_storage_class import ServerStorage
+
+
+STORAGE_BACKENDS = {
+    'sqlalchemy': ServerStorage,
+    'memory': MemoryStorage,
+}
+
+
+def create_storage(db_path, backend='sqlalchemy', **options):
+    """
+    Функция создания объекта базы данных сервера
+    :param db_path: путь к файлу базы SQLite (если не задан адрес базы database_url)
+    :param backend: название реализации базы данных (см. STORAGE_BACKENDS)
+    :param options: параметры выбранной реализации
+    """
+    return STORAGE_BACKENDS[backend](db_path, **options)
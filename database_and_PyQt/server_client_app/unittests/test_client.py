@@ -0,0 +1,122 @@
+import threading
+import unittest
+
+import common.variables as variables
+
+try:
+    from client.client_classes import Client
+except ImportError:
+    Client = None
+
+
+class FakeDatabase:
+    """
+    Класс базы клиента: хранит списки пользователей и контактов в памяти
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.contacts = []
+
+    def add_users(self, users):
+        self.users = set(users)
+
+    def update_users(self, added, removed):
+        self.users.update(added)
+        self.users.difference_update(removed)
+
+    def contacts_clear(self):
+        self.contacts = []
+
+    def add_contact(self, contact):
+        self.contacts.append(contact)
+
+
+@unittest.skipIf(Client is None, 'Не установлен PyQt5')
+class TestCaseClientLists(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся объект клиента без подключения к серверу,
+        отдельные запросы списков к серверу записываются в список calls
+        """
+        self.client = Client.__new__(Client)
+        self.client.client_name = 'alice'
+        self.client.database = FakeDatabase()
+        self.client.database_locker = threading.Lock()
+        self.client.users_version = None
+        self.calls = []
+        self.client.user_list_update = lambda wait=True: self.calls.append(('users', wait))
+        self.client.contact_list_update = lambda wait=True: self.calls.append(('contacts', wait))
+        self.client.lists_update = lambda wait=True: self.calls.append(('lists', wait))
+
+    def test_batch_lists(self):
+        """
+        Тест применения ответа на пакет запросов списков пользователей и контактов
+        """
+        self.client.process_lists({variables.RESPONSE: 200, variables.LIST_INFO: [
+            {variables.RESPONSE: 202, variables.LIST_INFO: ['alice', 'bob'], variables.USERS_VERSION: 3},
+            {variables.RESPONSE: 202, variables.LIST_INFO: ['bob']},
+        ]}, True)
+        self.assertEqual(self.client.database.users, {'alice', 'bob'})
+        self.assertEqual(self.client.database.contacts, ['bob'])
+        self.assertEqual(self.client.users_version, 3)
+        self.assertEqual(self.calls, [])
+
+    def test_batch_not_supported(self):
+        """
+        Тест запроса списков по отдельности, если сервер не поддерживает пакеты запросов (ответ 400)
+        """
+        self.client.process_lists({variables.RESPONSE: 400, variables.ERROR: 'Запрос некорректен.'}, True)
+        self.assertEqual(self.calls, [('users', True), ('contacts', True)])
+
+    def users_changed(self, version, added=(), removed=()):
+        """
+        Метод передачи клиенту сообщения 205 с изменениями списка пользователей
+        """
+        self.client.users_changed({variables.RESPONSE: 205, variables.USERS_VERSION: version,
+                                   variables.USERS_ADDED: list(added), variables.USERS_REMOVED: list(removed)})
+
+    def test_next_version(self):
+        """
+        Тест применения изменений следующей версии списка пользователей без запроса к серверу
+        """
+        self.client.database.add_users(['alice', 'bob'])
+        self.client.users_version = 3
+        self.users_changed(4, added=['carol'], removed=['bob'])
+        self.assertEqual(self.client.database.users, {'alice', 'carol'})
+        self.assertEqual(self.client.users_version, 4)
+        self.assertEqual(self.calls, [])
+
+    def test_old_version(self):
+        """
+        Тест пропуска уже учтённой версии списка пользователей
+        """
+        self.client.database.add_users(['alice'])
+        self.client.users_version = 3
+        self.users_changed(3, added=['bob'])
+        self.assertEqual(self.client.database.users, {'alice'})
+        self.assertEqual(self.client.users_version, 3)
+        self.assertEqual(self.calls, [])
+
+    def test_version_gap(self):
+        """
+        Тест полного запроса списков, если клиент пропустил версию списка пользователей
+        """
+        self.client.database.add_users(['alice'])
+        self.client.users_version = 3
+        self.users_changed(5, added=['bob'])
+        self.assertEqual(self.client.database.users, {'alice'})
+        self.assertEqual(self.calls, [('lists', False)])
+
+    def test_without_version(self):
+        """
+        Тест полного запроса списков по сообщению 205 без версии (сервер не передал изменения)
+        """
+        self.client.users_version = 3
+        self.client.users_changed({variables.RESPONSE: 205})
+        self.assertEqual(self.calls, [('lists', False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
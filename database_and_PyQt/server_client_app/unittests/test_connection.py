@@ -0,0 +1,68 @@
+import unittest
+from socket import socketpair, SOL_SOCKET, SO_SNDBUF, SO_RCVBUF
+
+import common.variables as variables
+from common.utils import MessageBuffer
+from server.connection_class import ClientConnection
+
+
+class TestCaseConnectionFlush(unittest.TestCase):
+
+    MESSAGES = [{variables.MESSAGE_TEXT: str(number) * 50000} for number in range(10)]
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся пара сокетов с маленькими буферами
+        """
+        self.server_sock, self.client_sock = socketpair()
+        self.server_sock.setsockopt(SOL_SOCKET, SO_SNDBUF, 4096)
+        self.client_sock.setsockopt(SOL_SOCKET, SO_RCVBUF, 4096)
+        self.server_sock.setblocking(False)
+        self.client_sock.settimeout(5)
+        self.connection = ClientConnection(self.server_sock)
+
+    def tearDown(self):
+        """
+        После теста сокеты закрываются
+        """
+        self.connection.close()
+        self.client_sock.close()
+
+    def transfer(self):
+        """
+        Метод отправки очереди частями: после каждой частичной отправки принимается порция данных
+        :return: список принятых сообщений
+        """
+        self.connection.send_many(self.MESSAGES)
+        buffer = MessageBuffer()
+        received = []
+        partial = False
+        while self.connection.flush():
+            partial = partial or isinstance(self.connection.outbound[0], memoryview)
+            self.assertTrue(0 < self.connection.pending_bytes <= sum(map(len, self.connection.outbound)))
+            buffer.feed(self.client_sock.recv(variables.MAX_PACKAGE_LENGTH))
+            received.extend(iter(buffer.next_message, None))
+        self.assertTrue(partial)
+        self.assertEqual(self.connection.pending_bytes, 0)
+        while len(received) < len(self.MESSAGES):
+            buffer.feed(self.client_sock.recv(variables.MAX_PACKAGE_LENGTH))
+            received.extend(iter(buffer.next_message, None))
+        return received
+
+    def test_partial_write(self):
+        """
+        Тест отправки через sendmsg с сохранением неотправленного остатка в начале очереди
+        """
+        self.assertTrue(self.connection.vectored)
+        self.assertEqual(self.transfer(), self.MESSAGES)
+
+    def test_partial_write_without_sendmsg(self):
+        """
+        Тест отправки по одному буферу через send (на платформах без sendmsg)
+        """
+        self.connection.vectored = False
+        self.assertEqual(self.transfer(), self.MESSAGES)
+
+
+if __name__ == '__main__':
+    unittest.main()
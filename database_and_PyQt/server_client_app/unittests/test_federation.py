@@ -0,0 +1,136 @@
+import threading
+import time
+import unittest
+from socket import create_connection
+
+import common.variables as variables
+from common.utils import get_message, send_message, set_framing
+from server.federation_class import Federation, make_challenge, sign_challenge, SIGN_REPLY
+
+
+class FakeServer:
+    """
+    Класс тестового сервера: вызовы из потоков федерации выполняются сразу и сохраняются
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def call_soon(self, func, *args):
+        func(*args)
+
+    def remote_snapshot(self, link, node, account_names):
+        self.calls.append(('snapshot', node, list(account_names)))
+        self.event.set()
+
+    def remote_presence(self, link, node, account_name, online):
+        self.calls.append(('presence', node, account_name, online))
+        self.event.set()
+
+    def deliver_routed(self, message):
+        self.calls.append(('route', message))
+        self.event.set()
+
+
+class TestCaseFederationHandshake(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся узел B, ожидающий подключения узла A
+        """
+        self.nodes = []
+        self.server_b = FakeServer()
+        self.node_b = self.create_node('B', {'A': ('127.0.0.1', 1)}, 'secret')
+        self.node_b.start(self.server_b)
+
+    def tearDown(self):
+        """
+        После теста все узлы закрываются
+        """
+        for node in self.nodes:
+            node.close()
+
+    def create_node(self, name, peers, secret):
+        """
+        Метод создания узла федерации на свободном порту
+        """
+        node = Federation(name, '127.0.0.1', 0, peers, secret)
+        self.nodes.append(node)
+        return node
+
+    def port_b(self):
+        return self.node_b.transport.getsockname()[1]
+
+    def connect_as_a(self, challenge):
+        """
+        Метод подключения к узлу B от имени узла A, возвращает сокет и ответ узла B
+        """
+        sock = create_connection(('127.0.0.1', self.port_b()), timeout=5)
+        set_framing(sock)
+        send_message(sock, {
+            variables.ACTION: variables.FEDERATION_HELLO,
+            variables.NODE: 'A',
+            variables.EPOCH: 'epoch',
+            variables.DATA: challenge,
+        })
+        return sock, get_message(sock)
+
+    def test_handshake(self):
+        """
+        Тест взаимной проверки узлов с общим секретом и передачи сообщения
+        """
+        node_a = self.create_node('A', {'B': ('127.0.0.1', self.port_b())}, 'secret')
+        node_a.start(FakeServer())
+        node_a.route('B', {'n': 1})
+        deadline = time.monotonic() + 5
+        while ('route', {'n': 1}) not in self.server_b.calls and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIn(('route', {'n': 1}), self.server_b.calls)
+
+    def test_wrong_secret(self):
+        """
+        Тест отказа узлу с другим секретом
+        """
+        node_a = self.create_node('A', {'B': ('127.0.0.1', self.port_b())}, 'wrong')
+        node_a.start(FakeServer())
+        node_a.route('B', {'n': 1})
+        self.assertFalse(self.server_b.event.wait(1))
+
+    def test_reflection(self):
+        """
+        Тест отказа при пересылке узлу его же ответа на вызов, полученного по второму соединению
+        """
+        first, answer = self.connect_as_a(make_challenge())
+        self.assertEqual(answer[variables.RESPONSE], 511)
+        second, reflected = self.connect_as_a(answer[variables.DATA])
+        send_message(first, {variables.RESPONSE: 511, variables.DIGEST: reflected[variables.DIGEST]})
+        self.assertEqual(get_message(first)[variables.RESPONSE], 400)
+        for sock in (first, second):
+            sock.close()
+        self.assertEqual(self.server_b.calls, [])
+
+    def test_malformed_message(self):
+        """
+        Тест закрытия соединения узла, приславшего после проверки сообщение без нужных ключей
+        """
+        sock, answer = self.connect_as_a(make_challenge())
+        send_message(sock, {
+            variables.RESPONSE: 511,
+            variables.DIGEST: sign_challenge(b'secret', SIGN_REPLY, 'A', 'B', answer[variables.DATA])})
+        self.assertEqual(get_message(sock)[variables.RESPONSE], 200)
+        send_message(sock, {variables.ACTION: variables.FEDERATION_PRESENCE, variables.SEQUENCE: 1})
+        self.assertEqual(sock.recv(variables.MAX_PACKAGE_LENGTH), b'')
+        sock.close()
+        self.assertTrue(self.server_b.event.wait(5))
+        self.assertEqual(self.server_b.calls, [('snapshot', 'A', [])])
+
+    def test_empty_secret(self):
+        """
+        Тест отказа в создании узла без общего секрета
+        """
+        self.assertRaises(ValueError, Federation, 'C', '127.0.0.1', 0, {}, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,588 @@
+import binascii
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import common.variables as variables
+from common.crypto import InlineExecutor, hash_password, challenge_digest
+from common.utils import MessageBuffer, encode_message
+from server.memory_storage_class import MemoryStorage
+from server.server_class import NewConnection
+from common import wire_codecs
+from server.server_core import ServerCore
+
+
+class FakeConnection:
+    """
+    Класс тестового соединения: хранит состояние, которое меняют методы сервера
+    """
+
+    def __init__(self, number):
+        self.auth_state = variables.AUTH_PENDING
+        self.paused = False
+        self.closed = False
+        self.is_congested = False
+        self.waiting_senders = set()
+        self.broken = False
+        self.buffer = MessageBuffer()
+        self.peername = ('127.0.0.1', 50000 + number)
+
+    def getpeername(self):
+        return self.peername
+
+
+class DeferredExecutor:
+    """
+    Класс исполнителя, задачи которого выполняются только при вызове run_pending
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, func, *args):
+        future = Future()
+        self.pending.append((future, func, args))
+        return future
+
+    def run_pending(self):
+        while self.pending:
+            future, func, args = self.pending.pop(0)
+            future.set_result(func(*args))
+
+
+class FakeServer(ServerCore):
+    """
+    Класс тестового сервера: отправленные сообщения сохраняются в списке соединения,
+    переданные в поток сервера вызовы выполняются сразу
+    """
+
+    def __init__(self):
+        ServerCore.__init__(self, MemoryStorage(), NewConnection(), InlineExecutor())
+        self.sent = dict()
+        self.codecs = dict()
+
+    def call_soon(self, func, *args):
+        func(*args)
+
+    def send_to_client(self, client, message):
+        if client.broken:
+            raise ConnectionResetError
+        self.sent.setdefault(client, []).append(dict(message))
+
+    def send_burst(self, client, messages):
+        for message in messages:
+            self.send_to_client(client, message)
+
+    def enable_framing(self, client, codec=None):
+        self.codecs[client] = codec
+
+    def pause_reading(self, client):
+        client.paused = True
+
+    def resume_reading(self, client):
+        client.paused = False
+
+    def disconnect_client(self, client):
+        self.handshakes.pop(client, None)
+        client.closed = True
+
+    def remove_client(self, client):
+        self.unregister_client(client)
+        self.disconnect_client(client)
+
+
+class TestCaseAuthStateMachine(unittest.TestCase):
+
+    USER = 'Guest'
+    PASSWORD = 'password'
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся сервер с одним зарегистрированным пользователем
+        """
+        self.server = FakeServer()
+        self.passwd_hash = hash_password(self.USER, self.PASSWORD)
+        self.server.database.add_user(self.USER, self.passwd_hash)
+        self.client = FakeConnection(1)
+
+    def presence(self):
+        """
+        Метод отправки серверу сообщения presence, возвращает вызов сервера
+        """
+        self.assertTrue(self.server.open_handshake(self.client))
+        self.server.process_client_message({
+            variables.ACTION: variables.PRESENCE,
+            variables.TIME: 1.1,
+            variables.PORT: variables.DEFAULT_PORT,
+            variables.USER: {variables.ACCOUNT_NAME: self.USER, variables.PUBLIC_KEY: 'KEY'}
+        }, self.client)
+        self.assertEqual(self.client.auth_state, variables.AUTH_CHALLENGED)
+        challenge = self.server.sent[self.client][-1]
+        self.assertEqual(challenge[variables.RESPONSE], 511)
+        return challenge[variables.DATA].encode('ascii')
+
+    def answer(self, digest):
+        """
+        Метод отправки серверу ответа на вызов
+        """
+        self.server.process_client_message({
+            variables.RESPONSE: 511,
+            variables.DATA: binascii.b2a_base64(digest).decode('ascii')
+        }, self.client)
+
+    def test_pipelined_request(self):
+        """
+        Тест запроса, принятого вместе с ответом на вызов: обрабатывается после завершения проверки ответа
+        """
+        self.server.crypto = DeferredExecutor()
+        challenge = self.presence()
+        self.client.buffer.feed(encode_message({
+            variables.RESPONSE: 511,
+            variables.DATA: binascii.b2a_base64(challenge_digest(self.passwd_hash, challenge)).decode('ascii')
+        }) + encode_message({
+            variables.ACTION: variables.USERS_REQUEST,
+            variables.TIME: 1.1,
+            variables.ACCOUNT_NAME: self.USER
+        }))
+        self.server.process_buffered(self.client)
+        self.assertEqual(self.client.auth_state, variables.AUTH_VERIFYING)
+        self.assertTrue(self.client.paused)
+        self.assertEqual(len(self.server.sent[self.client]), 1)
+        self.server.crypto.run_pending()
+        self.assertEqual(self.client.auth_state, variables.AUTH_DONE)
+        self.assertFalse(self.client.closed)
+        answers = self.server.sent[self.client][1:]
+        self.assertEqual(answers[0], {variables.RESPONSE: 200})
+        self.assertEqual(answers[1][variables.RESPONSE], 202)
+        self.assertEqual(answers[1][variables.LIST_INFO], [self.USER])
+
+    def test_correct_answer(self):
+        """
+        Тест успешной авторизации: PENDING -> CHALLENGED -> VERIFYING -> DONE
+        """
+        challenge = self.presence()
+        self.answer(challenge_digest(self.passwd_hash, challenge))
+        self.assertEqual(self.client.auth_state, variables.AUTH_DONE)
+        self.assertEqual(self.server.sent[self.client][-1], {variables.RESPONSE: 200})
+        self.assertIs(self.server.clients_names[self.USER], self.client)
+        self.assertFalse(self.client.paused)
+        self.assertEqual(self.server.handshakes, {})
+
+    def test_wrong_digest(self):
+        """
+        Тест отказа в авторизации при неверном ответе на вызов
+        """
+        challenge = self.presence()
+        self.answer(challenge_digest(hash_password(self.USER, 'wrong'), challenge))
+        self.assertEqual(self.server.sent[self.client][-1][variables.RESPONSE], 400)
+        self.assertTrue(self.client.closed)
+        self.assertNotIn(self.USER, self.server.clients_names)
+        self.assertEqual(self.server.handshakes, {})
+
+    def test_malformed_answer(self):
+        """
+        Тест отказа в авторизации при ответе без данных
+        """
+        self.presence()
+        self.server.process_client_message({variables.RESPONSE: 511}, self.client)
+        self.assertEqual(self.server.sent[self.client][-1][variables.RESPONSE], 400)
+        self.assertTrue(self.client.closed)
+
+    def test_unknown_user(self):
+        """
+        Тест отказа в авторизации незарегистрированному пользователю
+        """
+        self.server.open_handshake(self.client)
+        self.server.process_client_message({
+            variables.ACTION: variables.PRESENCE,
+            variables.TIME: 1.1,
+            variables.PORT: variables.DEFAULT_PORT,
+            variables.USER: {variables.ACCOUNT_NAME: 'Unknown'}
+        }, self.client)
+        self.assertEqual(self.server.sent[self.client][-1][variables.RESPONSE], 400)
+        self.assertTrue(self.client.closed)
+
+    def test_request_before_auth(self):
+        """
+        Тест отказа в обработке запроса до авторизации
+        """
+        self.server.open_handshake(self.client)
+        self.server.process_client_message({
+            variables.ACTION: variables.USERS_REQUEST,
+            variables.TIME: 1.1,
+            variables.ACCOUNT_NAME: self.USER
+        }, self.client)
+        self.assertEqual(self.server.sent[self.client][-1][variables.RESPONSE], 400)
+        self.assertTrue(self.client.closed)
+
+    def test_expiry(self):
+        """
+        Тест закрытия соединения, не авторизовавшегося за отведённое время
+        """
+        self.server.handshake_timeout = 0
+        self.presence()
+        self.assertEqual(self.server.expire_handshakes(), None)
+        self.assertEqual(self.server.sent[self.client][-1][variables.RESPONSE], 400)
+        self.assertTrue(self.client.closed)
+
+    def test_expiry_delay(self):
+        """
+        Тест расчёта времени до ближайшего срока авторизации
+        """
+        self.server.handshake_timeout = 100
+        self.server.open_handshake(self.client)
+        delay = self.server.expire_handshakes()
+        self.assertTrue(0 < delay <= 100)
+        self.assertFalse(self.client.closed)
+
+    def test_pending_cap(self):
+        """
+        Тест ограничения количества одновременно авторизующихся соединений
+        """
+        self.server.max_pending_handshakes = 2
+        self.assertTrue(self.server.open_handshake(FakeConnection(2)))
+        self.assertTrue(self.server.open_handshake(FakeConnection(3)))
+        self.assertFalse(self.server.open_handshake(self.client))
+        self.assertEqual(len(self.server.handshakes), 2)
+
+
+class FakeLink:
+    """
+    Класс тестового канала связи: сохраняет оповещения и пересланные сообщения
+    """
+
+    def __init__(self):
+        self.rooms = []
+        self.routed = []
+
+    def start(self, server):
+        pass
+
+    def publish_presence(self, account_name, online):
+        pass
+
+    def publish_room(self, account_name, room, joined):
+        self.rooms.append((account_name, room, joined))
+
+    def route(self, location, message):
+        self.routed.append((location, message))
+
+
+class TestCaseRooms(unittest.TestCase):
+
+    ROOM = '#room'
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся сервер с каналом связи и пользователями, подключёнными к разным шардам
+        """
+        self.server = FakeServer()
+        self.link = FakeLink()
+        self.server.attach_link(self.link)
+        self.clients = dict()
+        for name in ('alice', 'bob', 'carol', 'dave', 'eve'):
+            self.server.database.add_user(name, b'hash')
+        for number, name in enumerate(('alice', 'bob', 'carol')):
+            self.clients[name] = FakeConnection(number)
+            self.clients[name].auth_state = variables.AUTH_DONE
+            self.server.clients_names[name] = self.clients[name]
+        self.server.remote_presence(self.link, 1, 'dave', True)
+
+    def send_to_room(self, sender):
+        """
+        Метод отправки сообщения в комнату от имени подключённого пользователя
+        """
+        message = {
+            variables.ACTION: variables.MESSAGE,
+            variables.SENDER: sender,
+            variables.DESTINATION: self.ROOM,
+            variables.TIME: 1.1,
+            variables.MESSAGE_TEXT: 'text'
+        }
+        self.server.process_client_message(message, self.clients[sender])
+        return message
+
+    def test_join_published(self):
+        """
+        Тест оповещения других шардов о вступлении в комнату и выходе из неё
+        """
+        self.server.join_room('alice', self.ROOM)
+        self.server.leave_room('alice', self.ROOM)
+        self.assertEqual(self.link.rooms, [('alice', self.ROOM, True), ('alice', self.ROOM, False)])
+        self.assertNotIn(self.ROOM, self.server.rooms)
+
+    def test_remote_members(self):
+        """
+        Тест рассылки подключённым, удалённым (одна копия на шард) и не подключённым участникам,
+        вступившим в комнату на других шардах
+        """
+        self.server.join_room('alice', self.ROOM)
+        self.server.join_room('bob', self.ROOM)
+        self.server.remote_room('dave', self.ROOM, True)
+        self.server.remote_room('eve', self.ROOM, True)
+        message = self.send_to_room('alice')
+        self.assertEqual(self.server.sent[self.clients['bob']], [message])
+        self.assertEqual(len(self.link.routed), 1)
+        location, routed = self.link.routed[0]
+        self.assertEqual(location, 1)
+        self.assertEqual(routed[variables.RECIPIENTS], ['dave'])
+        self.assertEqual(self.server.database.pop_offline_messages('eve'), [message])
+        self.assertNotIn(self.clients['alice'], self.server.sent)
+
+    def test_deliver_routed_room_message(self):
+        """
+        Тест доставки пересланного сообщения комнаты перечисленным получателям
+        """
+        message = {variables.SENDER: 'dave', variables.DESTINATION: self.ROOM, variables.MESSAGE_TEXT: 'text'}
+        routed = dict(message)
+        routed[variables.RECIPIENTS] = ['bob', 'eve']
+        self.server.deliver_routed(routed)
+        self.assertEqual(self.server.sent[self.clients['bob']], [message])
+        self.assertEqual(self.server.database.pop_offline_messages('eve'), [message])
+
+    def test_members_loaded_on_miss(self):
+        """
+        Тест дополнения состава комнаты из базы, если вступление отправителя произошло на другом шарде
+        """
+        self.server.database.join_room('carol', self.ROOM)
+        self.server.database.join_room('bob', self.ROOM)
+        message = self.send_to_room('carol')
+        self.assertEqual(self.server.sent[self.clients['bob']], [message])
+
+    def test_failed_broadcast_stored(self):
+        """
+        Тест сохранения сообщения для участника, отправка которому не удалась
+        """
+        self.server.join_room('alice', self.ROOM)
+        self.server.join_room('bob', self.ROOM)
+        self.clients['bob'].broken = True
+        message = self.send_to_room('alice')
+        self.assertTrue(self.clients['bob'].closed)
+        self.assertEqual(self.server.database.pop_offline_messages('bob'), [message])
+
+
+class TestCaseBatch(unittest.TestCase):
+
+    USER = 'alice'
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся сервер с авторизованным клиентом
+        """
+        self.server = FakeServer()
+        for name in (self.USER, 'bob'):
+            self.server.database.add_user(name, b'hash')
+        self.client = FakeConnection(1)
+        self.client.auth_state = variables.AUTH_DONE
+        self.server.clients_names[self.USER] = self.client
+
+    def send_batch(self, requests, request_id=None):
+        """
+        Метод отправки серверу пакета запросов, возвращает ответ сервера
+        """
+        message = {variables.ACTION: variables.BATCH, variables.TIME: 1.1, variables.REQUESTS: requests}
+        if request_id is not None:
+            message[variables.REQUEST_ID] = request_id
+        self.server.process_client_message(message, self.client)
+        return self.server.sent[self.client][-1]
+
+    def test_mixed_batch(self):
+        """
+        Тест пакета из разных запросов: ответы в порядке запросов, с идентификаторами запросов
+        """
+        answer = self.send_batch([
+            {variables.ACTION: variables.ADD_CONTACT, variables.TIME: 1.1, variables.USER: self.USER,
+             variables.ACCOUNT_NAME: 'bob', variables.REQUEST_ID: 1},
+            {variables.ACTION: variables.USERS_REQUEST, variables.TIME: 1.1, variables.ACCOUNT_NAME: self.USER},
+            {variables.ACTION: variables.GET_CONTACTS, variables.TIME: 1.1, variables.USER: self.USER,
+             variables.REQUEST_ID: 3},
+        ], request_id=7)
+        self.assertEqual(answer[variables.RESPONSE], 200)
+        self.assertEqual(answer[variables.REQUEST_ID], 7)
+        self.assertEqual(answer[variables.LIST_INFO], [
+            {variables.RESPONSE: 200, variables.REQUEST_ID: 1},
+            {variables.RESPONSE: 202, variables.LIST_INFO: [self.USER, 'bob'],
+             variables.USERS_VERSION: self.server.users_version},
+            {variables.RESPONSE: 202, variables.LIST_INFO: ['bob'], variables.REQUEST_ID: 3},
+        ])
+        self.assertEqual(len(self.server.sent[self.client]), 1)
+
+    def test_invalid_request(self):
+        """
+        Тест пакета с некорректными запросами: на них отвечается 400, остальные запросы выполняются
+        """
+        answer = self.send_batch([
+            {variables.ACTION: 'unknown', variables.REQUEST_ID: 1},
+            'not a request',
+            {variables.ACTION: variables.GET_CONTACTS, variables.TIME: 1.1, variables.USER: 'bob'},
+            {variables.ACTION: variables.GET_CONTACTS, variables.TIME: 1.1, variables.USER: self.USER},
+        ])
+        self.assertEqual(answer[variables.RESPONSE], 200)
+        responses = answer[variables.LIST_INFO]
+        self.assertEqual([response[variables.RESPONSE] for response in responses], [400, 400, 400, 202])
+        self.assertEqual(responses[0][variables.REQUEST_ID], 1)
+        self.assertFalse(self.client.closed)
+
+    def test_too_many_requests(self):
+        """
+        Тест отказа в выполнении пакета больше допустимого размера
+        """
+        request = {variables.ACTION: variables.GET_CONTACTS, variables.TIME: 1.1, variables.USER: self.USER}
+        answer = self.send_batch([request] * (variables.BATCH_MAX_REQUESTS + 1))
+        self.assertEqual(answer[variables.RESPONSE], 400)
+        self.assertNotIn(variables.LIST_INFO, answer)
+
+
+class TestCaseUsersVersion(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся сервер с авторизованным клиентом
+        """
+        self.server = FakeServer()
+        self.server.database.add_user('alice', b'hash')
+        self.client = FakeConnection(1)
+        self.client.auth_state = variables.AUTH_DONE
+        self.server.clients_names['alice'] = self.client
+
+    def users_request(self):
+        """
+        Метод запроса списка пользователей, возвращает ответ сервера
+        """
+        self.server.process_client_message({variables.ACTION: variables.USERS_REQUEST, variables.TIME: 1.1,
+                                            variables.ACCOUNT_NAME: 'alice'}, self.client)
+        return self.server.sent[self.client][-1]
+
+    def test_delta(self):
+        """
+        Тест сообщения 205 с изменениями списка: версия увеличивается, ответ на запрос списка содержит ту же версию
+        """
+        version = self.users_request()[variables.USERS_VERSION]
+        self.server.service_update_lists(added=['bob'])
+        message = self.server.sent[self.client][-1]
+        self.assertEqual(message[variables.RESPONSE], 205)
+        self.assertEqual(message[variables.USERS_VERSION], version + 1)
+        self.assertEqual(message[variables.USERS_ADDED], ['bob'])
+        self.assertEqual(message[variables.USERS_REMOVED], [])
+        self.server.service_update_lists(removed=['bob'])
+        message = self.server.sent[self.client][-1]
+        self.assertEqual(message[variables.USERS_VERSION], version + 2)
+        self.assertEqual(message[variables.USERS_REMOVED], ['bob'])
+        self.assertEqual(self.users_request()[variables.USERS_VERSION], version + 2)
+
+    def test_without_delta(self):
+        """
+        Тест сообщения 205 без изменений списка: версия увеличивается, сообщение её не содержит
+        """
+        version = self.server.users_version
+        self.server.service_update_lists()
+        message = self.server.sent[self.client][-1]
+        self.assertEqual(message, {variables.RESPONSE: 205})
+        self.assertEqual(self.server.users_version, version + 1)
+
+
+class TestCaseCodecNegotiation(unittest.TestCase):
+
+    USER = 'Guest'
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся сервер с одним зарегистрированным пользователем
+        """
+        self.server = FakeServer()
+        self.server.database.add_user(self.USER, hash_password(self.USER, 'password'))
+        self.client = FakeConnection(1)
+
+    def presence(self, **options):
+        """
+        Метод отправки серверу сообщения presence с дополнительными полями, возвращает вызов сервера
+        """
+        self.assertTrue(self.server.open_handshake(self.client))
+        message = {
+            variables.ACTION: variables.PRESENCE,
+            variables.TIME: 1.1,
+            variables.PORT: variables.DEFAULT_PORT,
+            variables.USER: {variables.ACCOUNT_NAME: self.USER, variables.PUBLIC_KEY: 'KEY'}
+        }
+        message.update(options)
+        self.server.process_client_message(message, self.client)
+        return self.server.sent[self.client][-1]
+
+    @unittest.skipIf(variables.CODEC_MSGPACK not in wire_codecs.CODECS, 'Не установлен msgpack')
+    def test_msgpack(self):
+        """
+        Тест выбора кодека MessagePack, если клиент его предлагает
+        """
+        challenge = self.presence(**{variables.FRAMING: variables.FRAMING_LENGTH_PREFIX,
+                                     variables.CODECS: [variables.CODEC_MSGPACK, variables.CODEC_JSON]})
+        self.assertEqual(challenge[variables.CODEC], variables.CODEC_MSGPACK)
+        self.assertEqual(self.server.codecs[self.client].name, variables.CODEC_MSGPACK)
+
+    def test_json_offered(self):
+        """
+        Тест выбора JSON, если клиент не предлагает MessagePack
+        """
+        challenge = self.presence(**{variables.FRAMING: variables.FRAMING_LENGTH_PREFIX,
+                                     variables.CODECS: [variables.CODEC_JSON]})
+        self.assertEqual(challenge[variables.CODEC], variables.CODEC_JSON)
+        self.assertIs(self.server.codecs[self.client], wire_codecs.JSON)
+
+    def test_msgpack_not_installed(self):
+        """
+        Тест выбора JSON, если на сервере не установлен msgpack
+        """
+        with mock.patch.dict(wire_codecs.CODECS):
+            wire_codecs.CODECS.pop(variables.CODEC_MSGPACK, None)
+            challenge = self.presence(**{variables.FRAMING: variables.FRAMING_LENGTH_PREFIX,
+                                         variables.CODECS: [variables.CODEC_MSGPACK, variables.CODEC_JSON]})
+        self.assertEqual(challenge[variables.CODEC], variables.CODEC_JSON)
+        self.assertIs(self.server.codecs[self.client], wire_codecs.JSON)
+
+    def test_codecs_not_offered(self):
+        """
+        Тест кадрового режима без списка кодеков (клиент предыдущей версии): используется JSON
+        """
+        challenge = self.presence(**{variables.FRAMING: variables.FRAMING_LENGTH_PREFIX})
+        self.assertNotIn(variables.CODEC, challenge)
+        self.assertIs(self.server.codecs[self.client], wire_codecs.JSON)
+
+    def test_legacy(self):
+        """
+        Тест старого режима без кадров: кодек не согласуется, кадровый режим не включается
+        """
+        challenge = self.presence()
+        self.assertNotIn(variables.FRAMING, challenge)
+        self.assertNotIn(self.client, self.server.codecs)
+
+
+class TestCaseRunCall(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся сервер с одним подключённым клиентом
+        """
+        self.server = FakeServer()
+        self.client = FakeConnection(1)
+        self.server.open_handshake(self.client)
+
+    def test_failed_call_removes_client(self):
+        """
+        Тест закрытия соединения, переданного вызову, завершившемуся ошибкой
+        """
+        def failing_call(client):
+            raise ValueError('Пользователь не зарегистрирован.')
+
+        self.server.run_call(failing_call, (self.client,))
+        self.assertTrue(self.client.closed)
+        self.assertEqual(self.server.handshakes, {})
+
+    def test_failed_call_without_client(self):
+        """
+        Тест вызова с ошибкой, не связанного с соединением: ошибка не передаётся дальше
+        """
+        self.server.run_call(self.server.deliver_routed, ({variables.SENDER: 'x'},))
+        self.assertFalse(self.client.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
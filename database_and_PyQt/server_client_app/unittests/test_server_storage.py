@@ -0,0 +1,249 @@
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import inspect, select
+
+from server.server_storage_class import ServerStorage, MessageCounters
+
+# Схема базы сервера до появления версий схемы (таблицы, созданные первой версией сервера)
+BASELINE_SCHEMA = '''
+CREATE TABLE users (id INTEGER NOT NULL, name VARCHAR, last_login DATETIME, passwd_hash VARCHAR, pubkey TEXT,
+    PRIMARY KEY (id), UNIQUE (name));
+CREATE TABLE active_users (id INTEGER NOT NULL, user INTEGER, ip_address VARCHAR, port INTEGER, login_time DATETIME,
+    PRIMARY KEY (id), UNIQUE (user), FOREIGN KEY(user) REFERENCES users (id));
+CREATE TABLE login_history (id INTEGER NOT NULL, name INTEGER, ip_address VARCHAR, port INTEGER, date_time DATETIME,
+    PRIMARY KEY (id), FOREIGN KEY(name) REFERENCES users (id));
+CREATE TABLE users_contacts (id INTEGER NOT NULL, user INTEGER, contact INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(user) REFERENCES users (id), FOREIGN KEY(contact) REFERENCES users (id));
+CREATE TABLE history (id INTEGER NOT NULL, user INTEGER, sent INTEGER, accepted INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(user) REFERENCES users (id));
+'''
+
+
+class TestCaseSharedStorage(unittest.TestCase):
+    """
+    Тесты двух объектов базы сервера, работающих с одним файлом (как шарды сервера)
+    """
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаются два объекта базы на одном временном файле
+        """
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'server_base.db3')
+        self.first = ServerStorage(path)
+        self.second = ServerStorage(path)
+        self.first.add_user('Guest', b'hash')
+
+    def tearDown(self):
+        """
+        После теста базы закрываются, временный каталог удаляется
+        """
+        self.first.close()
+        self.second.close()
+        shutil.rmtree(self.directory)
+
+    def test_pubkey_changed_by_other_process(self):
+        """
+        Тест получения ключа, изменённого при входе пользователя через другой объект базы
+        """
+        self.assertEqual(self.second.get_hash('Guest'), b'hash')
+        self.first.login_user('Guest', '127.0.0.1', 7777, 'KEY-OLD')
+        self.assertEqual(self.first.get_pubkey('Guest'), 'KEY-OLD')
+        self.assertEqual(self.second.get_pubkey('Guest'), 'KEY-OLD')
+        self.first.logout_user('Guest')
+        self.first.login_user('Guest', '127.0.0.1', 7777, 'KEY-NEW')
+        self.assertEqual(self.first.get_pubkey('Guest'), 'KEY-NEW')
+        self.assertEqual(self.second.get_pubkey('Guest'), 'KEY-NEW')
+
+    def test_login_replaces_active_record(self):
+        """
+        Тест входа через другой объект базы до записи выхода из предыдущего подключения
+        """
+        self.first.login_user('Guest', '127.0.0.1', 7777, 'KEY-OLD')
+        self.first.get_pubkey('Guest')
+        self.second.login_user('Guest', '127.0.0.1', 7778, 'KEY-NEW')
+        self.assertEqual(self.second.get_pubkey('Guest'), 'KEY-NEW')
+        self.assertEqual(self.first.get_pubkey('Guest'), 'KEY-NEW')
+        self.assertEqual([row[2] for row in self.first.users_active()], [7778])
+
+    def test_unknown_user_pubkey(self):
+        """
+        Тест получения ключа незарегистрированного пользователя
+        """
+        self.assertIsNone(self.first.get_pubkey('Unknown'))
+
+
+class FakeWriter:
+    """
+    Класс потока записи, первая операция которого завершается ошибкой (например, база заблокирована)
+    """
+
+    def __init__(self):
+        self.failures = 1
+        self.written = []
+
+    def call(self, transaction, deltas):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('database is locked')
+        self.written.append({name: list(counters) for name, counters in deltas.items()})
+
+
+class TestCaseMessageCounters(unittest.TestCase):
+
+    def test_failed_flush_kept(self):
+        """
+        Тест повторной записи приращений после неудачной записи: поток записи продолжает работу
+        """
+        writer = FakeWriter()
+        counters = MessageCounters(writer, None, None, 10, 1)
+        counters.add('alice', 'bob')
+        deadline = time.monotonic() + 5
+        while writer.failures and time.monotonic() < deadline:
+            time.sleep(0.01)
+        counters.add('alice', 'carol')
+        counters.stop()
+        self.assertFalse(counters.thread.is_alive())
+        total = dict()
+        for deltas in writer.written:
+            for name, (sent, accepted) in deltas.items():
+                current = total.setdefault(name, [0, 0])
+                current[0] += sent
+                current[1] += accepted
+        self.assertEqual(total, {'alice': [2, 0], 'bob': [0, 1], 'carol': [0, 1]})
+
+
+class TestCaseOfflineMessages(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся база во временном каталоге с двумя пользователями
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server_base.db3')
+        self.database = ServerStorage(self.path, offline_ttl=3600, offline_quota=2)
+        self.database.add_user('alice', b'hash')
+        self.database.add_user('bob', b'hash')
+
+    def tearDown(self):
+        """
+        После теста база закрывается, временный каталог удаляется
+        """
+        self.database.close()
+        shutil.rmtree(self.directory)
+
+    def age_messages(self, seconds):
+        """
+        Метод переноса времени сохранения всех сообщений в прошлое
+        """
+        table = ServerStorage.OfflineMessages.__table__
+        with self.database.engine.begin() as connection:
+            for row_id, created in connection.execute(select(table.c.id, table.c.created)).all():
+                connection.execute(table.update().where(table.c.id == row_id).values(
+                    created=created - datetime.timedelta(seconds=seconds)))
+
+    def test_quota(self):
+        """
+        Тест квоты сообщений пользователя: сверх квоты сообщения не сохраняются,
+        после выдачи сохранённых сообщений квота освобождается
+        """
+        self.assertTrue(self.database.store_offline_message('alice', 'bob', {'text': 1}))
+        self.assertTrue(self.database.store_offline_message('alice', 'bob', {'text': 2}))
+        self.assertFalse(self.database.store_offline_message('alice', 'bob', {'text': 3}))
+        self.assertTrue(self.database.store_offline_message('bob', 'alice', {'text': 4}))
+        self.assertFalse(self.database.store_offline_message('alice', 'unknown', {'text': 5}))
+        self.assertEqual(self.database.pop_offline_messages('bob'), [{'text': 1}, {'text': 2}])
+        self.assertEqual(self.database.pop_offline_messages('bob'), [])
+        self.assertTrue(self.database.store_offline_message('alice', 'bob', {'text': 6}))
+
+    def test_expired_not_delivered(self):
+        """
+        Тест удаления без выдачи сообщений с истёкшим сроком хранения
+        """
+        self.database.store_offline_message('alice', 'bob', {'text': 'old'})
+        self.age_messages(7200)
+        self.database.store_offline_message('alice', 'bob', {'text': 'new'})
+        self.assertEqual(self.database.pop_offline_messages('bob'), [{'text': 'new'}])
+        self.assertEqual(self.database.pop_offline_messages('bob'), [])
+
+    def test_expired_removed_on_start(self):
+        """
+        Тест очистки сообщений с истёкшим сроком хранения при запуске сервера: они не занимают квоту
+        """
+        self.database.store_offline_message('alice', 'bob', {'text': 1})
+        self.database.store_offline_message('alice', 'bob', {'text': 2})
+        self.age_messages(7200)
+        self.database.close()
+        self.database = ServerStorage(self.path, offline_ttl=3600, offline_quota=2)
+        self.assertTrue(self.database.store_offline_message('alice', 'bob', {'text': 3}))
+        self.assertEqual(self.database.pop_offline_messages('bob'), [{'text': 3}])
+
+
+class TestCaseMigration(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся база со схемой первой версии сервера и повторяющимися контактами
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server_base.db3')
+        connection = sqlite3.connect(self.path)
+        connection.executescript(BASELINE_SCHEMA)
+        connection.executemany('INSERT INTO users (id, name, passwd_hash) VALUES (?, ?, ?)',
+                               [(1, 'alice', 'hash'), (2, 'bob', 'hash')])
+        connection.executemany('INSERT INTO users_contacts (user, contact) VALUES (?, ?)', [(1, 2), (1, 2), (2, 1)])
+        connection.commit()
+        connection.close()
+        self.database = None
+
+    def tearDown(self):
+        """
+        После теста база закрывается, временный каталог удаляется
+        """
+        if self.database is not None:
+            self.database.close()
+        shutil.rmtree(self.directory)
+
+    def test_migrate_baseline(self):
+        """
+        Тест обновления схемы базы первой версии: новые таблицы и индексы созданы,
+        повторяющиеся контакты удалены, записана текущая версия схемы
+        """
+        self.database = ServerStorage(self.path)
+        inspector = inspect(self.database.engine)
+        self.assertTrue({'offline_messages', 'room_members', 'schema_version'} <= set(inspector.get_table_names()))
+        indexes = {table: {index['name'] for index in inspector.get_indexes(table)}
+                   for table in ('users_contacts', 'login_history', 'history', 'room_members')}
+        self.assertEqual(indexes['users_contacts'], {'ix_users_contacts_user_contact', 'ix_users_contacts_contact'})
+        self.assertEqual(indexes['login_history'], {'ix_login_history_name_date_time'})
+        self.assertEqual(indexes['history'], {'ix_history_user'})
+        self.assertEqual(indexes['room_members'], {'ix_room_members_room_user', 'ix_room_members_user'})
+        version_table = ServerStorage.SchemaVersion.__table__
+        with self.database.engine.connect() as connection:
+            version = connection.execute(select(version_table.c.version)).scalar()
+        self.assertEqual(version, len(ServerStorage.MIGRATIONS))
+        self.assertEqual(self.database.get_contacts('alice'), ['bob'])
+        self.assertEqual(self.database.get_contacts('bob'), ['alice'])
+        self.database.add_contact('alice', 'bob')
+        self.assertEqual(self.database.get_contacts('alice'), ['bob'])
+
+    def test_migrate_once(self):
+        """
+        Тест повторного открытия обновлённой базы: миграции не выполняются повторно
+        """
+        ServerStorage(self.path).close()
+        self.database = ServerStorage(self.path)
+        version_table = ServerStorage.SchemaVersion.__table__
+        with self.database.engine.connect() as connection:
+            rows = connection.execute(select(version_table.c.version)).all()
+        self.assertEqual([row.version for row in rows], [len(ServerStorage.MIGRATIONS)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import binascii
+import time
+import unittest
+from socket import socket, socketpair, create_connection, SOL_SOCKET, SO_SNDBUF
+
+import common.variables as variables
+from common.crypto import InlineExecutor, hash_password, challenge_digest
+from common.utils import get_message, send_message, send_messages, set_framing
+from server.async_server_class import AsyncServer
+from server.connection_class import ClientConnection
+from server.selector_server_class import SelectorServer
+from server.server_class import Server, NewConnection
+
+
+def free_port():
+    """
+    Функция получения свободного порта
+    """
+    with socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerEnginesMixin:
+    """
+    Общие тесты движков сервера (класс движка задаётся в наследниках атрибутом ENGINE)
+    """
+
+    ENGINE = None
+    USER = 'Guest'
+    PASSWORD = 'password'
+
+    def setUp(self):
+        """
+        Перед каждым тестом запускается сервер с одним зарегистрированным пользователем
+        """
+        self.server = self.ENGINE(free_port(), '127.0.0.1', None, NewConnection(),
+                                  storage_options={'backend': 'memory'}, crypto=InlineExecutor())
+        self.server.daemon = True
+        self.passwd_hash = hash_password(self.USER, self.PASSWORD)
+        self.server.database.add_user(self.USER, self.passwd_hash)
+        self.server.start()
+        self.sockets = []
+
+    def tearDown(self):
+        """
+        После теста сервер останавливается, сокеты клиентов закрываются
+        """
+        self.server.stop()
+        self.server.join(variables.SHUTDOWN_TIMEOUT)
+        for sock in self.sockets:
+            sock.close()
+
+    def login(self, requests=()):
+        """
+        Метод подключения к серверу и авторизации пользователя, возвращает сокет клиента
+        :param requests: запросы, отправляемые одной записью с ответом на вызов (без ожидания авторизации)
+        """
+        sock = create_connection(('127.0.0.1', self.server.listen_port), timeout=5)
+        self.sockets.append(sock)
+        send_message(sock, {
+            variables.ACTION: variables.PRESENCE,
+            variables.TIME: time.time(),
+            variables.PORT: self.server.listen_port,
+            variables.USER: {variables.ACCOUNT_NAME: self.USER, variables.PUBLIC_KEY: 'KEY'},
+            variables.FRAMING: variables.FRAMING_LENGTH_PREFIX
+        })
+        answer = get_message(sock)
+        self.assertEqual(answer[variables.RESPONSE], 511)
+        self.assertEqual(answer[variables.FRAMING], variables.FRAMING_LENGTH_PREFIX)
+        set_framing(sock)
+        digest = challenge_digest(self.passwd_hash, answer[variables.DATA].encode('ascii'))
+        send_messages(sock, [{variables.RESPONSE: 511, variables.DATA: binascii.b2a_base64(digest).decode('ascii')}] +
+                      list(requests))
+        self.assertEqual(get_message(sock)[variables.RESPONSE], 200)
+        return sock
+
+    def test_stop_with_connected_client(self):
+        """
+        Тест остановки сервера с подключённым клиентом: сервер завершается, соединение закрывается
+        """
+        sock = self.login()
+        self.server.stop()
+        self.server.join(variables.SHUTDOWN_TIMEOUT * 2)
+        self.assertFalse(self.server.is_alive())
+        self.assertEqual(sock.recv(variables.MAX_PACKAGE_LENGTH), b'')
+
+
+    def test_request_pipelined_with_answer(self):
+        """
+        Тест запроса, отправленного одной записью с ответом на вызов: выполняется после авторизации
+        """
+        sock = self.login([{variables.ACTION: variables.USERS_REQUEST, variables.TIME: 1.1,
+                            variables.ACCOUNT_NAME: self.USER}])
+        answer = get_message(sock)
+        self.assertEqual(answer[variables.RESPONSE], 202)
+        self.assertEqual(answer[variables.LIST_INFO], [self.USER])
+
+
+class TestCaseServer(ServerEnginesMixin, unittest.TestCase):
+    ENGINE = Server
+
+
+class TestCaseSelectorServer(ServerEnginesMixin, unittest.TestCase):
+    ENGINE = SelectorServer
+
+
+class TestCaseAsyncServer(ServerEnginesMixin, unittest.TestCase):
+    ENGINE = AsyncServer
+
+
+class FakeSender:
+    """
+    Класс соединения отправителя, чтение от которого приостановлено
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.paused = True
+
+
+class TestCaseThreadEngineBackpressure(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся (без запуска) сервер и соединение получателя с маленьким буфером сокета
+        """
+        self.server = Server(free_port(), '127.0.0.1', None, NewConnection(),
+                             storage_options={'backend': 'memory'}, crypto=InlineExecutor())
+        server_sock, self.client_sock = socketpair()
+        server_sock.setsockopt(SOL_SOCKET, SO_SNDBUF, 4096)
+        server_sock.setblocking(False)
+        self.client_sock.settimeout(5)
+        self.recipient = ClientConnection(server_sock, high_watermark=64 * 1024, low_watermark=16 * 1024)
+
+    def tearDown(self):
+        """
+        После теста сокеты закрываются
+        """
+        self.recipient.close()
+        self.client_sock.close()
+        self.server.transport.close()
+
+    def test_drained_by_send_releases_senders(self):
+        """
+        Тест возобновления чтения от отправителя, когда очередь получателя освободилась
+        при отправке очередного сообщения (а не по готовности сокета к записи)
+        """
+        self.server.send_to_client(self.recipient, {variables.MESSAGE_TEXT: 'x' * 200 * 1024})
+        self.assertTrue(self.recipient.is_congested)
+        sender = FakeSender()
+        self.recipient.waiting_senders.add(sender)
+        while self.recipient.has_pending_output:
+            self.client_sock.recv(variables.MAX_PACKAGE_LENGTH)
+            self.recipient.flush()
+        self.assertTrue(sender.paused)
+        self.server.send_to_client(self.recipient, {variables.MESSAGE_TEXT: 'y'})
+        self.assertFalse(sender.paused)
+        self.assertEqual(self.recipient.waiting_senders, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+import unittest
+
+import common.variables as variables
+from common.utils import MessageBuffer
+from server.shard_class import ShardLink
+
+
+class FakeSocket:
+    """
+    Класс сокета, принимающего ограниченное количество байт, после чего запись завершается ошибкой
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = b''
+
+    def send(self, data):
+        if not self.limit:
+            raise BrokenPipeError
+        chunk = bytes(data[:min(self.limit, 100)])
+        self.limit -= len(chunk)
+        self.data += chunk
+        return len(chunk)
+
+
+class TestCaseShardLink(unittest.TestCase):
+
+    MESSAGES = [{variables.ACTION: variables.SHARD_ROUTE, variables.DATA: str(number) * 40} for number in range(5)]
+
+    def setUp(self):
+        """
+        Перед каждым тестом создаётся соединение с недоступным шардом
+        """
+        self.link = ShardLink(os.path.join(tempfile.mkdtemp(), 'missing.sock'))
+
+    def tearDown(self):
+        """
+        После теста поток отправки завершается
+        """
+        self.link.close()
+
+    def test_partial_send(self):
+        """
+        Тест удаления из пачки сообщений, полностью переданных сокету до ошибки записи
+        """
+        sock = FakeSocket(150)
+        batch = list(self.MESSAGES)
+        self.assertRaises(BrokenPipeError, ShardLink.send_batch, sock, batch)
+        buffer = MessageBuffer(framed=True)
+        buffer.feed(sock.data)
+        delivered = list(iter(buffer.next_message, None))
+        self.assertEqual(delivered + batch, self.MESSAGES)
+        self.assertTrue(delivered)
+
+    def test_close_unreachable(self):
+        """
+        Тест остановки без ожидания недоступного шарда
+        """
+        self.link.send({variables.ACTION: variables.SHARD_ROUTE})
+        time.sleep(variables.BUS_RECONNECT_INTERVAL * 2)
+        started = time.monotonic()
+        self.link.close()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(self.link.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
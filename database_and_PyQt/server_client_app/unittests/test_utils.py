@@ -0,0 +1,152 @@
+import json
+import unittest
+
+import common.custom_exceptions as custom_exceptions
+import common.variables as variables
+from common.utils import MessageBuffer, PreparedMessage, encode_message, decode_message, FRAME_HEADER
+from common.wire_codecs import CODECS
+
+
+TEST_MESSAGE = {
+    variables.ACTION: variables.PRESENCE,
+    variables.TIME: 1500.25,
+    variables.PORT: variables.DEFAULT_PORT,
+    variables.USER: {
+        variables.ACCOUNT_NAME: 'Гость'
+    },
+    'flag': True,
+    'empty': None,
+    'negative': -1.5e-3,
+    'text': 'a"b\\c',
+}
+
+
+class TestCaseMessageBuffer(unittest.TestCase):
+
+    def test_framed_split_at_every_byte(self):
+        """
+        Тест сборки сообщения в кадровом режиме, разрезанного в любой точке
+        """
+        data = encode_message(TEST_MESSAGE, framed=True)
+        for split in range(1, len(data)):
+            buffer = MessageBuffer(framed=True)
+            buffer.feed(data[:split])
+            self.assertIsNone(buffer.next_message())
+            buffer.feed(data[split:])
+            self.assertEqual(buffer.next_message(), TEST_MESSAGE)
+            self.assertIsNone(buffer.next_message())
+
+    def test_framed_several_messages(self):
+        """
+        Тест извлечения нескольких сообщений, принятых одной порцией в кадровом режиме
+        """
+        buffer = MessageBuffer(framed=True)
+        buffer.feed(encode_message({variables.RESPONSE: 200}, True) + encode_message(TEST_MESSAGE, True))
+        self.assertEqual(buffer.next_message(), {variables.RESPONSE: 200})
+        self.assertEqual(buffer.next_message(), TEST_MESSAGE)
+        self.assertIsNone(buffer.next_message())
+
+    def test_framed_too_long(self):
+        """
+        Тест отказа в приёме кадра длиннее допустимого
+        """
+        buffer = MessageBuffer(framed=True)
+        buffer.feed(FRAME_HEADER.pack(variables.MAX_FRAME_LENGTH + 1))
+        self.assertRaises(custom_exceptions.IncorrectData, buffer.next_message)
+
+    def test_legacy_split_at_every_byte(self):
+        """
+        Тест сборки сообщения в старом режиме, разрезанного в любой точке
+        (в том числе внутри числа, литерала, escape-последовательности и символа UTF-8)
+        """
+        for ensure_ascii in (True, False):
+            data = json.dumps(TEST_MESSAGE, ensure_ascii=ensure_ascii).encode(variables.ENCODING)
+            for split in range(1, len(data)):
+                with self.subTest(ensure_ascii=ensure_ascii, tail=data[:split][-8:]):
+                    buffer = MessageBuffer()
+                    buffer.feed(data[:split])
+                    self.assertIsNone(buffer.next_message())
+                    buffer.feed(data[split:])
+                    self.assertEqual(buffer.next_message(), TEST_MESSAGE)
+
+    def test_legacy_several_messages(self):
+        """
+        Тест извлечения нескольких сообщений, идущих подряд в старом режиме
+        """
+        buffer = MessageBuffer()
+        buffer.feed(encode_message(TEST_MESSAGE) + b' ' + encode_message({variables.RESPONSE: 200}))
+        self.assertEqual(buffer.next_message(), TEST_MESSAGE)
+        self.assertEqual(buffer.next_message(), {variables.RESPONSE: 200})
+        self.assertIsNone(buffer.next_message())
+
+    def test_legacy_malformed(self):
+        """
+        Тест отказа в приёме некорректных данных в старом режиме
+        """
+        buffer = MessageBuffer()
+        buffer.feed(b'{"a": tru, "b": 1}')
+        self.assertRaises(json.JSONDecodeError, buffer.next_message)
+        buffer = MessageBuffer()
+        buffer.feed(b'[1, 2]')
+        self.assertRaises(custom_exceptions.IncorrectData, buffer.next_message)
+
+
+@unittest.skipIf(variables.CODEC_MSGPACK not in CODECS, 'Не установлен msgpack')
+class TestCaseMsgpack(unittest.TestCase):
+
+    def test_round_trip(self):
+        """
+        Тест передачи сообщений кодеком MessagePack в кадровом режиме (байты передаются без преобразования)
+        """
+        codec = CODECS[variables.CODEC_MSGPACK]
+        message = dict(TEST_MESSAGE, data=b'\x00\xff')
+        buffer = MessageBuffer(framed=True, codec=codec)
+        buffer.feed(encode_message(message, True, codec) + encode_message({variables.RESPONSE: 200}, True, codec))
+        self.assertEqual(buffer.next_message(), message)
+        self.assertEqual(buffer.next_message(), {variables.RESPONSE: 200})
+        self.assertIsNone(buffer.next_message())
+
+    def test_malformed(self):
+        """
+        Тест отказа в приёме некорректных данных кодеком MessagePack
+        """
+        codec = CODECS[variables.CODEC_MSGPACK]
+        buffer = MessageBuffer(framed=True, codec=codec)
+        buffer.feed(FRAME_HEADER.pack(2) + b'\xc1\x00')
+        self.assertRaises(custom_exceptions.IncorrectData, buffer.next_message)
+
+
+class TestCasePreparedMessage(unittest.TestCase):
+
+    def test_with_field(self):
+        """
+        Тест добавления поля к закодированному сообщению всеми кодеками, в обоих режимах,
+        для пустого сообщения и сообщений с разными заголовками словаря MessagePack
+        """
+        messages = [{}, TEST_MESSAGE] + [{f'field{number}': number for number in range(size)} for size in (15, 20)]
+        for codec in CODECS.values():
+            for message in messages:
+                prepared = PreparedMessage(message)
+                extended = prepared.with_field(variables.REQUEST_ID, 7)
+                expected = dict(message, request_id=7)
+                self.assertEqual(dict(extended), expected)
+                self.assertEqual(decode_message(extended.encode(False, codec), codec), expected)
+                buffer = MessageBuffer(framed=True, codec=codec)
+                buffer.feed(extended.encode(True, codec))
+                self.assertEqual(buffer.next_message(), expected)
+                self.assertIn((False, codec.name), prepared.frames)
+
+    def test_with_existing_field(self):
+        """
+        Тест замены поля, которое уже есть в сообщении: сообщение кодируется полностью
+        """
+        prepared = PreparedMessage({variables.RESPONSE: 200, variables.REQUEST_ID: 1})
+        extended = prepared.with_field(variables.REQUEST_ID, 2)
+        for codec in CODECS.values():
+            self.assertEqual(decode_message(extended.encode(False, codec), codec),
+                             {variables.RESPONSE: 200, variables.REQUEST_ID: 2})
+        self.assertEqual(prepared[variables.REQUEST_ID], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()